@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Access log defaults
+ACCESS_LOG_QUEUE_SIZE = 10000      # Records waiting for the writer; more are dropped and counted
+ACCESS_LOG_BATCH_SIZE = 256        # Records written per write() call at most
+ACCESS_LOG_FORMATS = ('common', 'json')
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+# One served request. The request path only fills these fields in; formatting
+# and I/O happen on the writer thread.
+class AccessRecord:
+    __slots__ = ('client', 'timestamp', 'method', 'target', 'version', 'status', 'bytes_sent', 'duration')
+
+    def __init__(self, client, method, target, version, status, bytes_sent, duration):
+        self.client = client
+        self.timestamp = time.time()
+        self.method = method
+        self.target = target
+        self.version = version
+        self.status = status
+        self.bytes_sent = bytes_sent
+        self.duration = duration       # Seconds from the complete request head to the last byte sent
+
+# Function to format a record in the Common Log Format (as Apache's "common"),
+# with the duration in microseconds appended as Apache's %D would add it
+def format_common(record):
+    timestamp = time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(record.timestamp))
+    request_line = f"{record.method} {record.target} {record.version}" if record.method else '-'
+    size = record.bytes_sent if record.bytes_sent else '-'
+    return (f'{record.client} - - [{timestamp}] "{request_line}" {record.status} {size} '
+            f'{int(record.duration * 1000000)}')
+
+# Function to format a record as one JSON object per line
+def format_json(record):
+    return json.dumps({
+        'client': record.client,
+        'time': round(record.timestamp, 3),
+        'method': record.method,
+        'target': record.target,
+        'version': record.version,
+        'status': record.status,
+        'bytes': record.bytes_sent,
+        'duration_ms': round(record.duration * 1000, 3),
+    })
+
+# Background access logger. log() only puts the record on a bounded queue and
+# never waits: when the queue is full the record is dropped and counted, so a
+# slow disk or terminal can't stall request handling. A writer thread formats
+# queued records and writes them in batches, one write() and flush per batch.
+# A file gets each batch in a single append, so worker processes sharing one
+# file don't interleave within a line.
+class AccessLogger:
+    def __init__(self, path='-', log_format='common', queue_size=ACCESS_LOG_QUEUE_SIZE,
+                 batch_size=ACCESS_LOG_BATCH_SIZE):
+        if log_format not in ACCESS_LOG_FORMATS:
+            raise ValueError(f"Unknown access log format: {log_format}")
+        self.format = format_json if log_format == 'json' else format_common
+        # A file is written through an O_APPEND descriptor, one os.write() per batch
+        self.fd = None if path == '-' else os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Function to queue a record for writing; safe from any thread or the event loop
+    def log(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    # Writer thread: wait for a record, then take whatever else has queued up
+    # meanwhile (up to batch_size) and write it all at once. The busier the
+    # server, the larger the batches.
+    def run(self):
+        stopping = False
+        while not stopping:
+            record = self.queue.get()
+            batch = []
+            while True:
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception as e:
+                lines.append(f"Unformattable access log record: {e}")
+        data = "\n".join(lines) + "\n"
+        try:
+            if self.fd is None:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            else:
+                os.write(self.fd, data.encode('utf-8'))
+        except (OSError, ValueError):
+            with self.lock:
+                self.dropped += len(batch)
+            return
+        with self.lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    # Function to write what is still queued and stop the writer thread
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+
+    # Function to report the logger counters
+    def stats(self):
+        with self.lock:
+            return {
+                'written': self.written,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'queued': self.queue.qsize(),
+            }
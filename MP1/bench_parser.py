@@ -0,0 +1,85 @@
+# Micro-benchmark: the original recv(1024)/splitlines() request parsing versus
+# http_parser.HttpParser.
+#
+#   python3 bench_parser.py [iterations]
+#
+# The original parser is only given requests that fit in one recv(1024); the
+# table shows "truncated" where it would have cut the request off.
+
+import sys
+import timeit
+
+from http_parser import HttpParser
+
+SIMPLE_REQUEST = (b"GET /test.html HTTP/1.1\r\n"
+                  b"Host: localhost:8080\r\n"
+                  b"User-Agent: curl/8.4.0\r\n"
+                  b"Accept: */*\r\n\r\n")
+
+COOKIE_REQUEST = (b"GET /test.html HTTP/1.1\r\n"
+                  b"Host: localhost:8080\r\n"
+                  b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/131.0\r\n"
+                  b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+                  b"Accept-Encoding: gzip, deflate\r\n"
+                  b"Cookie: " + b"; ".join(b"session%d=%s" % (i, b"x" * 40) for i in range(80)) + b"\r\n"
+                  b"If-None-Match: \"618df557522ea1f27b37926e\"\r\n\r\n")
+
+PIPELINE_DEPTH = 50
+
+# The request parsing web_server.handle_request used to do
+def legacy_parse(raw):
+    request = raw[:1024].decode('utf-8')
+    request_lines = request.splitlines()
+    method, path, version = request_lines[0].split()
+    headers = {}
+    for line in request_lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip()] = value.strip()
+    return method, path, version, headers
+
+def parse_whole(raw):
+    parser = HttpParser()
+    parser.feed(raw)
+    return parser.next_message()
+
+def parse_pipelined(raw):
+    parser = HttpParser()
+    parser.feed(raw)
+    count = 0
+    while parser.next_message() is not None:
+        count += 1
+    return count
+
+def parse_fragments(raw, fragment_size=64):
+    parser = HttpParser()
+    for i in range(0, len(raw), fragment_size):
+        parser.feed(raw[i:i + fragment_size])
+        request = parser.next_message()
+    return request
+
+def time_per_call(function, argument, iterations):
+    seconds = min(timeit.repeat(lambda: function(argument), number=iterations, repeat=3))
+    return seconds / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{'case':<34}{'bytes':>8}{'legacy us/req':>16}{'HttpParser us/req':>20}")
+    for name, raw in (("simple GET", SIMPLE_REQUEST), ("cookie-heavy GET", COOKIE_REQUEST)):
+        legacy = "truncated" if len(raw) > 1024 else f"{time_per_call(legacy_parse, raw, iterations):.2f}"
+        new = time_per_call(parse_whole, raw, iterations)
+        print(f"{name:<34}{len(raw):>8}{legacy:>16}{new:>20.2f}")
+
+    pipelined = SIMPLE_REQUEST * PIPELINE_DEPTH
+    legacy = "n/a (1st only)"
+    new = time_per_call(parse_pipelined, pipelined, iterations // PIPELINE_DEPTH) / PIPELINE_DEPTH
+    print(f"{f'{PIPELINE_DEPTH} pipelined simple GETs':<34}{len(pipelined):>8}{legacy:>16}{new:>20.2f}")
+
+    for name, raw in (("simple GET, 64-byte fragments", SIMPLE_REQUEST),
+                      ("cookie GET, 64-byte fragments", COOKIE_REQUEST)):
+        new = time_per_call(parse_fragments, raw, iterations)
+        print(f"{name:<34}{len(raw):>8}{'misparsed':>16}{new:>20.2f}")
+
+if __name__ == "__main__":
+    main()
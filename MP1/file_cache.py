@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+# Cache defaults
+CACHE_MAX_BYTES = 64 * 1024 * 1024     # Total size of cached file contents
+CACHE_MAX_FILE_SIZE = 1024 * 1024      # Larger files keep only their metadata cached
+CACHE_MAX_ENTRIES = 10000
+CACHE_REVALIDATE_INTERVAL = 1.0        # Seconds before an entry is re-checked with os.stat()
+
+# Compression defaults
+COMPRESS_MIN_SIZE = 1024               # Smaller files are always sent uncompressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+
+# A compressed copy of a cached file's contents for one Content-Encoding
+class CompressedVariant:
+    def __init__(self, content, etag):
+        self.path = None
+        self.content = content
+        self.size = len(content)
+        self.etag = etag
+
+# One version of a file: its contents (if small enough) and the headers that
+# describe it, computed once when the version is first seen
+class CachedFile:
+    def __init__(self, path, stat_result, content):
+        self.path = path
+        self.inode = stat_result.st_ino
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.content = content   # bytes, or None when the file is served from disk
+        self.validated_at = time.monotonic()
+
+        # Precomputed header values. HTTP dates have one-second resolution, so the
+        # modification time is truncated to whole seconds for If-Modified-Since checks
+        self.modified_time = datetime.fromtimestamp(int(stat_result.st_mtime), timezone.utc)
+        self.last_modified = formatdate(int(stat_result.st_mtime), usegmt=True)
+
+        # Strong ETag from the bytes when we have them; files served from disk get a
+        # weak ETag from their stat fields instead of being hashed on every change
+        if content is not None:
+            self.etag = '"' + hashlib.blake2b(content, digest_size=12).hexdigest() + '"'
+        else:
+            self.etag = f'W/"{self.inode:x}-{self.size:x}-{self.mtime_ns:x}"'
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.headers = (f"Content-Type: {self.content_type}\r\n"
+                        f"Last-Modified: {self.last_modified}\r\n")
+
+        # Compressed representations of this version, filled in on first use
+        self.compressible = self.content_type.startswith(COMPRESSIBLE_TYPES)
+        self.variants = {}
+        self.sibling = None              # Up-to-date "<path>.gz" file, if any
+        self.sibling_checked_at = None
+
+    # Bytes this entry holds in memory
+    def cost(self):
+        cost = len(self.content) if self.content is not None else 0
+        for variant in self.variants.values():
+            if variant is not None:
+                cost += variant.size
+        return cost
+
+    # True if the stat result still describes this version of the file
+    def matches(self, stat_result):
+        return (stat_result.st_ino == self.inode
+                and stat_result.st_mtime_ns == self.mtime_ns
+                and stat_result.st_size == self.size)
+
+# Bounded LRU cache of static files, limited by the total bytes of cached content.
+# Entries are trusted for revalidate_interval seconds; after that the next lookup
+# re-stats the file and reloads it if its inode, mtime or size changed.
+class FileCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_file_size=CACHE_MAX_FILE_SIZE,
+                 revalidate_interval=CACHE_REVALIDATE_INTERVAL, max_entries=CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Function to return the CachedFile for a path, or None if it is not a regular file
+    def lookup(self, path):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and now - entry.validated_at < self.revalidate_interval:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry
+
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            self.remove(path)
+            return None
+
+        if entry is not None and entry.matches(stat_result):
+            with self.lock:
+                entry.validated_at = now
+                if path in self.entries:
+                    self.entries.move_to_end(path)
+                self.hits += 1
+            return entry
+
+        entry = self.load(path)
+        with self.lock:
+            self.misses += 1
+            if entry is not None:
+                self.store(entry)
+        return entry
+
+    # Function to read a file and its metadata from disk
+    def load(self, path):
+        try:
+            with open(path, 'rb') as file:
+                # fstat the open file so the contents and metadata belong to the same version
+                stat_result = os.fstat(file.fileno())
+                content = None
+                if stat_result.st_size <= self.max_file_size and stat_result.st_size <= self.max_bytes:
+                    content = file.read()
+        except OSError:
+            return None
+        return CachedFile(path, stat_result, content)
+
+    # Function to insert an entry and evict least recently used ones over the limits
+    # (caller holds the lock)
+    def store(self, entry):
+        old_entry = self.entries.pop(entry.path, None)
+        if old_entry is not None:
+            self.current_bytes -= old_entry.cost()
+
+        self.entries[entry.path] = entry
+        self.current_bytes += entry.cost()
+        self.evict()
+
+    # Function to evict least recently used entries until the cache fits its limits
+    # (caller holds the lock)
+    def evict(self):
+        while self.current_bytes > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted.cost()
+            self.evictions += 1
+
+    # Function to return the representation of an entry to send for a Content-Encoding:
+    # an up-to-date precompressed "<path>.gz" file on disk for gzip, otherwise a
+    # compressed copy of the cached contents made once per file version. Returns
+    # None when the file should be sent uncompressed.
+    def compressed(self, entry, encoding, min_size=COMPRESS_MIN_SIZE):
+        if not entry.compressible or entry.size < min_size:
+            return None
+
+        if encoding == 'gzip':
+            sibling = self.precompressed_sibling(entry)
+            if sibling is not None:
+                return sibling
+
+        if entry.content is None:
+            return None
+
+        with self.lock:
+            if encoding in entry.variants:
+                return entry.variants[encoding]
+
+        if encoding == 'gzip':
+            content = gzip.compress(entry.content, mtime=0)
+        else:
+            content = zlib.compress(entry.content)
+
+        # Remember a None result too, so incompressible files are only tried once
+        variant = None
+        if len(content) < entry.size:
+            variant = CompressedVariant(content, compressed_etag(entry.etag, encoding))
+
+        with self.lock:
+            if encoding not in entry.variants:
+                entry.variants[encoding] = variant
+                if variant is not None and self.entries.get(entry.path) is entry:
+                    self.current_bytes += variant.size
+                    self.evict()
+            return entry.variants[encoding]
+
+    # Function to find a "<path>.gz" file at least as new as the entry; the result is
+    # re-checked at the same interval as the entry itself
+    def precompressed_sibling(self, entry):
+        now = time.monotonic()
+        if entry.sibling_checked_at is None or now - entry.sibling_checked_at >= self.revalidate_interval:
+            sibling = self.lookup(entry.path + '.gz')
+            if sibling is not None and sibling.mtime_ns < entry.mtime_ns:
+                sibling = None
+            entry.sibling = sibling
+            entry.sibling_checked_at = now
+        return entry.sibling
+
+    # Function to drop a path from the cache
+    def remove(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.current_bytes -= entry.cost()
+
+    # Function to report the cache counters
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+            }
+
+# Function to derive the ETag of a compressed representation; it must differ from
+# the identity ETag because the bytes differ
+def compressed_etag(etag, encoding):
+    return etag[:-1] + '-' + encoding + '"'
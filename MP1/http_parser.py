@@ -0,0 +1,312 @@
+import re
+
+# Parser limits
+MAX_HEADER_SIZE = 16384       # Request/status line plus headers
+MAX_HEADER_COUNT = 100
+MAX_CHUNK_LINE_SIZE = 1024    # Chunk-size line including extensions
+
+# Returned by HttpParser.next_event() once a message's body is complete
+END_OF_MESSAGE = object()
+
+HTTP_VERSION = re.compile(r'HTTP/\d\.\d\Z')
+HEADER_NAME = re.compile(r"[!#$%&'*+\-.^_`|~0-9A-Za-z]+\Z")
+REQUEST_LINE = re.compile(r'(\S+)[ \t]+(\S+)[ \t]+(HTTP/\d\.\d)[ \t]*\Z')
+DIGITS = re.compile(r'[0-9]+\Z')              # str.isdigit() would also take '²', which int() rejects
+CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]+\Z')   # int(x, 16) alone would also take '-5', '+5', '0x5', '5_0'
+
+# Raised for malformed or oversized messages; status_code is the response a
+# server should send before closing the connection
+class HttpParseError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Fields shared by requests and responses
+class HttpMessage:
+    def __init__(self, version, header_list, raw_head):
+        self.version = version
+        self.header_list = header_list   # [(name, value)] in the order received
+        self.raw_head = raw_head         # Start line and headers as received
+        self.headers = {}                # Lower-case name -> value (repeats joined with ", ")
+        for name, value in header_list:
+            key = name.lower()
+            if key in self.headers:
+                self.headers[key] += ", " + value
+            else:
+                self.headers[key] = value
+        self.body = b''
+
+    def get_header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    # True if the Connection header lists the given token (e.g. "close")
+    def has_connection_token(self, token):
+        connection = self.headers.get('connection', '')
+        return token in [item.strip().lower() for item in connection.split(',')]
+
+class HttpRequest(HttpMessage):
+    def __init__(self, method, target, version, header_list, raw_head):
+        super().__init__(version, header_list, raw_head)
+        self.method = method
+        self.target = target
+
+class HttpResponse(HttpMessage):
+    def __init__(self, version, status_code, reason, header_list, raw_head):
+        super().__init__(version, header_list, raw_head)
+        self.status_code = status_code
+        self.reason = reason
+
+# Incremental HTTP/1.x parser. It does no I/O: bytes are fed in as they arrive
+# and complete pieces are pulled out, so the same parser works for blocking
+# sockets, the event loop, and any split of the message across recv() calls.
+#
+# Received bytes live in one bytearray that is consumed from the front. The
+# head is located with a single find() that resumes where the previous search
+# stopped, so a slowly arriving head is not rescanned from the start.
+class HttpParser:
+    def __init__(self, is_response=False, max_header_size=MAX_HEADER_SIZE, max_body_size=None):
+        self.is_response = is_response
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray()
+        self.eof = False
+        self.request_method = None   # For responses: the method of the matching request
+        self.reset()
+
+    # Function to prepare for the next message on the connection
+    def reset(self):
+        self.state = 'head'
+        self.scan_from = 0
+        self.remaining = 0
+        self.body_received = 0
+        self.message = None
+        self.body_buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    # Function to signal that the peer closed its side of the connection
+    def feed_eof(self):
+        self.eof = True
+
+    # True while a message has been started but not finished
+    def in_progress(self):
+        return self.state != 'head' or len(self.buffer) > 0
+
+    # Function to return the next parse event:
+    #   HttpRequest/HttpResponse - the message head
+    #   bytes                    - a piece of the (de-chunked) body
+    #   END_OF_MESSAGE           - the body is complete
+    #   None                     - more data is needed
+    def next_event(self):
+        if self.state == 'head':
+            return self.parse_head()
+        if self.state == 'body':
+            return self.parse_fixed_body()
+        if self.state == 'until-close':
+            return self.parse_until_close()
+        if self.state in ('chunk-size', 'chunk-data', 'chunk-end', 'trailers'):
+            return self.parse_chunked()
+        # state == 'done': the body is complete, get ready for the next message
+        self.reset()
+        return END_OF_MESSAGE
+
+    # Function to return the next complete message with its body collected in
+    # message.body, or None if it has not fully arrived yet
+    def next_message(self):
+        while True:
+            message = self.message
+            body = self.body_buffer
+            event = self.next_event()
+            if event is None:
+                return None
+            if event is END_OF_MESSAGE:
+                message.body = bytes(body)
+                return message
+            if isinstance(event, HttpMessage):
+                # Most requests have no body: finish them without another pass
+                if self.state == 'done':
+                    self.reset()
+                    return event
+            else:
+                self.body_buffer += event
+
+    def parse_head(self):
+        # Ignore empty lines in front of a message (RFC 9112, section 2.2)
+        while self.buffer[:2] == b'\r\n':
+            del self.buffer[:2]
+
+        head_end = self.buffer.find(b'\r\n\r\n', self.scan_from)
+        if head_end == -1:
+            if len(self.buffer) > self.max_header_size:
+                raise HttpParseError("Header section too large", 502 if self.is_response else 431)
+            if self.eof and self.buffer:
+                raise HttpParseError("Connection closed mid-header", 502 if self.is_response else 400)
+            self.scan_from = max(0, len(self.buffer) - 3)
+            return None
+        if head_end > self.max_header_size:
+            raise HttpParseError("Header section too large", 502 if self.is_response else 431)
+
+        # Header bytes are decoded once; ISO-8859-1 maps every byte, so it never fails
+        raw_head = self.buffer[:head_end].decode('iso-8859-1')
+        del self.buffer[:head_end + 4]
+        self.scan_from = 0
+
+        # One split in C; no per-line decoding or re-scanning of the buffer
+        lines = raw_head.split('\r\n')
+        if len(lines) - 1 > MAX_HEADER_COUNT:
+            raise HttpParseError("Too many header fields", 502 if self.is_response else 431)
+
+        header_list = []
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+            # No whitespace before the colon and no obsolete line folding (RFC 9112, section 5)
+            if not colon or not HEADER_NAME.match(name):
+                raise HttpParseError(f"Malformed header line: {line!r}", 502 if self.is_response else 400)
+            header_list.append((name, value.strip(' \t')))
+        start_line = lines[0]
+
+        if self.is_response:
+            self.message = self.parse_status_line(start_line, header_list, raw_head)
+        else:
+            self.message = self.parse_request_line(start_line, header_list, raw_head)
+
+        self.start_body()
+        return self.message
+
+    def parse_request_line(self, line, header_list, raw_head):
+        match = REQUEST_LINE.match(line.lstrip())
+        if match is None:
+            raise HttpParseError(f"Malformed request line: {line!r}")
+        method, target, version = match.groups()
+        return HttpRequest(method, target, version, header_list, raw_head)
+
+    def parse_status_line(self, line, header_list, raw_head):
+        version, _, rest = line.partition(' ')
+        status, _, reason = rest.partition(' ')
+        if not HTTP_VERSION.match(version) or len(status) != 3 or not DIGITS.match(status):
+            raise HttpParseError(f"Malformed status line: {line!r}", 502)
+        return HttpResponse(version, int(status), reason, header_list, raw_head)
+
+    # Function to work out how the body of the current message is framed
+    # (RFC 9112, section 6.3)
+    def start_body(self):
+        message = self.message
+        error_status = 502 if self.is_response else 400
+
+        if self.is_response:
+            if (self.request_method == 'HEAD' or 100 <= message.status_code < 200
+                    or message.status_code in (204, 304)):
+                self.state = 'done'
+                return
+
+        transfer_encoding = message.get_header('transfer-encoding')
+        if transfer_encoding is not None:
+            codings = [coding.strip().lower() for coding in transfer_encoding.split(',')]
+            if codings[-1] != 'chunked':
+                if self.is_response:
+                    self.state = 'until-close'
+                    return
+                raise HttpParseError("Unsupported transfer coding", 501)
+            self.state = 'chunk-size'
+            return
+
+        content_length = message.get_header('content-length')
+        if content_length is not None:
+            # Repeated Content-Length headers must agree
+            values = {value.strip() for value in content_length.split(',')}
+            if len(values) != 1 or not DIGITS.match(next(iter(values))):
+                raise HttpParseError("Invalid Content-Length", error_status)
+            self.remaining = int(values.pop())
+            self.check_body_size(self.remaining)
+            self.state = 'body' if self.remaining > 0 else 'done'
+            return
+
+        # Requests without framing headers have no body; responses run until close
+        self.state = 'until-close' if self.is_response else 'done'
+
+    def check_body_size(self, size):
+        if self.max_body_size is not None and size > self.max_body_size:
+            raise HttpParseError("Body too large", 502 if self.is_response else 413)
+
+    # Function to remove and return up to count bytes from the front of the buffer
+    def take(self, count):
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def parse_fixed_body(self):
+        if not self.buffer:
+            if self.eof:
+                raise HttpParseError("Connection closed mid-body", 502 if self.is_response else 400)
+            return None
+        data = self.take(min(self.remaining, len(self.buffer)))
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            self.state = 'done'
+        return data
+
+    def parse_until_close(self):
+        if self.buffer:
+            self.body_received += len(self.buffer)
+            self.check_body_size(self.body_received)
+            return self.take(len(self.buffer))
+        if self.eof:
+            self.reset()
+            return END_OF_MESSAGE
+        return None
+
+    def parse_chunked(self):
+        error_status = 502 if self.is_response else 400
+        while True:
+            if self.state == 'chunk-size':
+                line_end = self.buffer.find(b'\r\n')
+                if line_end == -1:
+                    if len(self.buffer) > MAX_CHUNK_LINE_SIZE:
+                        raise HttpParseError("Chunk size line too long", error_status)
+                    return self.need_more_data()
+                size_field = bytes(self.buffer[:line_end]).split(b';', 1)[0].strip()
+                del self.buffer[:line_end + 2]
+                if not CHUNK_SIZE.match(size_field):
+                    raise HttpParseError("Invalid chunk size", error_status)
+                self.remaining = int(size_field, 16)
+                if self.remaining == 0:
+                    self.state = 'trailers'
+                    continue
+                self.body_received += self.remaining
+                self.check_body_size(self.body_received)
+                self.state = 'chunk-data'
+
+            elif self.state == 'chunk-data':
+                if not self.buffer:
+                    return self.need_more_data()
+                data = self.take(min(self.remaining, len(self.buffer)))
+                self.remaining -= len(data)
+                if self.remaining == 0:
+                    self.state = 'chunk-end'
+                return data
+
+            elif self.state == 'chunk-end':
+                if len(self.buffer) < 2:
+                    return self.need_more_data()
+                if self.buffer[:2] != b'\r\n':
+                    raise HttpParseError("Missing CRLF after chunk", error_status)
+                del self.buffer[:2]
+                self.state = 'chunk-size'
+
+            elif self.state == 'trailers':
+                # Trailer fields are read and discarded, up to the empty line
+                line_end = self.buffer.find(b'\r\n')
+                if line_end == -1:
+                    if len(self.buffer) > self.max_header_size:
+                        raise HttpParseError("Trailer section too large", error_status)
+                    return self.need_more_data()
+                del self.buffer[:line_end + 2]
+                if line_end == 0:
+                    self.reset()
+                    return END_OF_MESSAGE
+
+    def need_more_data(self):
+        if self.eof:
+            raise HttpParseError("Connection closed mid-body", 502 if self.is_response else 400)
+        return None
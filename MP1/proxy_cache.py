@@ -0,0 +1,450 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+# Cache defaults
+PROXY_CACHE_DIR = '.proxy_cache'
+MEMORY_CACHE_MAX_BYTES = 32 * 1024 * 1024     # Hot tier: response bodies kept in memory
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024      # Cold tier: one file per stored response
+MAX_OBJECT_SIZE = 8 * 1024 * 1024             # Larger responses are relayed but not stored
+HEURISTIC_FRACTION = 0.1                      # Of the time since Last-Modified (RFC 9111, 4.2.2)
+HEURISTIC_MAX_LIFETIME = 24 * 60 * 60
+COALESCE_TIMEOUT = 30                         # Seconds a request waits for another's fetch
+
+# Status codes a cache may store, and the ones that may be given a heuristic
+# freshness lifetime (RFC 9110, section 15.1)
+CACHEABLE_STATUS_CODES = {200, 203, 204, 300, 301, 304, 308, 404, 405, 410, 414, 501}
+HEURISTIC_STATUS_CODES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+# Delta-seconds values: ASCII digits only, as str.isdigit() would also accept
+# characters such as '²' that int() rejects
+DELTA_SECONDS = re.compile(r'[0-9]+\Z')
+
+# Headers that describe the connection or the framing, not the stored response
+UNSTORED_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate',
+                    'proxy-authorization', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+                    'content-length', 'age'}
+
+# Function to split a Cache-Control header into {directive: argument or True}
+def parse_cache_control(value):
+    directives = {}
+    for item in (value or '').split(','):
+        name, _, argument = item.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else True
+    return directives
+
+# Function to read a delta-seconds argument, or None if it is malformed
+def delta_seconds(value):
+    if isinstance(value, str) and DELTA_SECONDS.match(value):
+        return int(value)
+    return None
+
+# Function to convert an HTTP date to a Unix timestamp, or None
+def parse_http_timestamp(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+# A stored response: status, end-to-end headers and the complete body, with the
+# freshness information derived from its headers (RFC 9111, section 4.2)
+class CachedResponse:
+    def __init__(self, key, status_code, reason, header_list, body, request_time, response_time, vary=()):
+        self.key = key
+        self.status_code = status_code
+        self.reason = reason
+        self.header_list = [(name, value) for name, value in header_list
+                            if name.lower() not in UNSTORED_HEADERS]
+        self.body = body
+        self.request_time = request_time     # Wall-clock time the request was sent upstream
+        self.response_time = response_time   # ... and the response received
+        self.vary = tuple(vary)              # (header name, request value) pairs the response varies on
+
+        headers = {}
+        for name, value in header_list:
+            key_name = name.lower()
+            headers[key_name] = headers[key_name] + ", " + value if key_name in headers else value
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+        self.cache_control = parse_cache_control(headers.get('cache-control'))
+        self.date_value = parse_http_timestamp(headers.get('date')) or response_time
+        self.age_value = delta_seconds(headers.get('age', '').strip()) or 0
+        self.lifetime = self.freshness_lifetime(headers)
+
+    # Function to work out how long the response stays fresh, in seconds
+    def freshness_lifetime(self, headers):
+        # A shared cache prefers s-maxage, then max-age, then Expires
+        for directive in ('s-maxage', 'max-age'):
+            seconds = delta_seconds(self.cache_control.get(directive))
+            if seconds is not None:
+                return seconds
+        if 'expires' in headers:
+            expires = parse_http_timestamp(headers['expires'])
+            # An invalid Expires date means "already expired"
+            return max(0, expires - self.date_value) if expires is not None else 0
+
+        # Heuristic: a fraction of the time since the resource last changed
+        last_modified = parse_http_timestamp(self.last_modified)
+        if last_modified is not None and self.status_code in HEURISTIC_STATUS_CODES:
+            return min(HEURISTIC_MAX_LIFETIME, max(0, self.date_value - last_modified) * HEURISTIC_FRACTION)
+        return 0
+
+    # Function to compute the response's current age (RFC 9111, section 4.2.3)
+    def current_age(self, now):
+        apparent_age = max(0, self.response_time - self.date_value)
+        response_delay = self.response_time - self.request_time
+        corrected_initial_age = max(apparent_age, self.age_value + response_delay)
+        return corrected_initial_age + (now - self.response_time)
+
+    # True if the response may be used without contacting the origin
+    def is_fresh(self, now, max_age=None):
+        if 'no-cache' in self.cache_control:
+            return False
+        age = self.current_age(now)
+        if max_age is not None and age > max_age:
+            return False
+        return age < self.lifetime
+
+    # True if the response has a validator to revalidate it with
+    def has_validator(self):
+        return self.etag is not None or self.last_modified is not None
+
+    # Bytes this entry holds in memory
+    def cost(self):
+        return len(self.body)
+
+    # Function to serialize the entry as a JSON metadata line followed by the body
+    def to_bytes(self):
+        meta = {
+            'key': self.key,
+            'status_code': self.status_code,
+            'reason': self.reason,
+            'headers': self.header_list,
+            'request_time': self.request_time,
+            'response_time': self.response_time,
+            'vary': self.vary,
+        }
+        return json.dumps(meta).encode('utf-8') + b'\n' + self.body
+
+    @staticmethod
+    def from_bytes(data):
+        meta_line, _, body = data.partition(b'\n')
+        meta = json.loads(meta_line)
+        return CachedResponse(meta['key'], meta['status_code'], meta['reason'],
+                              [tuple(header) for header in meta['headers']], body,
+                              meta['request_time'], meta['response_time'],
+                              [tuple(item) for item in meta['vary']])
+
+# Function to build the base cache key for a request; Vary values are added to it
+def primary_key(method, uri):
+    return f"{method} {uri}"
+
+# Function to build the full cache key: the base key plus the request's values for
+# the headers the stored response varies on
+def variant_key(primary, vary):
+    return primary + ''.join(f"\n{name}: {value}" for name, value in vary)
+
+# Shared HTTP cache for the proxy with two tiers: a bounded in-memory LRU of hot
+# responses and a larger on-disk store with one file per response. Disk hits are
+# promoted to memory. Lookups that miss while another thread is already fetching
+# the same key wait for that fetch instead of going upstream themselves.
+class ProxyCache:
+    def __init__(self, cache_dir=PROXY_CACHE_DIR, memory_max_bytes=MEMORY_CACHE_MAX_BYTES,
+                 disk_max_bytes=DISK_CACHE_MAX_BYTES, max_object_size=MAX_OBJECT_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.max_object_size = max_object_size
+        self.memory = OrderedDict()       # key -> CachedResponse, least recently used first
+        self.memory_bytes = 0
+        self.disk = OrderedDict()         # key -> file size, least recently used first
+        self.disk_bytes = 0
+        self.vary_names = {}              # primary key -> header names of its stored variants
+        self.variants = {}                # primary key -> set of full keys
+        self.in_flight = {}               # full key -> Event set when its fetch finishes
+        self.lock = threading.Lock()
+
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stores = 0
+        self.bytes_saved = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.load_disk_index()
+
+    # Function to rebuild the disk index from the cache directory, oldest file first
+    def load_disk_index(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            try:
+                with open(path, 'rb') as file:
+                    meta = json.loads(file.readline())
+                files.append((os.path.getmtime(path), meta['key'], os.path.getsize(path), meta))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, key, size, meta in sorted(files, key=lambda item: item[0]):
+            primary = key.split('\n', 1)[0]
+            self.disk[key] = size
+            self.disk_bytes += size
+            self.vary_names[primary] = tuple(name for name, _ in meta['vary'])
+            self.variants.setdefault(primary, set()).add(key)
+        self.evict_disk()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    # Function to find the cache key for a request, given the Vary headers of what is stored
+    def request_key(self, method, uri, request):
+        primary = primary_key(method, uri)
+        with self.lock:
+            names = self.vary_names.get(primary, ())
+        return variant_key(primary, [(name, request.get_header(name, '')) for name in names])
+
+    # Function to return the stored response for a key, fresh or not, and the tier
+    # it came from: (entry, 'memory' or 'disk'), or (None, None)
+    def lookup(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry, 'memory'
+            on_disk = key in self.disk
+
+        entry = self.read_disk(key) if on_disk else None
+        if entry is None:
+            return None, None
+        with self.lock:
+            self.store_memory(entry)
+        return entry, 'disk'
+
+    def read_disk(self, key):
+        try:
+            with open(self.entry_path(key), 'rb') as file:
+                entry = CachedResponse.from_bytes(file.read())
+        except (OSError, ValueError, KeyError):
+            self.remove(key)
+            return None
+        if entry.key != key:
+            return None
+        with self.lock:
+            if key in self.disk:
+                self.disk.move_to_end(key)
+        return entry
+
+    # Function to record how a request was answered; served_from is 'memory', 'disk',
+    # 'revalidated' or 'miss', and size is the body bytes not fetched from the origin
+    def record(self, served_from, size=0):
+        with self.lock:
+            if served_from == 'memory':
+                self.memory_hits += 1
+            elif served_from == 'disk':
+                self.disk_hits += 1
+            elif served_from == 'revalidated':
+                self.revalidated += 1
+            else:
+                self.misses += 1
+            self.bytes_saved += size
+
+    # Function to claim the upstream fetch for a key. Returns (True, event) to the
+    # first caller, which must call end_fetch(); others get (False, event) to wait on.
+    def begin_fetch(self, key):
+        with self.lock:
+            event = self.in_flight.get(key)
+            if event is not None:
+                self.coalesced += 1
+                return False, event
+            event = self.in_flight[key] = threading.Event()
+            return True, event
+
+    def end_fetch(self, key):
+        with self.lock:
+            event = self.in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    # Function to store a complete response from the origin
+    def store(self, method, uri, request, response, body, request_time, response_time):
+        vary_header = response.get_header('vary', '')
+        names = tuple(sorted({name.strip().lower() for name in vary_header.split(',') if name.strip()}))
+        primary = primary_key(method, uri)
+        vary = [(name, request.get_header(name, '')) for name in names]
+        entry = CachedResponse(variant_key(primary, vary), response.status_code, response.reason,
+                               response.header_list, body, request_time, response_time, vary)
+        self.put(primary, entry)
+        return entry
+
+    # Function to update a stored response with the headers of a 304 from the
+    # origin (RFC 9111, section 4.3.4) and keep the refreshed copy
+    def refresh(self, entry, response, request_time, response_time):
+        updated = {name.lower() for name, _ in response.header_list}
+        header_list = [(name, value) for name, value in entry.header_list if name.lower() not in updated]
+        header_list += [(name, value) for name, value in response.header_list
+                        if name.lower() not in UNSTORED_HEADERS]
+        refreshed = CachedResponse(entry.key, entry.status_code, entry.reason, header_list, entry.body,
+                                   request_time, response_time, entry.vary)
+        self.put(entry.key.split('\n', 1)[0], refreshed)
+        return refreshed
+
+    def put(self, primary, entry):
+        data = entry.to_bytes()
+        with self.lock:
+            self.stores += 1
+            # A response with different Vary headers replaces the variants stored before it
+            names = tuple(name for name, _ in entry.vary)
+            if self.vary_names.get(primary, names) != names:
+                stale = self.variants.pop(primary, set())
+            else:
+                stale = set()
+            self.vary_names[primary] = names
+            self.variants.setdefault(primary, set()).add(entry.key)
+            self.store_memory(entry)
+        for key in stale - {entry.key}:
+            self.remove(key)
+        if self.cache_dir is not None:
+            self.write_disk(entry.key, data)
+
+    # Function to write an entry file; the rename makes it appear complete or not at all
+    def write_disk(self, key, data):
+        path = self.entry_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing cache entry: {e}")
+            return
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            expired = self.evict_disk()
+        for expired_key in expired:
+            self.delete_file(expired_key)
+
+    # Function to insert an entry into the memory tier and evict least recently used
+    # ones over the limit (caller holds the lock)
+    def store_memory(self, entry):
+        old_entry = self.memory.pop(entry.key, None)
+        if old_entry is not None:
+            self.memory_bytes -= old_entry.cost()
+        self.memory[entry.key] = entry
+        self.memory_bytes += entry.cost()
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.cost()
+
+    # Function to drop least recently used files over the disk limit; returns the
+    # keys whose files should be deleted (caller holds the lock)
+    def evict_disk(self):
+        expired = []
+        while self.disk_bytes > self.disk_max_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            expired.append(key)
+        return expired
+
+    def delete_file(self, key):
+        try:
+            os.remove(self.entry_path(key))
+        except OSError:
+            pass
+
+    # Function to drop one stored response from both tiers
+    def remove(self, key):
+        with self.lock:
+            entry = self.memory.pop(key, None)
+            if entry is not None:
+                self.memory_bytes -= entry.cost()
+            on_disk = self.disk.pop(key, None)
+            if on_disk is not None:
+                self.disk_bytes -= on_disk
+        if on_disk is not None:
+            self.delete_file(key)
+
+    # Function to drop every stored variant of a URI, e.g. after a POST to it
+    # (RFC 9111, section 4.4)
+    def invalidate(self, uri):
+        primary = primary_key('GET', uri)
+        with self.lock:
+            keys = self.variants.pop(primary, set())
+            self.vary_names.pop(primary, None)
+        for key in keys:
+            self.remove(key)
+
+    # Function to report the cache counters
+    def stats(self):
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits + self.revalidated
+            answered = hits + self.misses
+            return {
+                'requests': answered,
+                'hit_ratio': round(hits / answered, 3) if answered else 0.0,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'stores': self.stores,
+                'bytes_saved': self.bytes_saved,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'disk_entries': len(self.disk),
+                'disk_bytes': self.disk_bytes,
+            }
+
+# Function to decide whether a response to a request may be stored by a shared
+# cache (RFC 9111, section 3)
+def is_storable(request, response):
+    if request.method != 'GET' or response.status_code not in CACHEABLE_STATUS_CODES:
+        return False
+    if response.status_code == 304 or response.get_header('vary', '').strip() == '*':
+        return False
+    request_directives = parse_cache_control(request.get_header('cache-control'))
+    response_directives = parse_cache_control(response.get_header('cache-control'))
+    if 'no-store' in request_directives or 'no-store' in response_directives:
+        return False
+    if 'private' in response_directives:
+        return False
+    # Responses to authenticated requests are only shared when explicitly allowed
+    if request.get_header('authorization') is not None and not (
+            {'public', 's-maxage', 'must-revalidate'} & response_directives.keys()):
+        return False
+    # Storing is only useful with a freshness lifetime or a validator
+    return bool({'public', 'max-age', 's-maxage'} & response_directives.keys()
+                or response.get_header('expires') is not None
+                or response.get_header('etag') is not None
+                or response.get_header('last-modified') is not None)
+
+# Function to check whether the client already has the stored response, from its
+# If-None-Match (weak comparison) or else its If-Modified-Since
+def is_not_modified(request, entry):
+    if_none_match = request.get_header('if-none-match')
+    if if_none_match is not None:
+        if entry.etag is None:
+            return False
+        etag = entry.etag[2:] if entry.etag.startswith('W/') else entry.etag
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate == '*' or (candidate[2:] if candidate.startswith('W/') else candidate) == etag:
+                return True
+        return False
+
+    if_modified_since = parse_http_timestamp(request.get_header('if-modified-since'))
+    last_modified = parse_http_timestamp(entry.last_modified)
+    return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
@@ -1,64 +1,1028 @@
+import argparse
+import asyncio
+import signal
 import socket
 import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from access_log import AccessLogger, AccessRecord, ACCESS_LOG_FORMATS
+from http_parser import HttpParser, HttpParseError, END_OF_MESSAGE, DIGITS
+from proxy_cache import (ProxyCache, is_storable, is_not_modified, parse_cache_control, delta_seconds,
+                         PROXY_CACHE_DIR, MEMORY_CACHE_MAX_BYTES, DISK_CACHE_MAX_BYTES, COALESCE_TIMEOUT)
+from server_metrics import ServerMetrics, METRICS_PATH, METRICS_CONTENT_TYPE
+
+# Proxy configuration
+PROXY_HOST = '0.0.0.0'
+PROXY_PORT = 8888
+LISTEN_BACKLOG = socket.SOMAXCONN
+DEFAULT_ORIGIN = ('httpbin.org', 80)   # Origin for requests without an absolute URI
+RECV_BUFFER_SIZE = 65536
+CLIENT_TIMEOUT = 30                    # Seconds to wait on the client socket
+MAX_REQUEST_BODY_SIZE = 16 * 1024 * 1024   # Threaded engine; the async engine streams bodies
+MAX_CONNECTIONS = 10000                # Async engine: client connections served at once
+
+# Streaming relay settings (async engine and CONNECT tunnels)
+RELAY_BUFFER_SIZE = 65536        # Bytes read from one side per read
+RELAY_HIGH_WATER = 256 * 1024    # Bytes queued for a slow receiver before reading from the sender pauses
+TUNNEL_IDLE_TIMEOUT = 300        # Seconds a CONNECT tunnel may sit idle
+CONNECT_PORTS = {443}            # Ports CONNECT may open tunnels to
+
+# Origin connection pool settings
+POOL_MAX_IDLE_PER_ORIGIN = 8     # Idle keep-alive connections kept per (host, port)
+POOL_IDLE_TIMEOUT = 30           # Seconds an idle upstream connection is kept
+ORIGIN_CONNECT_TIMEOUT = 5
+ORIGIN_READ_TIMEOUT = 30
+
+# Connection-specific headers that are not forwarded (RFC 9110, section 7.6.1)
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate',
+                      'proxy-authorization', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+
+# Methods whose repetition has the same effect as a single request (RFC 9110, section 9.2.2)
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'}
+
+# Client preconditions, replaced by the cache's own when it revalidates a response
+CONDITIONAL_HEADERS = {'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range'}
+
+# Reason phrases for the errors the proxy sends itself
+ERROR_REASONS = {400: "Bad Request", 403: "Forbidden", 413: "Content Too Large",
+                 431: "Request Header Fields Too Large", 501: "Not Implemented", 502: "Bad Gateway"}
+
+# Access log settings: a file to append to, '-' for stdout, or None for no access log
+ACCESS_LOG_PATH = '-'
+ACCESS_LOG_FORMAT = 'common'
+
+# Raised when no response head could be obtained from the origin, so the client
+# can still be sent a 502
+class OriginUnavailableError(Exception):
+    pass
+
+# Client socket or stream writer that counts the bytes sent to the client and
+# notes the status code of the response it starts with, for the access log and
+# metrics. Everything else is passed through to the wrapped object.
+class MeteredClient:
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_sent = 0
+        self.status_code = None
+
+    def count(self, data):
+        if self.status_code is None:
+            self.status_code = response_status(data)
+        self.bytes_sent += len(data)
+
+    def sendall(self, data):
+        self.stream.sendall(data)
+        self.count(data)
+
+    def write(self, data):
+        self.stream.write(data)
+        self.count(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+# Function to read the status code from the start of a response ("HTTP/1.1 200 ..."),
+# or 0 if data doesn't start with a status line
+def response_status(data):
+    code = bytes(data[9:12]).decode('iso-8859-1')
+    return int(code) if data[:5] == b'HTTP/' and DIGITS.match(code) else 0
+
+# A persistent TCP connection to one origin server
+class OriginConnection:
+    def __init__(self, origin, sock):
+        self.origin = origin
+        self.sock = sock
+        self.parser = HttpParser(is_response=True)
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    def is_healthy(self):
+        return is_connection_healthy(self.sock)
+
+    def close(self):
+        self.sock.close()
+
+# A persistent connection to one origin server, used by the async engine
+class AsyncOriginConnection:
+    def __init__(self, origin, reader, writer):
+        self.origin = origin
+        self.reader = reader
+        self.writer = writer
+        self.parser = HttpParser(is_response=True)
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    # The stream sees EOF from the origin as soon as the event loop reads it
+    def is_healthy(self):
+        return not (self.reader.at_eof() or self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+# Per-origin pool of idle keep-alive connections. acquire() hands out the most
+# recently used healthy connection (or opens a new one) and release() returns it
+# if the response left it reusable. Connections idle longer than idle_timeout are
+# closed by evict_idle(), which the proxy runs periodically.
+class OriginConnectionPool:
+    def __init__(self, max_idle_per_origin=POOL_MAX_IDLE_PER_ORIGIN, idle_timeout=POOL_IDLE_TIMEOUT,
+                 connect_timeout=ORIGIN_CONNECT_TIMEOUT):
+        self.max_idle_per_origin = max_idle_per_origin
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.idle = {}   # (host, port) -> deque of OriginConnection, most recent last
+        self.lock = threading.Lock()
+
+        # Counters
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    # Function to take the most recently used healthy idle connection, or None
+    def take_idle(self, origin):
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                connections = self.idle.get(origin)
+                connection = connections.pop() if connections else None
+            if connection is None:
+                return None
+            if now - connection.last_used < self.idle_timeout and connection.is_healthy():
+                with self.lock:
+                    self.reused += 1
+                return connection
+            connection.close()
+            with self.lock:
+                self.evicted += 1
+
+    # Function to get a connection to origin; returns (connection, reused)
+    def acquire(self, origin):
+        connection = self.take_idle(origin)
+        if connection is not None:
+            return connection, True
+
+        sock = socket.create_connection(origin, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.created += 1
+        return OriginConnection(origin, sock), False
+
+    # Function to return a connection after a response; unusable ones are closed
+    def release(self, connection, reusable):
+        if reusable:
+            connection.last_used = time.monotonic()
+            with self.lock:
+                connections = self.idle.setdefault(connection.origin, deque())
+                if len(connections) < self.max_idle_per_origin:
+                    connections.append(connection)
+                    return
+        connection.close()
+
+    # Function to close connections that have been idle for too long
+    def evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for origin, connections in list(self.idle.items()):
+                while connections and now - connections[0].last_used >= self.idle_timeout:
+                    expired.append(connections.popleft())
+                if not connections:
+                    del self.idle[origin]
+            self.evicted += len(expired)
+        for connection in expired:
+            connection.close()
+
+    # Function to report the pool counters
+    def stats(self):
+        with self.lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'idle': sum(len(connections) for connections in self.idle.values()),
+            }
+
+# The same pool for the async engine; only opening a connection differs
+class AsyncOriginConnectionPool(OriginConnectionPool):
+    async def acquire(self, origin):
+        connection = self.take_idle(origin)
+        if connection is not None:
+            return connection, True
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*origin, limit=RELAY_BUFFER_SIZE),
+                                                self.connect_timeout)
+        writer.transport.set_write_buffer_limits(high=RELAY_HIGH_WATER)
+        with self.lock:
+            self.created += 1
+        return AsyncOriginConnection(origin, reader, writer), False
+
+# Function to check that an idle upstream socket is still open: a non-blocking
+# peek must find nothing to read. EOF means the origin closed it, and unexpected
+# bytes mean it is out of sync with the request/response exchange.
+def is_connection_healthy(sock):
+    timeout = sock.gettimeout()
+    try:
+        sock.setblocking(False)
+        sock.recv(1, socket.MSG_PEEK)
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+# Function to find the origin (host, port) and origin-form target for a request.
+# Proxy-style requests name the origin in an absolute URI ("GET http://host/path");
+# plain requests are addressed to the proxy itself and go to the default origin.
+# An absolute URI without a host or with an invalid port raises HttpParseError (400).
+def resolve_origin(request):
+    if request.target.lower().startswith('http://'):
+        url = urlsplit(request.target)
+        try:
+            port = url.port or 80
+        except ValueError:
+            raise HttpParseError(f"Invalid port in request target: {request.target!r}")
+        if not url.hostname:
+            raise HttpParseError(f"No host in request target: {request.target!r}")
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        return (url.hostname, port), path
+    return DEFAULT_ORIGIN, request.target
+
+# Function to build the absolute URI of a request, used as its cache key
+def origin_uri(origin, path):
+    host, port = origin
+    return f"http://{host}{path}" if port == 80 else f"http://{host}:{port}{path}"
+
+# Function to build the request head sent upstream: origin-form target, hop-by-hop
+# headers removed, and a keep-alive connection to the origin. If conditional
+# headers are given they replace the client's own preconditions. body_length is
+# the size of the body that follows, or None to send it chunked.
+def build_origin_head(request, origin, path, conditional_headers=None, body_length=0):
+    hop_by_hop = HOP_BY_HOP_HEADERS | {token.strip().lower()
+                                       for token in request.get_header('connection', '').split(',')}
+    if conditional_headers is not None:
+        hop_by_hop |= CONDITIONAL_HEADERS
+    lines = [f"{request.method} {path} HTTP/1.1"]
+    host, port = origin
+    lines.append(f"Host: {host}" if port == 80 else f"Host: {host}:{port}")
+    for name, value in request.header_list:
+        key = name.lower()
+        if key in hop_by_hop or key in ('host', 'content-length'):
+            continue
+        lines.append(f"{name}: {value}")
+    for name, value in conditional_headers or ():
+        lines.append(f"{name}: {value}")
+    if body_length is None:
+        lines.append("Transfer-Encoding: chunked")
+    elif body_length or request.method in ('POST', 'PUT', 'PATCH'):
+        lines.append(f"Content-Length: {body_length}")
+    lines.append("Connection: keep-alive")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('iso-8859-1')
+
+# Function to build the complete request sent upstream for a buffered request
+def build_origin_request(request, origin, path, conditional_headers=None):
+    return build_origin_head(request, origin, path, conditional_headers, len(request.body)) + request.body
+
+# Function to build the response head sent to the client. A chunked origin body
+# is re-chunked on the way through; the client connection closes after the response.
+def build_client_response_head(response):
+    hop_by_hop = HOP_BY_HOP_HEADERS | {token.strip().lower()
+                                       for token in response.get_header('connection', '').split(',')}
+    lines = [f"HTTP/1.1 {response.status_code} {response.reason}"]
+    for name, value in response.header_list:
+        if name.lower() not in hop_by_hop:
+            lines.append(f"{name}: {value}")
+    if is_chunked(response):
+        lines.append("Transfer-Encoding: chunked")
+    lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('iso-8859-1')
+
+def is_chunked(response):
+    return response.get_header('transfer-encoding', '').lower().endswith('chunked')
+
+# Function to read from a connection until the parser yields its next event.
+# A peer that closes the connection between messages raises ConnectionError.
+def read_event(sock, parser):
+    while True:
+        event = parser.next_event()
+        if event is not None:
+            return event
+        data = sock.recv(RECV_BUFFER_SIZE)
+        if not data:
+            if not parser.in_progress():
+                raise ConnectionError("Connection closed by peer")
+            parser.feed_eof()
+        else:
+            parser.feed(data)
+
+# Function to read the next request from the client, with its body
+def read_client_request(client_socket, parser):
+    while True:
+        request = parser.next_message()
+        if request is not None:
+            return request
+        data = client_socket.recv(RECV_BUFFER_SIZE)
+        if not data:
+            if not parser.in_progress():
+                return None
+            parser.feed_eof()
+        else:
+            parser.feed(data)
+
+# True if the origin connection can carry another request after this response;
+# until-close bodies end with the connection, so it can't be reused
+def keeps_connection(connection, response):
+    return (response.version == 'HTTP/1.1' and not response.has_connection_token('close')
+            and connection.parser.state != 'until-close')
+
+# True if a request that failed on a reused origin connection may be sent again
+# on a fresh one: the origin closed or reset the idle connection before any byte
+# of the response arrived, and the request has no body or is idempotent. A
+# timeout doesn't qualify, since the origin may have acted on the request already.
+def can_retry(request, body_length, error, parser):
+    if not isinstance(error, ConnectionError) or parser.in_progress():
+        return False
+    return body_length == 0 or request.method in IDEMPOTENT_METHODS
+
+# Function to relay one response from the origin to the client, streaming the
+# body as it arrives. If capture_limit is set, the body is also collected as
+# long as it stays within that many bytes. Returns (reusable, body or None).
+def relay_response(connection, client_socket, response, capture_limit=None):
+    chunked = is_chunked(response)
+    client_socket.sendall(build_client_response_head(response))
+    reusable = keeps_connection(connection, response)
+    body = bytearray() if capture_limit is not None else None
+
+    while True:
+        event = read_event(connection.sock, connection.parser)
+        if event is END_OF_MESSAGE:
+            break
+        if body is not None:
+            body += event
+            if len(body) > capture_limit:
+                body = None
+        if chunked:
+            client_socket.sendall(b'%x\r\n' % len(event) + event + b'\r\n')
+        else:
+            client_socket.sendall(event)
+    if chunked:
+        client_socket.sendall(b'0\r\n\r\n')
+    return reusable, bytes(body) if body is not None else None
+
+# Function to send a request to the origin and read the response head, using a
+# pooled connection when one is available. Returns (connection, response).
+def open_origin_response(request, origin, path, conditional_headers=None):
+    origin_request = build_origin_request(request, origin, path, conditional_headers)
+
+    while True:
+        started = time.monotonic()
+        connection, reused = ORIGIN_POOL.acquire(origin)
+        if not reused:
+            METRICS.observe_upstream('connect', time.monotonic() - started)
+        try:
+            connection.sock.settimeout(ORIGIN_READ_TIMEOUT)
+            connection.parser.request_method = request.method
+
+            # Forward the client's request to the origin server
+            sent = time.monotonic()
+            connection.sock.sendall(origin_request)
+
+            # Receive the response head from the origin server
+            response = read_event(connection.sock, connection.parser)
+            METRICS.observe_upstream('response_head', time.monotonic() - sent)
+            return connection, response
+        except (OSError, HttpParseError) as e:
+            connection.close()
+            # The origin may close an idle connection just as we reuse it; retry on a
+            # fresh connection if the request can safely be sent twice
+            if not (reused and can_retry(request, len(request.body), e, connection.parser)):
+                raise OriginUnavailableError(e)
+
+# Function to forward the request to the origin server and relay the response.
+# With a uri the response is stored in the cache if it is storable; with a cached
+# entry the request revalidates it, and a 304 from the origin is answered from the cache.
+def forward_request(client_socket, request, origin, path, uri=None, cached=None):
+    conditional_headers = None
+    if cached is not None:
+        conditional_headers = []
+        if cached.etag is not None:
+            conditional_headers.append(('If-None-Match', cached.etag))
+        if cached.last_modified is not None:
+            conditional_headers.append(('If-Modified-Since', cached.last_modified))
+
+    request_time = time.time()
+    try:
+        connection, response = open_origin_response(request, origin, path, conditional_headers)
+    except OSError as e:
+        raise OriginUnavailableError(e)
+    response_time = time.time()
+
+    try:
+        if cached is not None and response.status_code == 304:
+            # A 304 has no body; this only moves the parser on to the next response
+            read_event(connection.sock, connection.parser)
+            ORIGIN_POOL.release(connection, keeps_connection(connection, response))
+            entry = RESPONSE_CACHE.refresh(cached, response, request_time, response_time)
+            RESPONSE_CACHE.record('revalidated', len(entry.body))
+            send_cached_response(client_socket, request, entry, 'REVALIDATED')
+            return
+
+        capture_limit = None
+        if uri is not None and is_storable(request, response):
+            capture_limit = RESPONSE_CACHE.max_object_size
+        reusable, body = relay_response(connection, client_socket, response, capture_limit)
+        connection.requests += 1
+    except BaseException:
+        connection.close()
+        raise
+    ORIGIN_POOL.release(connection, reusable)
+
+    if uri is not None:
+        RESPONSE_CACHE.record('miss')
+        if body is not None:
+            RESPONSE_CACHE.store('GET', uri, request, response, body, request_time, response_time)
+
+# Function to send a stored response to the client, or a 304 if the client's
+# preconditions show it already has it
+def send_cached_response(client_socket, request, entry, cache_status='HIT'):
+    not_modified = is_not_modified(request, entry)
+    if not_modified:
+        lines = ["HTTP/1.1 304 Not Modified"]
+    else:
+        lines = [f"HTTP/1.1 {entry.status_code} {entry.reason}"]
+    lines += [f"{name}: {value}" for name, value in entry.header_list]
+    lines.append(f"Age: {int(entry.current_age(time.time()))}")
+    lines.append(f"X-Cache: {cache_status}")
+    if not not_modified and entry.status_code not in (204, 304):
+        lines.append(f"Content-Length: {len(entry.body)}")
+    lines.append("Connection: close")
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode('iso-8859-1')
+    client_socket.sendall(head if not_modified or request.method == 'HEAD' else head + entry.body)
+
+# Function to answer a request from the cache when possible, otherwise from the
+# origin. Concurrent misses for the same response share a single upstream fetch.
+def serve_request(client_socket, request, origin, path):
+    if RESPONSE_CACHE is None:
+        forward_request(client_socket, request, origin, path)
+        return
+
+    uri = origin_uri(origin, path)
+    directives = parse_cache_control(request.get_header('cache-control'))
+    if request.method != 'GET' or request.get_header('range') is not None or 'no-store' in directives:
+        forward_request(client_socket, request, origin, path)
+        # A request that may change the resource makes stored copies stale
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            RESPONSE_CACHE.invalidate(uri)
+        return
+
+    revalidate = 'no-cache' in directives or request.get_header('pragma', '').lower() == 'no-cache'
+    max_age = delta_seconds(directives.get('max-age'))
+
+    key = RESPONSE_CACHE.request_key('GET', uri, request)
+    cached, tier = RESPONSE_CACHE.lookup(key)
+    if cached is not None and not revalidate and cached.is_fresh(time.time(), max_age):
+        RESPONSE_CACHE.record(tier, len(cached.body))
+        send_cached_response(client_socket, request, cached)
+        return
+
+    leader, event = RESPONSE_CACHE.begin_fetch(key)
+    if not leader:
+        # Another request is already fetching this response: wait for it and use
+        # what it stored, going upstream only if it stored nothing usable
+        event.wait(COALESCE_TIMEOUT)
+        key = RESPONSE_CACHE.request_key('GET', uri, request)
+        cached, tier = RESPONSE_CACHE.lookup(key)
+        if cached is not None and cached.is_fresh(time.time(), max_age):
+            RESPONSE_CACHE.record(tier, len(cached.body))
+            send_cached_response(client_socket, request, cached)
+            return
+        forward_request(client_socket, request, origin, path, uri)
+        return
 
-# Function to forward the request to the origin server and get the response
-def forward_request(client_socket, request):
     try:
-        # Connect to the origin server (e.g., example.com at port 80)
-        origin_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        origin_server.connect(('httpbin.org', 80))
+        if cached is not None and not cached.has_validator():
+            cached = None
+        forward_request(client_socket, request, origin, path, uri, cached)
+    finally:
+        RESPONSE_CACHE.end_fetch(key)
+
+# Function to build a short error response
+def error_response(status_code):
+    status = f"{status_code} {ERROR_REASONS[status_code]}"
+    body = f"<h1>{status}</h1>".encode('utf-8')
+    return (f"HTTP/1.1 {status}\r\nContent-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('utf-8') + body
+
+# Function to send a short error response to the client
+def send_error(client_socket, status_code):
+    client_socket.sendall(error_response(status_code))
+
+# Function to build the response of the metrics endpoint, with the counters of
+# the given origin pool, the response cache and the access log
+def metrics_response(pool):
+    extra = {'origin_pool': pool.stats()}
+    if RESPONSE_CACHE is not None:
+        extra['response_cache'] = RESPONSE_CACHE.stats()
+    if ACCESS_LOG is not None:
+        extra['access_log'] = ACCESS_LOG.stats()
+    body = METRICS.render(extra).encode('utf-8')
+    return (f"HTTP/1.1 200 OK\r\nContent-Type: {METRICS_CONTENT_TYPE}\r\nCache-Control: no-store\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('utf-8') + body
 
-        # Forward the client's request to the origin server
-        origin_server.sendall(request)
+# Function to count a finished exchange in the metrics and queue its access log
+# line. request is None if it could not be parsed; status 0 means no response
+# was started (the client or the origin failed first).
+def record_request(client_address, request, client, started):
+    duration = time.monotonic() - started
+    status_code = client.status_code or 0
+    METRICS.observe_request(status_code, duration, client.bytes_sent)
+    if ACCESS_LOG is not None:
+        host = client_address[0] if client_address else '-'
+        if request is None:
+            ACCESS_LOG.log(AccessRecord(host, None, None, None, status_code, client.bytes_sent, duration))
+        else:
+            ACCESS_LOG.log(AccessRecord(host, request.method, request.target, request.version, status_code,
+                                        client.bytes_sent, duration))
 
-        # Receive the response from the origin server
+# Function to parse a CONNECT target ("host:port"); returns (host, port) or None
+def parse_connect_target(target):
+    host, _, port = target.rpartition(':')
+    if not host or not DIGITS.match(port):
+        return None
+    return host.strip('[]'), int(port)
+
+# Function to check a CONNECT request; returns the target or the error status to send
+def check_connect_target(request):
+    target = parse_connect_target(request.target)
+    if target is None:
+        return None, 400
+    if target[1] not in CONNECT_PORTS:
+        return None, 403
+    return target, None
+
+# Function to copy bytes from one socket to the other until EOF, then pass the
+# EOF on so each direction of the tunnel closes independently
+def pipe_sockets(source, destination):
+    try:
         while True:
-            response = origin_server.recv(4096)
-            if len(response) == 0:
+            data = source.recv(RELAY_BUFFER_SIZE)
+            if not data:
                 break
+            destination.sendall(data)
+        destination.shutdown(socket.SHUT_WR)
+    except OSError:
+        # One side failed: tear the whole tunnel down
+        for sock in (source, destination):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-            # Send the response back to the client
-            client_socket.sendall(response)
+# Function to open a CONNECT tunnel and relay bytes both ways, one thread per direction
+def tunnel(client_socket, parser, request):
+    target, error_status = check_connect_target(request)
+    if target is None:
+        send_error(client_socket, error_status)
+        return
+    try:
+        started = time.monotonic()
+        upstream = socket.create_connection(target, timeout=ORIGIN_CONNECT_TIMEOUT)
+        METRICS.observe_upstream('tunnel_connect', time.monotonic() - started)
+    except OSError as e:
+        print(f"Error opening tunnel to {target}: {e}")
+        send_error(client_socket, 502)
+        return
 
+    try:
+        upstream.settimeout(TUNNEL_IDLE_TIMEOUT)
+        client_socket.settimeout(TUNNEL_IDLE_TIMEOUT)
+        client_socket.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+
+        # Bytes the client sent right after the CONNECT head belong to the tunnel
+        if parser.buffer:
+            upstream.sendall(parser.buffer)
+
+        upload = threading.Thread(target=pipe_sockets, args=(client_socket, upstream), daemon=True)
+        upload.start()
+        pipe_sockets(upstream, client_socket)
+        upload.join()
     finally:
-        # Close the connections
-        origin_server.close()
-        client_socket.close()
+        upstream.close()
 
 # Function to handle incoming requests from clients
-def handle_client(client_socket):
+def handle_client(client_socket, client_address=None):
+    METRICS.connection_opened()
+    client_socket = MeteredClient(client_socket)
+    started = time.monotonic()
+    request = None
     try:
+        client_socket.settimeout(CLIENT_TIMEOUT)
+
         # Receive the client's request
-        request = client_socket.recv(4096)
-        print(f"Received request: {request.decode('utf-8')}")
+        parser = HttpParser(max_body_size=MAX_REQUEST_BODY_SIZE)
+        try:
+            request = read_client_request(client_socket, parser)
+        except HttpParseError as e:
+            send_error(client_socket, e.status_code)
+            return
+        if request is None:
+            return
+        started = time.monotonic()
+
+        if request.target == METRICS_PATH:
+            client_socket.sendall(metrics_response(ORIGIN_POOL))
+            return
 
-        # Forward the request to the origin server
-        forward_request(client_socket, request)
+        if request.method == 'CONNECT':
+            tunnel(client_socket, parser, request)
+            return
+
+        # Forward the request to the origin server named by the request
+        try:
+            origin, path = resolve_origin(request)
+        except HttpParseError as e:
+            send_error(client_socket, e.status_code)
+            return
+        try:
+            serve_request(client_socket, request, origin, path)
+        except OriginUnavailableError as e:
+            print(f"Error contacting origin {origin}: {e}")
+            send_error(client_socket, 502)
 
     except Exception as e:
         print(f"Error handling request: {e}")
     finally:
         client_socket.close()
+        METRICS.connection_closed()
+        if request is not None or client_socket.status_code is not None:
+            record_request(client_address, request, client_socket, started)
+
+# Function to read from a stream until the parser yields its next event
+async def read_event_async(reader, parser, timeout):
+    while True:
+        event = parser.next_event()
+        if event is not None:
+            return event
+        data = await asyncio.wait_for(reader.read(RELAY_BUFFER_SIZE), timeout)
+        if not data:
+            if not parser.in_progress():
+                raise ConnectionError("Connection closed by peer")
+            parser.feed_eof()
+        else:
+            parser.feed(data)
+
+# Function to send a short error response from the async engine
+async def send_error_async(writer, status_code):
+    writer.write(error_response(status_code))
+    await writer.drain()
+
+# Function to copy bytes from reader to writer until EOF. drain() waits while the
+# writer has more than RELAY_HIGH_WATER bytes queued, and nothing more is read
+# meanwhile, so a slow receiver slows down the sender instead of filling memory.
+async def pipe_stream(reader, writer, timeout):
+    try:
+        while True:
+            data = await asyncio.wait_for(reader.read(RELAY_BUFFER_SIZE), timeout)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (OSError, asyncio.TimeoutError):
+        # One side failed or went idle: tear the whole tunnel down
+        writer.close()
+
+# Function to open a CONNECT tunnel and relay bytes both ways at once
+async def tunnel_async(client_reader, client_writer, parser, request):
+    target, error_status = check_connect_target(request)
+    if target is None:
+        await send_error_async(client_writer, error_status)
+        return
+    try:
+        started = time.monotonic()
+        upstream_reader, upstream_writer = await asyncio.wait_for(
+            asyncio.open_connection(*target, limit=RELAY_BUFFER_SIZE), ORIGIN_CONNECT_TIMEOUT)
+        METRICS.observe_upstream('tunnel_connect', time.monotonic() - started)
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Error opening tunnel to {target}: {e}")
+        await send_error_async(client_writer, 502)
+        return
+
+    try:
+        upstream_writer.transport.set_write_buffer_limits(high=RELAY_HIGH_WATER)
+        client_writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+
+        # Bytes the client sent right after the CONNECT head belong to the tunnel
+        if parser.buffer:
+            upstream_writer.write(bytes(parser.buffer))
+
+        await asyncio.gather(pipe_stream(client_reader, upstream_writer, TUNNEL_IDLE_TIMEOUT),
+                             pipe_stream(upstream_reader, client_writer, TUNNEL_IDLE_TIMEOUT))
+    finally:
+        upstream_writer.close()
+
+# Function to stream the client's request body to the origin as it arrives,
+# re-chunking it if it came chunked
+async def stream_request_body(client_reader, parser, upstream_writer, chunked):
+    while True:
+        event = await read_event_async(client_reader, parser, CLIENT_TIMEOUT)
+        if event is END_OF_MESSAGE:
+            break
+        if chunked:
+            upstream_writer.write(b'%x\r\n' % len(event) + event + b'\r\n')
+        else:
+            upstream_writer.write(event)
+        await upstream_writer.drain()
+    if chunked:
+        upstream_writer.write(b'0\r\n\r\n')
+        await upstream_writer.drain()
+
+# Function to stream one response body from the origin to the client
+async def stream_response_body(connection, client_writer, response):
+    chunked = is_chunked(response)
+    while True:
+        event = await read_event_async(connection.reader, connection.parser, ORIGIN_READ_TIMEOUT)
+        if event is END_OF_MESSAGE:
+            break
+        if chunked:
+            client_writer.write(b'%x\r\n' % len(event) + event + b'\r\n')
+        else:
+            client_writer.write(event)
+        await client_writer.drain()
+    if chunked:
+        client_writer.write(b'0\r\n\r\n')
+        await client_writer.drain()
 
-# Create a TCP/IP socket for the proxy server
-proxy_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Function to relay one request and its response without buffering either body.
+# The request body is sent upstream by a separate task while the response is read,
+# so an origin that answers before the upload finishes is relayed at once.
+async def relay_http_async(client_reader, client_writer, parser, request, origin, path):
+    if parser.state == 'body':
+        body_length = parser.remaining
+    elif parser.state == 'done':
+        body_length = 0
+    else:
+        body_length = None   # Chunked request bodies are forwarded chunked
+    head = build_origin_head(request, origin, path, body_length=body_length)
 
-# Bind the proxy server to the port
-proxy_server.bind(('0.0.0.0', 8888))  # Listening on port 8888 for proxy requests
+    while True:
+        started = time.monotonic()
+        try:
+            connection, reused = await ASYNC_ORIGIN_POOL.acquire(origin)
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"Error contacting origin {origin}: {e}")
+            await send_error_async(client_writer, 502)
+            return
+        if not reused:
+            METRICS.observe_upstream('connect', time.monotonic() - started)
+
+        connection.parser.request_method = request.method
+        connection.writer.write(head)
+        sent = time.monotonic()
+        # A request without a body is complete with its head
+        upload = None
+        if body_length != 0:
+            upload = asyncio.ensure_future(
+                stream_request_body(client_reader, parser, connection.writer, body_length is None))
+        try:
+            response = await read_event_async(connection.reader, connection.parser, ORIGIN_READ_TIMEOUT)
+            METRICS.observe_upstream('response_head', time.monotonic() - sent)
+        except (OSError, HttpParseError, asyncio.TimeoutError) as e:
+            if upload is not None:
+                upload.cancel()
+            connection.close()
+            # A reused connection may have been closed by the origin; a request
+            # without a body can be sent again on a fresh one if that is safe
+            if reused and body_length == 0 and can_retry(request, body_length, e, connection.parser):
+                continue
+            print(f"Error contacting origin {origin}: {e}")
+            await send_error_async(client_writer, 502)
+            return
+        break
+
+    try:
+        client_writer.write(build_client_response_head(response))
+        await stream_response_body(connection, client_writer, response)
+        connection.requests += 1
+
+        # The connection can only be reused if the origin also got the whole request
+        uploaded = upload is None or (upload.done() and not upload.cancelled())
+        reusable = keeps_connection(connection, response) and uploaded
+        if upload is not None:
+            if upload.done():
+                upload.result()
+            else:
+                upload.cancel()
+    except BaseException:
+        if upload is not None:
+            upload.cancel()
+        connection.close()
+        raise
+    ASYNC_ORIGIN_POOL.release(connection, reusable)
+
+# Function to handle one client connection in the async engine
+async def handle_client_async(client_reader, client_writer):
+    METRICS.connection_opened()
+    client_address = client_writer.get_extra_info('peername')
+    client_writer = MeteredClient(client_writer)
+    client_writer.transport.set_write_buffer_limits(high=RELAY_HIGH_WATER)
+    started = time.monotonic()
+    request = None
+    try:
+        # Receive the client's request head; the body is streamed afterwards
+        parser = HttpParser()
+        try:
+            request = await read_event_async(client_reader, parser, CLIENT_TIMEOUT)
+        except HttpParseError as e:
+            await send_error_async(client_writer, e.status_code)
+            return
+        except (ConnectionError, asyncio.TimeoutError):
+            return
+        started = time.monotonic()
+
+        if request.target == METRICS_PATH:
+            client_writer.write(metrics_response(ASYNC_ORIGIN_POOL))
+            await client_writer.drain()
+            return
+
+        if request.method == 'CONNECT':
+            await tunnel_async(client_reader, client_writer, parser, request)
+            return
+
+        # Forward the request to the origin server named by the request
+        try:
+            origin, path = resolve_origin(request)
+        except HttpParseError as e:
+            await send_error_async(client_writer, e.status_code)
+            return
+        await relay_http_async(client_reader, client_writer, parser, request, origin, path)
+
+    except (OSError, HttpParseError, asyncio.TimeoutError) as e:
+        print(f"Error relaying request: {e}")
+    except Exception as e:
+        print(f"Error handling request: {e}")
+    finally:
+        client_writer.close()
+        METRICS.connection_closed()
+        if request is not None or client_writer.status_code is not None:
+            record_request(client_address, request, client_writer, started)
+
+# Function to close idle upstream connections in the background
+def run_pool_reaper(pool):
+    while True:
+        time.sleep(max(pool.idle_timeout / 2, 0.5))
+        pool.evict_idle()
+
+# Function to close idle upstream connections from inside the event loop
+async def run_pool_reaper_async(pool):
+    while True:
+        await asyncio.sleep(max(pool.idle_timeout / 2, 0.5))
+        pool.evict_idle()
+
+# Shared pools of upstream connections, one per engine
+ORIGIN_POOL = OriginConnectionPool()
+ASYNC_ORIGIN_POOL = AsyncOriginConnectionPool()
+
+# Shared response cache; None when caching is turned off
+RESPONSE_CACHE = None
 
-# Listen for incoming connections
-proxy_server.listen(10)
-print("Proxy server is running on http://localhost:8888")
+# Background access logger, started in __main__; None when turned off
+ACCESS_LOG = None
+
+# Request metrics of the proxy, served at METRICS_PATH
+METRICS = ServerMetrics('proxy')
 
 # Handle multiple client connections using threads
-def start_proxy_server():
+def start_proxy_server(proxy_server):
     while True:
         client_socket, client_address = proxy_server.accept()
-        print(f"New connection from {client_address}")
 
         # Create a new thread for each client connection
-        client_thread = threading.Thread(target=handle_client, args=(client_socket,))
+        client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
         client_thread.start()
 
-# Start the proxy server
-start_proxy_server()
+# Serve every client connection from one asyncio event loop; the semaphore caps
+# the connections relayed at once
+async def start_async_proxy_server(proxy_server, max_connections):
+    connection_slots = asyncio.Semaphore(max_connections)
+
+    async def on_client(client_reader, client_writer):
+        async with connection_slots:
+            await handle_client_async(client_reader, client_writer)
+
+    asyncio.get_running_loop().create_task(run_pool_reaper_async(ASYNC_ORIGIN_POOL))
+    server = await asyncio.start_server(on_client, sock=proxy_server, limit=RELAY_BUFFER_SIZE)
+    async with server:
+        await server.serve_forever()
+
+def parse_origin(value):
+    host, _, port = value.rpartition(':')
+    return (host, int(port)) if host else (value, 80)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simple HTTP forward proxy")
+    parser.add_argument('--host', default=PROXY_HOST)
+    parser.add_argument('--port', type=int, default=PROXY_PORT)
+    parser.add_argument('--mode', choices=('threaded', 'async'), default='threaded',
+                        help="one thread per client, or one asyncio loop streaming every connection")
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help="client connections relayed at once by the async engine")
+    parser.add_argument('--relay-buffer-size', type=int, default=RELAY_BUFFER_SIZE,
+                        help="bytes read from one side of a relay at a time")
+    parser.add_argument('--relay-high-water', type=int, default=RELAY_HIGH_WATER,
+                        help="bytes queued for a slow receiver before reading pauses")
+    parser.add_argument('--connect-ports', type=lambda value: {int(port) for port in value.split(',')},
+                        default=CONNECT_PORTS, help="comma-separated ports CONNECT may tunnel to")
+    parser.add_argument('--default-origin', type=parse_origin, default=DEFAULT_ORIGIN,
+                        help="host[:port] for requests that do not name an origin in an absolute URI")
+    parser.add_argument('--pool-size', type=int, default=POOL_MAX_IDLE_PER_ORIGIN,
+                        help="idle upstream connections kept per origin")
+    parser.add_argument('--pool-idle-timeout', type=float, default=POOL_IDLE_TIMEOUT,
+                        help="seconds an idle upstream connection is kept")
+    # Cache options default to None so that setting one with --mode async, which
+    # has no response cache, can be refused instead of silently ignored
+    parser.add_argument('--cache-dir',
+                        help=f"directory for the on-disk response cache (default {PROXY_CACHE_DIR})")
+    parser.add_argument('--cache-memory-size', type=int,
+                        help=f"bytes of responses kept in memory (default {MEMORY_CACHE_MAX_BYTES})")
+    parser.add_argument('--cache-disk-size', type=int,
+                        help=f"bytes of responses kept on disk (default {DISK_CACHE_MAX_BYTES})")
+    parser.add_argument('--no-cache', action='store_true', help="relay every request to the origin")
+    parser.add_argument('--access-log', default=ACCESS_LOG_PATH,
+                        help="file the access log is appended to, '-' for stdout")
+    parser.add_argument('--access-log-format', choices=ACCESS_LOG_FORMATS, default=ACCESS_LOG_FORMAT,
+                        help="Common Log Format or one JSON object per line")
+    parser.add_argument('--no-access-log', action='store_true', help="don't write an access log")
+    parser.add_argument('--metrics-path', default=METRICS_PATH,
+                        help="origin-form path the proxy answers with its metrics instead of forwarding")
+    args = parser.parse_args()
+
+    if args.mode == 'async':
+        given = [option for option, value in (('--cache-dir', args.cache_dir),
+                                              ('--cache-memory-size', args.cache_memory_size),
+                                              ('--cache-disk-size', args.cache_disk_size))
+                 if value is not None]
+        if given:
+            parser.error(f"{', '.join(given)}: the async engine has no response cache; "
+                         "use --mode threaded to cache responses")
+    if args.cache_dir is None:
+        args.cache_dir = PROXY_CACHE_DIR
+    if args.cache_memory_size is None:
+        args.cache_memory_size = MEMORY_CACHE_MAX_BYTES
+    if args.cache_disk_size is None:
+        args.cache_disk_size = DISK_CACHE_MAX_BYTES
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    DEFAULT_ORIGIN = args.default_origin
+    RELAY_BUFFER_SIZE = args.relay_buffer_size
+    RELAY_HIGH_WATER = args.relay_high_water
+    CONNECT_PORTS = args.connect_ports
+    METRICS_PATH = args.metrics_path
+    if not args.no_access_log:
+        ACCESS_LOG = AccessLogger(args.access_log, args.access_log_format)
+    if args.mode == 'threaded':
+        ORIGIN_POOL = OriginConnectionPool(args.pool_size, args.pool_idle_timeout)
+        if not args.no_cache:
+            RESPONSE_CACHE = ProxyCache(args.cache_dir, args.cache_memory_size, args.cache_disk_size)
+        threading.Thread(target=run_pool_reaper, args=(ORIGIN_POOL,), daemon=True).start()
+    else:
+        ASYNC_ORIGIN_POOL = AsyncOriginConnectionPool(args.pool_size, args.pool_idle_timeout)
+
+    # Create a TCP/IP socket for the proxy server
+    proxy_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    proxy_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # Bind the proxy server to the port
+    proxy_server.bind((args.host, args.port))
+
+    # Listen for incoming connections
+    proxy_server.listen(LISTEN_BACKLOG)
+    print(f"Proxy server is running on http://localhost:{args.port} ({args.mode} mode)")
+
+    # SIGTERM stops the proxy like Ctrl-C, so the statistics are still printed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # Start the proxy server
+    try:
+        if args.mode == 'async':
+            asyncio.run(start_async_proxy_server(proxy_server, args.max_connections))
+        else:
+            start_proxy_server(proxy_server)
+    except KeyboardInterrupt:
+        print("Proxy server stopped.")
+        pool = ASYNC_ORIGIN_POOL if args.mode == 'async' else ORIGIN_POOL
+        print(f"Origin pool: {pool.stats()}")
+        if RESPONSE_CACHE is not None:
+            print(f"Response cache: {RESPONSE_CACHE.stats()}")
+    finally:
+        proxy_server.close()
+        if ACCESS_LOG is not None:
+            ACCESS_LOG.close()
+            print(f"Access log: {ACCESS_LOG.stats()}")
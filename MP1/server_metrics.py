@@ -0,0 +1,111 @@
+import threading
+import time
+
+# Metrics defaults
+METRICS_PATH = '/metrics'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Latency histogram with fixed bucket bounds: observe() adds one count, so memory
+# stays constant however many requests are served
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    # Function to write the histogram in the Prometheus text format, with
+    # cumulative bucket counts
+    def render(self, name, labels=''):
+        lines = []
+        cumulative = 0
+        separator = ',' if labels else ''
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+# Request metrics of one server process: requests by status, a latency
+# histogram, bytes sent, open connections and timings of upstream work (e.g. a
+# proxy connecting to an origin). Updates take a lock for a few additions only.
+class ServerMetrics:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.requests = {}            # status code -> count
+        self.latency = Histogram()
+        self.bytes_sent = 0
+        self.connections = 0
+        self.active_connections = 0
+        self.upstream = {}            # phase -> Histogram
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    # Function to count a finished request: its status, duration in seconds and
+    # the bytes sent for it (head and body)
+    def observe_request(self, status, duration, bytes_sent):
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.latency.observe(duration)
+            self.bytes_sent += bytes_sent
+
+    # Function to time one phase of upstream work, e.g. 'connect' or 'response_head'
+    def observe_upstream(self, phase, duration):
+        with self.lock:
+            histogram = self.upstream.get(phase)
+            if histogram is None:
+                histogram = self.upstream[phase] = Histogram()
+            histogram.observe(duration)
+
+    # Function to render every metric in the Prometheus text exposition format.
+    # extra maps a metric family to a stats() dict (e.g. a cache's counters);
+    # its numeric values are added as gauges named <prefix>_<family>_<key>.
+    def render(self, extra=None):
+        prefix = self.prefix
+        with self.lock:
+            lines = [f'# TYPE {prefix}_requests_total counter']
+            for status, count in sorted(self.requests.items()):
+                lines.append(f'{prefix}_requests_total{{status="{status}"}} {count}')
+            lines.append(f'# TYPE {prefix}_request_duration_seconds histogram')
+            lines += self.latency.render(f'{prefix}_request_duration_seconds')
+            lines.append(f'# TYPE {prefix}_response_bytes_total counter')
+            lines.append(f'{prefix}_response_bytes_total {self.bytes_sent}')
+            lines.append(f'# TYPE {prefix}_connections_total counter')
+            lines.append(f'{prefix}_connections_total {self.connections}')
+            lines.append(f'# TYPE {prefix}_active_connections gauge')
+            lines.append(f'{prefix}_active_connections {self.active_connections}')
+            if self.upstream:
+                lines.append(f'# TYPE {prefix}_upstream_duration_seconds histogram')
+                for phase, histogram in sorted(self.upstream.items()):
+                    lines += histogram.render(f'{prefix}_upstream_duration_seconds', f'phase="{phase}"')
+        lines.append(f'# TYPE {prefix}_uptime_seconds gauge')
+        lines.append(f'{prefix}_uptime_seconds {time.time() - self.started:.3f}')
+        for family, stats in (extra or {}).items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'{prefix}_{family}_{key} {value}')
+        return "\n".join(lines) + "\n"
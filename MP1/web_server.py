@@ -1,137 +1,844 @@
+import argparse
+import asyncio
 import socket
 import os
-from datetime import datetime, timezone
+import re
+import signal
+import sys
 from email.utils import parsedate_to_datetime
+from functools import lru_cache
 import threading
 import time
 
-# Function to handle request validation and response generation
-def handle_request(client_connection):
-    try:
-        # Receive the request from the client
-        request = client_connection.recv(1024).decode('utf-8')
-        print(f"Raw request: {request}")
+from access_log import AccessLogger, AccessRecord, ACCESS_LOG_FORMATS
+from file_cache import FileCache, CACHE_MAX_BYTES, CACHE_MAX_FILE_SIZE, CACHE_REVALIDATE_INTERVAL, COMPRESS_MIN_SIZE
+from http_parser import HttpParser, HttpParseError
+from server_metrics import ServerMetrics, METRICS_PATH, METRICS_CONTENT_TYPE
+
+# Server configuration
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 8080
+LISTEN_BACKLOG = socket.SOMAXCONN
+MAX_CONNECTIONS = 1000
+ACCEPT_POLL_INTERVAL = 0.5      # Seconds between shutdown checks while waiting to accept
+WORKER_RESTART_DELAY = 1.0      # Seconds a crashing worker waits before it is restarted
+
+# Set once a graceful shutdown has been requested (SIGTERM)
+SHUTDOWN_EVENT = threading.Event()
+
+# Persistent connection settings
+KEEP_ALIVE_TIMEOUT = 5          # Seconds an idle connection is kept open
+MAX_KEEP_ALIVE_REQUESTS = 100   # Requests served before the connection is closed
+
+# Request reading limits
+RECV_BUFFER_SIZE = 65536
+MAX_REQUEST_HEAD_SIZE = 16384   # Largest request line + headers accepted (431 beyond)
+MAX_REQUEST_BODY_SIZE = 1024 * 1024  # Largest request body accepted (413 beyond)
+REQUEST_READ_TIMEOUT = 10       # Seconds a started request has to arrive completely (408 after)
+SEND_TIMEOUT = 30               # Seconds a blocked send may wait (threaded engine)
+
+# Optional pacing of file bodies (off by default). When PACING_DELAY > 0 the body
+# is sent in PACING_CHUNK_SIZE slices with PACING_DELAY seconds between them,
+# which reproduces the original throttled HOL-blocking experiment.
+PACING_DELAY = 0
+PACING_CHUNK_SIZE = 1024
+
+# Cache-Control sent with every 200/206/304. "no-cache" lets browsers and CDNs
+# store files but revalidate them (ETag / Last-Modified) before each reuse.
+CACHE_CONTROL = "no-cache"
+
+# Response compression. Encodings are listed in order of preference.
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = COMPRESS_MIN_SIZE
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+# Static file cache shared by all connections
+FILE_CACHE = FileCache()
+
+# Access log: one line per request, written by a background thread in each
+# server process. ACCESS_LOG_PATH is a file to append to, '-' for stdout, or
+# None for no access log.
+ACCESS_LOG_PATH = '-'
+ACCESS_LOG_FORMAT = 'common'
+ACCESS_LOG = None               # AccessLogger of this process, started by serve()
+
+# Request metrics of this process, served at METRICS_PATH
+METRICS = ServerMetrics('http')
+
+# Describes how a request will be answered; built by route_request
+class Response:
+    def __init__(self, status_code, keep_alive=True, entry=None):
+        self.status_code = status_code
+        self.keep_alive = keep_alive
+        self.entry = entry       # CachedFile being served
+        self.body = entry        # Representation sent: the file itself or a compressed variant
+        self.content_encoding = None
+        self.file_size = 0
+        self.offset = 0          # First byte of the file to send
+        self.length = 0          # Number of bytes of the file to send
+        self.content_range = None
+        self.content = None      # Generated body (the metrics endpoint) instead of a file
+
+# Byte positions in a Range header: ASCII digits only, as str.isdigit() would
+# also accept characters such as '²' that int() rejects
+RANGE_POSITION = re.compile(r'[0-9]+')
+
+# Function to parse a single "bytes=" Range header against a file size.
+# Returns (first_byte, last_byte), None when the header should be ignored
+# (malformed or multiple ranges, so the whole file is sent), or raises
+# ValueError when the range cannot be satisfied.
+def parse_range(range_header, file_size):
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if (not (first or last) or (first and not RANGE_POSITION.fullmatch(first))
+            or (last and not RANGE_POSITION.fullmatch(last))):
+        return None
+
+    if first == "":
+        # Suffix range: the last N bytes of the file
+        suffix_length = int(last)
+        if suffix_length == 0 or file_size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, file_size - suffix_length), file_size - 1
 
-        request_lines = request.splitlines()
+    first_byte = int(first)
+    if last and int(last) < first_byte:
+        return None
+    if first_byte >= file_size:
+        raise ValueError("Unsatisfiable range")
+    last_byte = int(last) if last else file_size - 1
+    return first_byte, min(last_byte, file_size - 1)
 
-        if len(request_lines) > 0:
+# Function to parse an HTTP date; clients repeat the same If-Modified-Since value,
+# so parsed dates are memoized
+@lru_cache(maxsize=256)
+def parse_http_date(value):
+    return parsedate_to_datetime(value)
+
+# Function to choose a Content-Encoding from an Accept-Encoding header.
+# Returns the supported encoding with the highest q-value, or None for identity.
+@lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding):
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        qvalue = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip().lower() == "q":
             try:
-                method, path, version = request_lines[0].split()
+                qvalue = float(value)
             except ValueError:
-                client_connection.sendall(generate_response(400).encode('utf-8'))
-                return
-
-            if path == '/':
-                path = '/test.html'  # Serve test.html by default
-
-            if method not in ['GET']:
-                client_connection.sendall(generate_response(501).encode('utf-8'))
-                return
-
-            if version != "HTTP/1.1":
-                client_connection.sendall(generate_response(400).encode('utf-8'))
-                return
-
-            headers = {}
-            for line in request_lines[1:]:
-                if ":" in line:
-                    key, value = line.split(":", 1)  # Split only on the first colon
-                    headers[key.strip()] = value.strip()
-
-            if "Host" not in headers:
-                client_connection.sendall(generate_response(400).encode('utf-8'))
-                return
-
-            if method == 'GET':
-                if_modified_since = headers.get("If-Modified-Since", None)
-                file_path = '.' + path
-
-                if os.path.isfile(file_path):
-                    if if_modified_since:
-                        try:
-                            # Log the If-Modified-Since header
-                            print(f"Received If-Modified-Since header: {if_modified_since}")
-
-                            # Parse the If-Modified-Since header
-                            if_modified_since_dt = parsedate_to_datetime(if_modified_since)
-
-                            if if_modified_since_dt is None:
-                                print("Failed to parse the If-Modified-Since header correctly.")
-                                client_connection.sendall(generate_response(400).encode('utf-8'))
-                                return
-
-                            # Get the file's modification time
-                            file_modified_time = datetime.fromtimestamp(os.path.getmtime(file_path), timezone.utc)
-                            print(f"File modification time: {file_modified_time}")
-
-                            # Compare file modification time with If-Modified-Since header
-                            if file_modified_time <= if_modified_since_dt:
-                                client_connection.sendall(generate_response(304).encode('utf-8'))
-                                return
-                        except (TypeError, ValueError) as e:
-                            print(f"Error parsing If-Modified-Since header: {e}")
-                            client_connection.sendall(generate_response(400).encode('utf-8'))
-                            return
-
-                    # Return 200 OK with file content
-                    with open(file_path, 'rb') as file:
-                        content = file.read()
-                    
-                    # Send response in chunks to simulate HOL blocking avoidance
-                    client_connection.sendall("HTTP/1.1 200 OK\r\n".encode('utf-8'))
-                    client_connection.sendall("Content-Type: text/html\r\n\r\n".encode('utf-8'))
-                    
-                    for i in range(0, len(content), 1024):
-                        client_connection.sendall(content[i:i+1024])
-                        time.sleep(0.1)  # Simulate delay between sending chunks
-
-                    return
-
-                else:
-                    client_connection.sendall(generate_response(404).encode('utf-8'))
-                    return
+                qvalue = 0.0
+        qvalues[coding] = qvalue
+
+    best_encoding, best_qvalue = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        qvalue = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if qvalue > best_qvalue:
+            best_encoding, best_qvalue = encoding, qvalue
+    return best_encoding
+
+# Function to check an If-None-Match list against an ETag using weak comparison
+def etag_in_list(header_value, etag):
+    if header_value.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque_tag:
+            return True
+    return False
+
+# Function to check If-Range: a strong ETag must match exactly, a date must equal Last-Modified
+def if_range_matches(if_range, response):
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == response.body.etag
+    if if_range.startswith('W/'):
+        return False
+    return if_range == response.entry.last_modified
+
+# Function to validate a parsed request and decide which response it gets
+def route_request(request):
+    path = request.target
+    if path == '/':
+        path = '/test.html'  # Serve test.html by default
+
+    # HTTP/1.1 connections are persistent unless the client asks to close
+    keep_alive = not request.has_connection_token("close")
+
+    if request.method not in ['GET']:
+        return Response(501, keep_alive)
+
+    if request.version != "HTTP/1.1":
+        return Response(400, keep_alive=False)
+
+    if request.get_header("Host") is None:
+        return Response(400, keep_alive=False)
+
+    if path == METRICS_PATH:
+        response = Response(200, keep_alive)
+        response.content = METRICS.render({
+            'file_cache': FILE_CACHE.stats(),
+            'access_log': ACCESS_LOG.stats() if ACCESS_LOG is not None else {},
+        }).encode('utf-8')
+        response.length = len(response.content)
+        return response
+
+    if_none_match = request.get_header("If-None-Match")
+    if_modified_since = request.get_header("If-Modified-Since")
+    file_path = '.' + path
+
+    entry = FILE_CACHE.lookup(file_path)
+    if entry is None:
+        return Response(404, keep_alive)
+
+    # Pick the representation first: validators belong to the bytes actually sent
+    response = Response(200, keep_alive, entry)
+    accept_encoding = request.get_header("Accept-Encoding")
+    if COMPRESSION_ENABLED and accept_encoding:
+        encoding = negotiate_encoding(accept_encoding)
+        variant = FILE_CACHE.compressed(entry, encoding, COMPRESSION_MIN_SIZE) if encoding else None
+        if variant is not None:
+            response.body = variant
+            response.content_encoding = encoding
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110, section 13.2.2)
+    if if_none_match is not None:
+        if etag_in_list(if_none_match, response.body.etag):
+            response.status_code = 304
+            return response
+
+    elif if_modified_since:
+        try:
+            # Parse the If-Modified-Since header
+            if_modified_since_dt = parse_http_date(if_modified_since)
+
+            if if_modified_since_dt is None:
+                return Response(400, keep_alive=False)
+
+            # Get the file's modification time
+            file_modified_time = entry.modified_time
+
+            # Compare file modification time with If-Modified-Since header
+            if file_modified_time <= if_modified_since_dt:
+                response.status_code = 304
+                return response
+        except (TypeError, ValueError):
+            return Response(400, keep_alive=False)
+
+    response.file_size = response.body.size
+    response.length = response.file_size
+
+    # A Range is only honoured if If-Range (when sent) still names this version
+    range_header = request.get_header("Range")
+    if_range = request.get_header("If-Range")
+    if range_header and (if_range is None or if_range_matches(if_range, response)):
+        try:
+            byte_range = parse_range(range_header, response.file_size)
+        except ValueError:
+            response.status_code = 416
+            response.content_range = f"bytes */{response.file_size}"
+            return response
+
+        if byte_range is not None:
+            first_byte, last_byte = byte_range
+            response.status_code = 206
+            response.offset = first_byte
+            response.length = last_byte - first_byte + 1
+            response.content_range = f"bytes {first_byte}-{last_byte}/{response.file_size}"
+
+    return response
+
+# Function to send the file part of a 200/206 response (thread-per-connection engine).
+# Cached files are sent straight from memory. Other files go through
+# socket.sendfile(), which hands the copy to the kernel with os.sendfile(), so the
+# file is never read into Python memory; where sendfile is unavailable it falls
+# back to buffered send() internally.
+def send_file_body(client_connection, response):
+    end = response.offset + response.length
+
+    if response.body.content is not None:
+        body = memoryview(response.body.content)
+        if PACING_DELAY <= 0:
+            client_connection.sendall(body[response.offset:end])
+            return
+
+        # Optional pacing mode: send fixed-size slices with a delay in between
+        for offset in range(response.offset, end, PACING_CHUNK_SIZE):
+            client_connection.sendall(body[offset:min(offset + PACING_CHUNK_SIZE, end)])
+            time.sleep(PACING_DELAY)
+        return
+
+    with open(response.body.path, 'rb') as file:
+        if PACING_DELAY <= 0:
+            client_connection.sendfile(file, response.offset, response.length)
+            return
+
+        for offset in range(response.offset, end, PACING_CHUNK_SIZE):
+            client_connection.sendfile(file, offset, min(PACING_CHUNK_SIZE, end - offset))
+            time.sleep(PACING_DELAY)
+
+# Function to send the file part of a 200/206 response (async engine).
+# loop.sock_sendfile() also uses os.sendfile() on the non-blocking socket.
+async def send_file_body_async(client_connection, response):
+    loop = asyncio.get_running_loop()
+    end = response.offset + response.length
+
+    if response.body.content is not None:
+        body = memoryview(response.body.content)
+        if PACING_DELAY <= 0:
+            await loop.sock_sendall(client_connection, body[response.offset:end])
+            return
+
+        for offset in range(response.offset, end, PACING_CHUNK_SIZE):
+            await loop.sock_sendall(client_connection, body[offset:min(offset + PACING_CHUNK_SIZE, end)])
+            await asyncio.sleep(PACING_DELAY)  # Same pacing as the threaded engine, without holding a thread
+        return
+
+    with open(response.body.path, 'rb') as file:
+        if PACING_DELAY <= 0:
+            await loop.sock_sendfile(client_connection, file, response.offset, response.length)
+            return
+
+        for offset in range(response.offset, end, PACING_CHUNK_SIZE):
+            await loop.sock_sendfile(client_connection, file, offset, min(PACING_CHUNK_SIZE, end - offset))
+            await asyncio.sleep(PACING_DELAY)
+
+# Function to pick the recv() timeout: an idle connection waits KEEP_ALIVE_TIMEOUT
+# for its next request, a request that has started must finish within
+# REQUEST_READ_TIMEOUT of its first byte (so slow partial headers can't hold a slot)
+def receive_timeout(parser, request_started):
+    if not parser.in_progress():
+        return KEEP_ALIVE_TIMEOUT
+    return request_started + REQUEST_READ_TIMEOUT - time.monotonic()
+
+# Function to count a finished request in the metrics and queue its access log
+# line; request is None when the request could not be parsed
+def record_request(client, request, status_code, bytes_sent, started):
+    duration = time.monotonic() - started
+    METRICS.observe_request(status_code, duration, bytes_sent)
+    if ACCESS_LOG is not None:
+        if request is None:
+            ACCESS_LOG.log(AccessRecord(client, None, None, None, status_code, bytes_sent, duration))
+        else:
+            ACCESS_LOG.log(AccessRecord(client, request.method, request.target, request.version, status_code,
+                                        bytes_sent, duration))
+
+# Function to give the number of response bytes sent for a routed request
+def response_size(head, response):
+    if response.content is not None or response.status_code in (200, 206):
+        return len(head) + response.length
+    return len(head)
+
+# Function to handle request validation and response generation (thread-per-connection engine).
+# The connection stays open for further (possibly pipelined) requests until the
+# client closes it, asks for "Connection: close", goes idle, or hits the request limit.
+def handle_request(client_connection, connection_slots=None):
+    METRICS.connection_opened()
+    try:
+        client = client_connection.getpeername()[0]
+        # Headers and body are separate writes; don't let Nagle hold back the body
+        client_connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        parser = HttpParser(max_header_size=MAX_REQUEST_HEAD_SIZE, max_body_size=MAX_REQUEST_BODY_SIZE)
+        request_started = time.monotonic()
+        requests_served = 0
+        keep_alive = True
+
+        while keep_alive:
+            try:
+                request = parser.next_message()
+            except HttpParseError as e:
+                error = generate_response(e.status_code).encode('utf-8')
+                client_connection.settimeout(SEND_TIMEOUT)
+                client_connection.sendall(error)
+                record_request(client, None, e.status_code, len(error), request_started)
+                break
+
+            if request is None:
+                if SHUTDOWN_EVENT.is_set() and not parser.in_progress():
+                    break  # Draining: don't wait for another request
+
+                # Receive more of the request from the client
+                timeout = receive_timeout(parser, request_started)
+                try:
+                    if timeout <= 0:
+                        raise socket.timeout
+                    client_connection.settimeout(timeout)
+                    data = client_connection.recv(RECV_BUFFER_SIZE)
+                except socket.timeout:
+                    if parser.in_progress():
+                        error = generate_response(408).encode('utf-8')
+                        client_connection.settimeout(SEND_TIMEOUT)
+                        client_connection.sendall(error)
+                        record_request(client, None, 408, len(error), request_started)
+                    break  # Idle keep-alive connection or a request that never finished
+                if not data:
+                    break  # Client closed the connection
+                if not parser.in_progress():
+                    request_started = time.monotonic()
+                parser.feed(data)
+                continue
+
+            # Any pipelined bytes already buffered count as the next request starting now
+            request_started = time.monotonic()
+
+            response = route_request(request)
+
+            requests_served += 1
+            if requests_served >= MAX_KEEP_ALIVE_REQUESTS or SHUTDOWN_EVENT.is_set():
+                response.keep_alive = False
+            keep_alive = response.keep_alive
+
+            head = generate_response_head(response).encode('utf-8')
+            client_connection.settimeout(SEND_TIMEOUT)
+            client_connection.sendall(head)
+            if response.content is not None:
+                client_connection.sendall(response.content)
+            elif response.status_code in (200, 206):
+                send_file_body(client_connection, response)
+            record_request(client, request, response.status_code, response_size(head, response), request_started)
 
+    except OSError as e:
+        print(f"Error handling request: {e}")
     finally:
         client_connection.close()
+        METRICS.connection_closed()
+        if connection_slots is not None:
+            connection_slots.release()
 
-# Function to generate responses based on status codes
-def generate_response(status_code, content=None):
+# Function to handle a connection on the event loop (async engine).
+# Same responses and keep-alive rules as handle_request, but every socket
+# operation yields to the loop instead of blocking a thread.
+async def handle_request_async(client_connection):
+    loop = asyncio.get_running_loop()
+    METRICS.connection_opened()
+    try:
+        client = client_connection.getpeername()[0]
+        client_connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        parser = HttpParser(max_header_size=MAX_REQUEST_HEAD_SIZE, max_body_size=MAX_REQUEST_BODY_SIZE)
+        request_started = time.monotonic()
+        requests_served = 0
+        keep_alive = True
+
+        while keep_alive:
+            try:
+                request = parser.next_message()
+            except HttpParseError as e:
+                error = generate_response(e.status_code).encode('utf-8')
+                await loop.sock_sendall(client_connection, error)
+                record_request(client, None, e.status_code, len(error), request_started)
+                break
+
+            if request is None:
+                if SHUTDOWN_EVENT.is_set() and not parser.in_progress():
+                    break
+
+                timeout = receive_timeout(parser, request_started)
+                try:
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError
+                    data = await asyncio.wait_for(loop.sock_recv(client_connection, RECV_BUFFER_SIZE), timeout)
+                except asyncio.TimeoutError:
+                    if parser.in_progress():
+                        error = generate_response(408).encode('utf-8')
+                        await loop.sock_sendall(client_connection, error)
+                        record_request(client, None, 408, len(error), request_started)
+                    break
+                if not data:
+                    break
+                if not parser.in_progress():
+                    request_started = time.monotonic()
+                parser.feed(data)
+                continue
+
+            request_started = time.monotonic()
+
+            response = route_request(request)
+
+            requests_served += 1
+            if requests_served >= MAX_KEEP_ALIVE_REQUESTS or SHUTDOWN_EVENT.is_set():
+                response.keep_alive = False
+            keep_alive = response.keep_alive
+
+            head = generate_response_head(response).encode('utf-8')
+            await loop.sock_sendall(client_connection, head)
+            if response.content is not None:
+                await loop.sock_sendall(client_connection, response.content)
+            elif response.status_code in (200, 206):
+                await send_file_body_async(client_connection, response)
+            record_request(client, request, response.status_code, response_size(head, response), request_started)
+
+    except OSError as e:
+        print(f"Error handling request: {e}")
+    finally:
+        client_connection.close()
+        METRICS.connection_closed()
+
+# Function to build the Connection header for a response
+def connection_header(keep_alive):
+    return "Connection: keep-alive\r\n" if keep_alive else "Connection: close\r\n"
+
+# Function to build the headers describing the representation being sent
+def generate_entity_headers(response):
+    headers = (response.entry.headers +
+               f"ETag: {response.body.etag}\r\n"
+               f"Cache-Control: {CACHE_CONTROL}\r\n")
+    if response.content_encoding:
+        headers += f"Content-Encoding: {response.content_encoding}\r\n"
+    if COMPRESSION_ENABLED and response.entry.compressible:
+        headers += "Vary: Accept-Encoding\r\n"
+    return headers
+
+# Function to build everything in front of the file body for a routed request
+def generate_response_head(response):
+    if response.content is not None:
+        return ("HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {METRICS_CONTENT_TYPE}\r\n"
+                "Cache-Control: no-store\r\n"
+                f"Content-Length: {response.length}\r\n"
+                + connection_header(response.keep_alive) + "\r\n")
+
+    elif response.status_code == 200:
+        return ("HTTP/1.1 200 OK\r\n"
+                + generate_entity_headers(response) +
+                "Accept-Ranges: bytes\r\n"
+                f"Content-Length: {response.length}\r\n"
+                + connection_header(response.keep_alive) + "\r\n")
+
+    elif response.status_code == 206:
+        return ("HTTP/1.1 206 Partial Content\r\n"
+                + generate_entity_headers(response) +
+                "Accept-Ranges: bytes\r\n"
+                f"Content-Range: {response.content_range}\r\n"
+                f"Content-Length: {response.length}\r\n"
+                + connection_header(response.keep_alive) + "\r\n")
+
+    elif response.status_code == 304 and response.entry is not None:
+        # Validators and caching directives a 200 would have carried
+        headers = (f"ETag: {response.body.etag}\r\n"
+                   f"Last-Modified: {response.entry.last_modified}\r\n"
+                   f"Cache-Control: {CACHE_CONTROL}\r\n")
+        if COMPRESSION_ENABLED and response.entry.compressible:
+            headers += "Vary: Accept-Encoding\r\n"
+        return "HTTP/1.1 304 Not Modified\r\n" + headers + connection_header(response.keep_alive) + "\r\n"
+
+    elif response.status_code == 416:
+        return generate_error_response("416 Range Not Satisfiable", response.keep_alive,
+                                       f"Content-Range: {response.content_range}\r\n")
+
+    return generate_response(response.status_code, keep_alive=response.keep_alive)
+
+# Function to generate responses based on status codes.
+# Every response carries Content-Length (or has no body) so it can be framed on a
+# persistent connection.
+def generate_response(status_code, content=None, keep_alive=False):
     if status_code == 200:
-        response_line = "HTTP/1.1 200 OK\r\n"
-        headers = "Content-Type: text/html\r\n\r\n"
-        return response_line + headers + content.decode('utf-8')
-    
+        return ("HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/html\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                + connection_header(keep_alive) + "\r\n" + content.decode('utf-8'))
+
     elif status_code == 304:
-        return "HTTP/1.1 304 Not Modified\r\n\r\n"
+        return "HTTP/1.1 304 Not Modified\r\n" + connection_header(keep_alive) + "\r\n"
 
     elif status_code == 400:
-        return "HTTP/1.1 400 Bad Request\r\n\r\n<h1>400 Bad Request</h1>"
-    
+        return generate_error_response("400 Bad Request", keep_alive)
+
     elif status_code == 404:
-        return "HTTP/1.1 404 Not Found\r\n\r\n<h1>404 Not Found</h1>"
+        return generate_error_response("404 Not Found", keep_alive)
+
+    elif status_code == 408:
+        return generate_error_response("408 Request Timeout", keep_alive)
+
+    elif status_code == 413:
+        return generate_error_response("413 Content Too Large", keep_alive)
+
+    elif status_code == 431:
+        return generate_error_response("431 Request Header Fields Too Large", keep_alive)
 
     elif status_code == 501:
-        return "HTTP/1.1 501 Not Implemented\r\n\r\n<h1>501 Not Implemented</h1>"
+        return generate_error_response("501 Not Implemented", keep_alive)
+
+# Function to generate an error response with a small HTML body
+def generate_error_response(status, keep_alive=False, extra_headers=""):
+    body = f"<h1>{status}</h1>"
+    return (f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            + extra_headers
+            + connection_header(keep_alive) + "\r\n" + body)
+
+# Function to create the listening socket. With reuse_port every worker process
+# binds its own socket to the same port and the kernel spreads connections over them.
+def create_server_socket(host=SERVER_HOST, port=SERVER_PORT, backlog=LISTEN_BACKLOG, reuse_port=False):
+    # Create a TCP/IP socket
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
-# Create a TCP/IP socket
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Bind the socket to the port
+    server_socket.bind((host, port))
 
-# Bind the socket to the port
-server_socket.bind(('0.0.0.0', 8080))  # Binds to all available interfaces
+    # Listen for incoming connections; a deep backlog absorbs connection bursts
+    server_socket.listen(backlog)
+    return server_socket
 
-# Listen for incoming connections
-server_socket.listen(5)
-print("Server is running on http://localhost:8080")
+# Function to begin a graceful shutdown: stop accepting, finish in-flight requests
+# and close persistent connections after their current response
+def request_shutdown(signum=None, frame=None):
+    SHUTDOWN_EVENT.set()
 
 # Handle multiple client connections using threads
-def start_server():
-    while True:
-        client_connection, client_address = server_socket.accept()
-        print(f"New connection from {client_address}")
+def start_server(server_socket, max_connections=MAX_CONNECTIONS):
+    # Bound the number of live handler threads; once the limit is reached new
+    # connections wait in the listen backlog instead of spawning more threads
+    connection_slots = threading.BoundedSemaphore(max_connections)
+    client_threads = []
+
+    # Poll so a shutdown request is noticed while waiting in accept()
+    server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+    while not SHUTDOWN_EVENT.is_set():
+        if not connection_slots.acquire(timeout=ACCEPT_POLL_INTERVAL):
+            continue
+        try:
+            client_connection, client_address = server_socket.accept()
+        except socket.timeout:
+            connection_slots.release()
+            continue
 
         # Create a new thread for each client connection
-        client_thread = threading.Thread(target=handle_request, args=(client_connection,))
+        client_thread = threading.Thread(target=handle_request, args=(client_connection, connection_slots))
         client_thread.start()
+        client_threads = [thread for thread in client_threads if thread.is_alive()]
+        client_threads.append(client_thread)
+
+    # Drain: wait for the connections that are still being served
+    print(f"Draining {len(client_threads)} connection(s)...")
+    for client_thread in client_threads:
+        client_thread.join()
+
+# Handle multiple client connections on a single event loop
+async def start_async_server(server_socket, max_connections=MAX_CONNECTIONS):
+    loop = asyncio.get_running_loop()
+    server_socket.setblocking(False)
+
+    # Same connection limit as the threaded engine: stop accepting while all slots are busy
+    connection_slots = asyncio.Semaphore(max_connections)
+    active_tasks = set()
+
+    def release_slot(task):
+        active_tasks.discard(task)
+        connection_slots.release()
+
+    async def accept_connections():
+        while True:
+            await connection_slots.acquire()
+            client_connection, client_address = await loop.sock_accept(server_socket)
+
+            task = asyncio.create_task(handle_request_async(client_connection))
+            active_tasks.add(task)
+            task.add_done_callback(release_slot)
+
+    accept_task = asyncio.create_task(accept_connections())
+
+    def stop_accepting():
+        request_shutdown()
+        accept_task.cancel()
+
+    loop.add_signal_handler(signal.SIGTERM, stop_accepting)
+    try:
+        await accept_task
+    except asyncio.CancelledError:
+        pass
+
+    # Drain: wait for the connections that are still being served
+    print(f"Draining {len(active_tasks)} connection(s)...")
+    if active_tasks:
+        await asyncio.gather(*active_tasks, return_exceptions=True)
+
+# Function to run one server process with the selected engine. The access log
+# writer is a thread, so each process (each forked worker) starts its own.
+def serve(server_socket, mode, max_connections):
+    global ACCESS_LOG
+    if ACCESS_LOG_PATH:
+        ACCESS_LOG = AccessLogger(ACCESS_LOG_PATH, ACCESS_LOG_FORMAT)
+    try:
+        if mode == 'async':
+            asyncio.run(start_async_server(server_socket, max_connections))
+        else:
+            signal.signal(signal.SIGTERM, request_shutdown)
+            start_server(server_socket, max_connections)
+    finally:
+        if ACCESS_LOG is not None:
+            ACCESS_LOG.close()
+            print(f"Access log: {ACCESS_LOG.stats()}")
+            ACCESS_LOG = None
+
+# Function to run a worker process forked by the supervisor
+def run_worker(worker_id, server_socket, args):
+    # The supervisor turns Ctrl+C into SIGTERM for every worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if server_socket is None:
+        server_socket = create_server_socket(args.host, args.port, args.backlog, reuse_port=True)
+    print(f"Worker {worker_id} (pid {os.getpid()}) started")
+    try:
+        serve(server_socket, args.mode, args.max_connections)
+    finally:
+        server_socket.close()
+    print(f"Worker {worker_id} (pid {os.getpid()}) stopped. File cache: {FILE_CACHE.stats()}")
+
+# Prefork supervisor: starts args.workers processes that share the port, restarts
+# any that exit unexpectedly, and on SIGTERM/SIGINT tells them all to drain
+def run_supervisor(args):
+    if not hasattr(os, 'fork'):
+        raise SystemExit("Worker processes need os.fork(); run with --workers 1 on this platform")
+
+    # Without SO_REUSEPORT the workers inherit one listening socket and share its accept queue
+    server_socket = None
+    if not args.reuse_port:
+        server_socket = create_server_socket(args.host, args.port, args.backlog)
+
+    workers = {}      # pid -> worker id
+    started_at = {}   # worker id -> start time
+    stopping = False
+
+    def start_worker(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(worker_id, server_socket, args)
+            except BaseException as e:
+                print(f"Worker {worker_id} crashed: {e!r}")
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        workers[pid] = worker_id
+        started_at[worker_id] = time.monotonic()
+
+    def stop_workers(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print("Supervisor shutting down; draining workers...")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    for worker_id in range(args.workers):
+        start_worker(worker_id)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = workers.pop(pid)
+        if stopping:
+            continue
+
+        print(f"Worker {worker_id} (pid {pid}) exited with status {status}; restarting")
+        # Don't spin if a worker dies immediately after starting
+        if time.monotonic() - started_at[worker_id] < WORKER_RESTART_DELAY:
+            time.sleep(WORKER_RESTART_DELAY)
+        if not stopping:
+            start_worker(worker_id)
+
+    if server_socket is not None:
+        server_socket.close()
+    print("Server stopped.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simple HTTP web server")
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded',
+                        help="connection engine: thread per connection or a single event loop")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (more than 1 starts a prefork supervisor)")
+    parser.add_argument('--reuse-port', action='store_true',
+                        help="give each worker its own SO_REUSEPORT socket instead of sharing one")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG,
+                        help="listen() backlog for pending connections")
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help="maximum number of connections served at once")
+    parser.add_argument('--keep-alive-timeout', type=float, default=KEEP_ALIVE_TIMEOUT,
+                        help="seconds an idle persistent connection is kept open")
+    parser.add_argument('--request-timeout', type=float, default=REQUEST_READ_TIMEOUT,
+                        help="seconds a started request has to arrive completely")
+    parser.add_argument('--max-keep-alive-requests', type=int, default=MAX_KEEP_ALIVE_REQUESTS,
+                        help="requests served on one connection before it is closed")
+    parser.add_argument('--pace-delay', type=float, default=PACING_DELAY,
+                        help="seconds to wait between body chunks (0 disables pacing)")
+    parser.add_argument('--pace-chunk-size', type=int, default=PACING_CHUNK_SIZE,
+                        help="bytes per chunk when pacing is enabled")
+    parser.add_argument('--cache-size', type=int, default=CACHE_MAX_BYTES,
+                        help="bytes of file contents kept in the in-memory cache")
+    parser.add_argument('--cache-max-file-size', type=int, default=CACHE_MAX_FILE_SIZE,
+                        help="largest file whose contents are cached")
+    parser.add_argument('--cache-revalidate', type=float, default=CACHE_REVALIDATE_INTERVAL,
+                        help="seconds before a cached file is re-checked on disk")
+    parser.add_argument('--cache-control', default=CACHE_CONTROL,
+                        help="Cache-Control header value for file responses")
+    parser.add_argument('--no-compression', action='store_true',
+                        help="never compress responses")
+    parser.add_argument('--compress-min-size', type=int, default=COMPRESSION_MIN_SIZE,
+                        help="smallest file (bytes) worth compressing")
+    parser.add_argument('--access-log', default=ACCESS_LOG_PATH,
+                        help="file the access log is appended to, '-' for stdout")
+    parser.add_argument('--access-log-format', choices=ACCESS_LOG_FORMATS, default=ACCESS_LOG_FORMAT,
+                        help="Common Log Format or one JSON object per line")
+    parser.add_argument('--no-access-log', action='store_true', help="don't write an access log")
+    parser.add_argument('--metrics-path', default=METRICS_PATH,
+                        help="path that serves the request metrics instead of a file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    KEEP_ALIVE_TIMEOUT = args.keep_alive_timeout
+    MAX_KEEP_ALIVE_REQUESTS = args.max_keep_alive_requests
+    REQUEST_READ_TIMEOUT = args.request_timeout
+    PACING_DELAY = args.pace_delay
+    PACING_CHUNK_SIZE = args.pace_chunk_size
+    CACHE_CONTROL = args.cache_control
+    COMPRESSION_ENABLED = not args.no_compression
+    COMPRESSION_MIN_SIZE = args.compress_min_size
+    ACCESS_LOG_PATH = None if args.no_access_log else args.access_log
+    ACCESS_LOG_FORMAT = args.access_log_format
+    METRICS_PATH = args.metrics_path
+    FILE_CACHE = FileCache(args.cache_size, args.cache_max_file_size, args.cache_revalidate)
+
+    if args.workers > 1:
+        print(f"Server is running on http://localhost:{args.port} ({args.workers} {args.mode} workers)")
+        run_supervisor(args)
+    else:
+        server_socket = create_server_socket(args.host, args.port, args.backlog)
+        print(f"Server is running on http://localhost:{args.port} ({args.mode} mode)")
 
-# Start the server
-start_server()
+        # Start the server
+        try:
+            serve(server_socket, args.mode, args.max_connections)
+            print("Server stopped.")
+        except KeyboardInterrupt:
+            print("Server stopped.")
+        finally:
+            server_socket.close()
+            print(f"File cache: {FILE_CACHE.stats()}")
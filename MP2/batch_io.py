@@ -0,0 +1,75 @@
+# batch_io.py
+
+import logging
+import selectors
+import socket
+
+# Defaults
+BATCH_SIZE = 64                 # Datagrams drained per wakeup
+SOCKET_RCVBUF = 4 * 1024 * 1024
+SOCKET_SNDBUF = 4 * 1024 * 1024
+
+log = logging.getLogger('rdt.batch_io')
+
+# recvfrom_into with MSG_DONTWAIT returns at once when the queue is empty, while
+# the socket stays blocking for sends. Windows has no MSG_DONTWAIT; there each
+# further datagram is polled with select first.
+DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Function to set the kernel socket buffer sizes (None keeps the default) and
+# return the sizes in effect. Linux doubles the value asked for and caps it at
+# net.core.rmem_max / wmem_max.
+def configure_socket_buffers(sock, rcvbuf=SOCKET_RCVBUF, sndbuf=SOCKET_SNDBUF):
+    try:
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    except OSError as e:
+        log.warning("Could not set socket buffer sizes: %s", e)
+    return (sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+
+# Batched datagram receiver: one select() wakeup, then recvfrom_into until the
+# socket's queue is empty or batch_size datagrams are in hand, each into a buffer
+# from pool. A recvmmsg-style batch in pure Python; the caller releases each
+# buffer to the pool once it is done with the datagram.
+class BatchReceiver:
+    def __init__(self, sock, pool, batch_size=BATCH_SIZE):
+        self.sock = sock
+        self.pool = pool
+        self.batch_size = batch_size
+        # Blocking mode: a timeout would make recvfrom_into wait despite MSG_DONTWAIT
+        sock.settimeout(None)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.batches = 0
+        self.datagrams = 0
+
+    # Function to wait up to timeout seconds for datagrams and return a list of
+    # (buffer, nbytes, address); empty if none arrived
+    def receive(self, timeout):
+        batch = []
+        if not self.selector.select(timeout):
+            return batch
+        while len(batch) < self.batch_size:
+            if batch and not DONTWAIT and not self.selector.select(0):
+                break
+            buffer = self.pool.acquire()
+            try:
+                nbytes, address = self.sock.recvfrom_into(buffer, 0, DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                self.pool.release(buffer)
+                break
+            except OSError:
+                # e.g. an ICMP port unreachable reported for an earlier send
+                self.pool.release(buffer)
+                break
+            batch.append((buffer, nbytes, address))
+        if batch:
+            self.batches += 1
+            self.datagrams += len(batch)
+        return batch
+
+    def close(self):
+        self.selector.close()
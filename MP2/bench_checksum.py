@@ -0,0 +1,68 @@
+# bench_checksum.py
+#
+# Micro-benchmark of the packet datapath: pack a data packet, then unpack and
+# verify it, with the original additive checksum (struct.pack and header +
+# payload concatenation) against the Internet checksum and CRC-32 of packet.py.
+#
+#   python3 bench_checksum.py [--sizes 64 1000 1400] [--packets 20000]
+
+import argparse
+import os
+import struct
+import timeit
+
+from packet import Packet, PACKET_TYPE_DATA, CHECKSUM_NAMES
+
+# The packet code sender.py and receiver.py each carried before packet.py
+class LegacyPacket:
+    def __init__(self, packet_type, seq_num, payload=b''):
+        self.packet_type = packet_type
+        self.seq_num = seq_num
+        self.payload = payload
+        self.checksum = 0
+
+    def compute_checksum(self):
+        checksum = self.packet_type + self.seq_num
+        checksum += sum(self.payload)
+        return checksum & 0xFFFF
+
+    def pack(self):
+        self.checksum = self.compute_checksum()
+        header = struct.pack('!B I H', self.packet_type, self.seq_num, self.checksum)
+        return header + self.payload
+
+    @staticmethod
+    def unpack(packet_bytes):
+        packet_type, seq_num, checksum = struct.unpack('!B I H', packet_bytes[:7])
+        packet = LegacyPacket(packet_type, seq_num, packet_bytes[7:])
+        packet.checksum = checksum
+        return packet
+
+    def is_corrupt(self):
+        return self.checksum != self.compute_checksum()
+
+# Function to time one pack + unpack + verify round in microseconds
+def time_round_trip(pack, unpack, packets):
+    def round_trip():
+        assert not unpack(pack()).is_corrupt()
+    return min(timeit.repeat(round_trip, number=packets, repeat=3)) / packets * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet checksum micro-benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 1000, 1400], help="payload sizes in bytes")
+    parser.add_argument('--packets', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'checksum':<12}{'payload':>9}{'us/packet':>12}{'MB/s':>10}")
+    for size in args.sizes:
+        payload = os.urandom(size)
+        candidates = [('legacy sum', lambda: LegacyPacket(PACKET_TYPE_DATA, 7, payload).pack(), LegacyPacket.unpack)]
+        for name, checksum_type in CHECKSUM_NAMES.items():
+            candidates.append((name, lambda checksum_type=checksum_type: Packet(PACKET_TYPE_DATA, 7, payload, checksum_type).pack(),
+                               lambda packet_bytes, checksum_type=checksum_type: Packet.unpack(packet_bytes, checksum_type)))
+        for name, pack, unpack in candidates:
+            micros = time_round_trip(pack, unpack, args.packets)
+            print(f"{name:<12}{size:>9}{micros:>12.2f}{size / micros:>10.1f}")
+
+if __name__ == "__main__":
+    main()
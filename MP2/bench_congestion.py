@@ -0,0 +1,128 @@
+# bench_congestion.py
+#
+# Compares the congestion controllers on the same transfer: goodput,
+# retransmissions (and how many were fast retransmits), timeouts and mean
+# congestion window, from the metrics rdt_send returns.
+#
+#   python3 bench_congestion.py [--megabytes 0.5] [--loss 0.02] [--seeds 5] [--plot]
+#
+# Each run starts receiver.py in a subprocess with the same loss probability
+# as the sender, so a data packet is dropped with about twice that probability.
+# Run i seeds both sides' random loss with i; thread timing still varies, so
+# one run says little, and each controller is reported as min / median / max
+# over the seeds. --plot writes cc_cwnd_plot.png and cc_throughput_plot.png
+# from each controller's median run.
+
+import argparse
+import contextlib
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import receiver
+import sender
+from congestion_control import CONTROLLERS
+
+SEGMENT_SIZE = 1000
+
+# Function to run one transfer with the given controller and return its metrics
+def run_transfer(controller, segments, loss, seed):
+    receiver_process = subprocess.Popen(
+        [sys.executable, '-c', f"import random, receiver; random.seed({seed}); "
+                               f"receiver.LOSS_PROBABILITY = {loss}; receiver.rdt_receive()"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    time.sleep(0.5)
+    random.seed(seed)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        metrics = sender.rdt_send(sock, segments, receiver.RECEIVER_ADDR, plot=False,
+                                  congestion_control=controller)
+    sock.close()
+    try:
+        receiver_process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        # The FIN was lost and the receiver is still waiting for it
+        receiver_process.kill()
+        receiver_process.wait()
+    return metrics
+
+# Function to return the min, median and max of some values
+def spread(values):
+    values = sorted(values)
+    return values[0], values[len(values) // 2], values[-1]
+
+# Function to plot each controller's cwnd and throughput on shared axes
+def plot_comparison(results):
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    for name, metrics in results.items():
+        plt.plot(metrics['cwnd_times'], metrics['cwnd_values'], label=name)
+    plt.xlabel('Time (s)')
+    plt.ylabel('Congestion Window Size (packets)')
+    plt.title('Congestion Window by Controller')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig('cc_cwnd_plot.png')
+    plt.close()
+
+    plt.figure()
+    for name, metrics in results.items():
+        plt.plot(metrics['throughput_times'], metrics['throughput_values'], marker='o', label=name)
+    plt.xlabel('Time (s)')
+    plt.ylabel('Throughput (bps)')
+    plt.title('Throughput by Controller')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig('cc_throughput_plot.png')
+    plt.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Congestion control benchmark")
+    parser.add_argument('--megabytes', type=float, default=0.5)
+    parser.add_argument('--loss', type=float, default=0.02, help="loss probability on both sides")
+    parser.add_argument('--seeds', type=int, default=5, help="transfers per controller, seeded 0 to seeds - 1")
+    parser.add_argument('--plot', action='store_true')
+    args = parser.parse_args()
+
+    sender.LOSS_PROBABILITY = args.loss
+    sender.ERROR_PROBABILITY = 0.0
+    count = int(args.megabytes * 1_000_000 / SEGMENT_SIZE)
+    segments = [b'x' * SEGMENT_SIZE for _ in range(count)]
+    megabits = count * SEGMENT_SIZE * 8 / 1_000_000
+
+    results = {}
+    print(f"{'controller':<12}{'Mbit/s min / median / max':>28}{'retransmits':>18}{'fast':>7}"
+          f"{'timeouts':>10}{'mean cwnd':>11}")
+    for name in CONTROLLERS:
+        runs = []
+        for seed in range(args.seeds):
+            metrics = run_transfer(name, segments, args.loss, seed)
+            if metrics is None:
+                print(f"{name:<12}{'handshake failed':>30} (seed {seed})")
+                continue
+            runs.append((megabits / metrics['duration'], metrics))
+        if not runs:
+            continue
+        runs.sort(key=lambda run: run[0])
+        low, median, high = spread([goodput for goodput, _ in runs])
+        retransmits = spread([metrics['retransmissions'] for _, metrics in runs])
+        fast = spread([metrics['fast_retransmits'] for _, metrics in runs])
+        timeouts = spread([metrics['metrics']['counters'].get('timeouts', 0) for _, metrics in runs])
+        mean_cwnds = [sum(metrics['cwnd_values']) / len(metrics['cwnd_values']) if metrics['cwnd_values'] else 0
+                      for _, metrics in runs]
+        # Medians, with the range of the retransmissions
+        print(f"{name:<12}{f'{low:.2f} / {median:.2f} / {high:.2f}':>28}"
+              f"{f'{retransmits[1]} ({retransmits[0]}-{retransmits[2]})':>18}{fast[1]:>7}{timeouts[1]:>10}"
+              f"{spread(mean_cwnds)[1]:>11.1f}")
+        results[name] = runs[len(runs) // 2][1]
+
+    if args.plot:
+        plot_comparison(results)
+
+if __name__ == "__main__":
+    main()
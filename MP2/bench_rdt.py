@@ -0,0 +1,171 @@
+# bench_rdt.py
+#
+# Throughput benchmark of rdt_send/rdt_receive over the netem.py link emulator,
+# run in-process across a matrix of congestion controllers and link conditions.
+# Each transfer records goodput, retransmission ratio and RTT percentiles, and
+# the results are written to JSON so runs can be compared over time.
+#
+#   python3 bench_rdt.py [--cc newreno,cubic,bbr] [--loss 0,0.02] [--delay 0,0.01] [--bandwidth 0]
+#                        [--megabytes 0.25] [--seed 1] [--runs 1] [--output bench_rdt.json]
+#                        [--compare previous.json]
+#
+# The built-in loss and corruption of sender.py and receiver.py are switched
+# off; all impairments come from the emulator, seeded per run. Delay, jitter and
+# loss apply in both directions, the bandwidth cap to the data direction only.
+
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+
+import receiver
+import sender
+from congestion_control import CONTROLLERS
+from netem import LinkEmulator, LinkProfile
+
+SEGMENT_SIZE = 1000
+RECEIVER_JOIN_TIMEOUT = 30
+
+# Function to run one transfer of data through an emulated link and return its
+# result record
+def run_transfer(controller, data, forward, reverse, seed, segment_size=SEGMENT_SIZE):
+    random.seed(seed)
+    received = []
+    completed = threading.Event()
+
+    def on_complete(flow):
+        received.append(bytes(flow.data()))
+        completed.set()
+
+    server = receiver.RdtServer(('127.0.0.1', 0), on_complete=on_complete)
+    emulator = LinkEmulator(server.sock.getsockname(), forward, reverse, seed).start()
+    server_thread = threading.Thread(target=server.serve, args=(1,))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    segments = sender.Segments(data, segment_size)
+    packets = len(segments)
+
+    metrics = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server_thread.start()
+        try:
+            metrics = sender.rdt_send(sock, segments, emulator.address, plot=False, congestion_control=controller,
+                                      transfer_size=len(data), segment_size=segment_size)
+        finally:
+            segments.release()
+            sock.close()
+            # The receiver finishes on the FIN; without a connection there is none to wait for.
+            # rdt_send has stopped retrying its FIN, so the receiver need not linger.
+            completed.wait(RECEIVER_JOIN_TIMEOUT if metrics is not None else 0)
+            server.stop()
+            server_thread.join()
+            server.close()
+            emulator.stop()
+
+    result = {'ok': metrics is not None and received == [data], 'link': emulator.stats()}
+    if metrics is None:
+        return result
+    # Percentiles come from the sender's RTT histogram, which counts every sample;
+    # rtt_values only keeps the most recent sample per sequence number
+    rtt_histogram = metrics['metrics']['histograms'].get('rtt_ms', {})
+    result.update({
+        'goodput_mbps': len(data) * 8 / metrics['transfer_time'] / 1e6,
+        'transfer_time_s': metrics['transfer_time'],
+        'duration_s': metrics['duration'],   # With the FIN exchange
+        'retransmissions': metrics['retransmissions'],
+        'fast_retransmits': metrics['fast_retransmits'],
+        'retransmission_ratio': metrics['retransmissions'] / packets if packets else 0.0,
+        'rtt_ms': {f"p{p}": rtt_histogram.get(f"p{p}") for p in (50, 90, 99)},
+        'final_rto_ms': metrics['rto'] * 1000,
+    })
+    return result
+
+# Function to key a result by its parameters, for comparing two runs
+def result_key(result):
+    return (result['cc'], result['loss'], result['delay'], result['bandwidth'], result['run'])
+
+# Function to print how goodput and retransmissions moved against a previous JSON file
+def compare(results, path):
+    with open(path) as file:
+        previous = {result_key(result): result for result in json.load(file)['results']}
+    print(f"\nAgainst {path}:")
+    print(f"{'cc':<9}{'loss':>6}{'delay':>7}{'bw':>6}{'goodput':>10}{'change':>9}{'retx ratio':>12}{'was':>8}")
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or not result['ok'] or not before['ok']:
+            continue
+        change = (result['goodput_mbps'] / before['goodput_mbps'] - 1) * 100
+        print(f"{result['cc']:<9}{result['loss']:>6}{result['delay']:>7}{result['bandwidth']:>6}"
+              f"{result['goodput_mbps']:>10.2f}{change:>+8.1f}%{result['retransmission_ratio']:>12.3f}"
+              f"{before['retransmission_ratio']:>8.3f}")
+
+# Function to parse a comma-separated list of numbers
+def number_list(text):
+    return [float(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description="RDT throughput benchmark over an emulated link")
+    parser.add_argument('--cc', default=','.join(CONTROLLERS), help="comma-separated controllers")
+    parser.add_argument('--loss', type=number_list, default=[0.0, 0.02], help="loss probabilities")
+    parser.add_argument('--delay', type=number_list, default=[0.0, 0.01], help="one-way delays in seconds")
+    parser.add_argument('--bandwidth', type=number_list, default=[0.0], help="Mbit/s caps, 0 for none")
+    parser.add_argument('--jitter', type=float, default=0.0, help="seconds of +/- jitter")
+    parser.add_argument('--burst-loss', type=float, default=0.0)
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--duplicate', type=float, default=0.0)
+    parser.add_argument('--megabytes', type=float, default=0.25)
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=1, help="transfers per combination")
+    parser.add_argument('--output', default='bench_rdt.json')
+    parser.add_argument('--compare', help="earlier --output file to compare against")
+    args = parser.parse_args()
+
+    sender.LOSS_PROBABILITY = 0.0
+    sender.ERROR_PROBABILITY = 0.0
+    receiver.LOSS_PROBABILITY = 0.0
+    data = random.Random(args.seed).randbytes(int(args.megabytes * 1_000_000))
+
+    results = []
+    print(f"{'cc':<9}{'loss':>6}{'delay':>7}{'bw':>6}{'run':>4}{'Mbit/s':>9}{'retx ratio':>12}"
+          f"{'rtt p50':>9}{'p90':>8}{'p99':>8}")
+    matrix = itertools.product(args.cc.split(','), args.loss, args.delay, args.bandwidth, range(args.runs))
+    for index, (controller, loss, delay, bandwidth, run) in enumerate(matrix):
+        forward = LinkProfile(loss, args.burst_loss, delay=delay, jitter=args.jitter, reorder=args.reorder,
+                              duplicate=args.duplicate, bandwidth=bandwidth * 1e6 or None)
+        reverse = LinkProfile(loss, args.burst_loss, delay=delay, jitter=args.jitter, reorder=args.reorder,
+                              duplicate=args.duplicate)
+        seed = args.seed * 1000 + index
+        result = {'cc': controller, 'loss': loss, 'delay': delay, 'bandwidth': bandwidth, 'run': run, 'seed': seed}
+        result.update(run_transfer(controller, data, forward, reverse, seed, args.segment_size))
+        results.append(result)
+        prefix = f"{controller:<9}{loss:>6}{delay:>7}{bandwidth:>6}{run:>4}"
+        if 'goodput_mbps' not in result:
+            print(f"{prefix}{'handshake failed':>30}")
+            continue
+        rtt = result['rtt_ms']
+        print(f"{prefix}{result['goodput_mbps']:>9.2f}{result['retransmission_ratio']:>12.3f}"
+              f"{rtt['p50'] or 0:>9.1f}{rtt['p90'] or 0:>8.1f}{rtt['p99'] or 0:>8.1f}"
+              f"{'' if result['ok'] else '  DATA MISMATCH'}")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'megabytes': args.megabytes,
+        'segment_size': args.segment_size,
+        'seed': args.seed,
+        'impairments': {'jitter': args.jitter, 'burst_loss': args.burst_loss, 'reorder': args.reorder,
+                        'duplicate': args.duplicate},
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
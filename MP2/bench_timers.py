@@ -0,0 +1,99 @@
+# bench_timers.py
+#
+# Compares the old per-packet threading.Timer retransmission timers with the
+# shared TimerWheel: peak thread count and CPU time per MB transferred.
+#
+#   python3 bench_timers.py [--megabytes 1] [--loss 0.0]
+#
+# Each run starts receiver.py in a subprocess and sends from this process, so
+# the CPU time measured is the sender's.
+
+import argparse
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import receiver
+import sender
+from timer_wheel import TimerWheel
+
+SEGMENT_SIZE = 1000
+
+# The timers rdt_send used before: one threading.Timer (an OS thread) per packet
+class ThreadTimers:
+    def __init__(self):
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def arm(self, key, delay, callback, *args):
+        timer = threading.Timer(delay, callback, args=args)
+        with self.lock:
+            old_timer = self.timers.pop(key, None)
+            self.timers[key] = timer
+        if old_timer is not None:
+            old_timer.cancel()
+        timer.start()
+
+    def cancel(self, key):
+        with self.lock:
+            timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return timer is not None
+
+# Function to sample the number of live threads until stopped
+def sample_threads(stop, peak):
+    while not stop.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        time.sleep(0.01)
+
+# Function to run one transfer with the given timers and return its measurements
+def run_transfer(timers, segments, loss):
+    receiver_process = subprocess.Popen(
+        [sys.executable, '-c', f"import receiver; receiver.LOSS_PROBABILITY = {loss}; receiver.rdt_receive()"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    time.sleep(0.5)
+
+    stop = threading.Event()
+    peak = [threading.active_count()]
+    sampler = threading.Thread(target=sample_threads, args=(stop, peak))
+    sampler.start()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        sender.rdt_send(sock, segments, receiver.RECEIVER_ADDR, timers=timers, plot=False)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    stop.set()
+    sampler.join()
+    sock.close()
+    receiver_process.wait(timeout=10)
+    # The sampler thread itself is not counted
+    return peak[0] - 1, cpu, wall
+
+def main():
+    parser = argparse.ArgumentParser(description="Retransmission timer benchmark")
+    parser.add_argument('--megabytes', type=float, default=1.0)
+    parser.add_argument('--loss', type=float, default=0.0, help="loss probability on both sides")
+    args = parser.parse_args()
+
+    sender.LOSS_PROBABILITY = args.loss
+    sender.ERROR_PROBABILITY = 0.0
+    count = int(args.megabytes * 1_000_000 / SEGMENT_SIZE)
+    segments = [b'x' * SEGMENT_SIZE for _ in range(count)]
+    megabytes = count * SEGMENT_SIZE / 1_000_000
+
+    print(f"{'timers':<20}{'peak threads':>14}{'CPU s/MB':>12}{'wall s':>10}")
+    for name, timers in (("threading.Timer", ThreadTimers()), ("TimerWheel", TimerWheel())):
+        threads, cpu, wall = run_transfer(timers, segments, args.loss)
+        print(f"{name:<20}{threads:>14}{cpu / megabytes:>12.3f}{wall:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# congestion_control.py
+
+from collections import deque
+
+# Defaults, in packets
+INITIAL_CWND = 1
+INITIAL_SSTHRESH = 16
+MIN_SSTHRESH = 2
+
+# Base congestion controller with TCP NewReno behaviour (RFC 5681, RFC 6582).
+# The sender detects the events and calls the matching hook; the controller only
+# owns cwnd, ssthresh and, for pacing controllers, the gap between sends:
+#
+#   on_packet_sent    - a packet went out
+#   on_delivered      - packets were newly acknowledged, cumulatively or by SACK
+#   on_ack            - the cumulative ACK advanced outside fast recovery
+#   on_enter_recovery - third duplicate ACK: the oldest packet is being fast-retransmitted
+#   on_dupack         - a further duplicate ACK during fast recovery
+#   on_partial_ack    - an ACK during recovery that leaves a hole before the recovery point
+#   on_exit_recovery  - everything sent before the loss has been acknowledged
+#   on_timeout        - a retransmission timeout
+#
+# Subclasses override the hooks whose behaviour differs.
+class CongestionController:
+    name = 'newreno'
+    BETA = 0.5    # Multiplicative decrease on loss
+
+    def __init__(self, initial_cwnd=INITIAL_CWND, initial_ssthresh=INITIAL_SSTHRESH):
+        self.cwnd = float(initial_cwnd)
+        self.ssthresh = float(initial_ssthresh)
+
+    def on_packet_sent(self, seq_num, now):
+        pass
+
+    def on_delivered(self, acked, rtt, now, in_flight):
+        pass
+
+    # Slow start adds one packet per packet acknowledged; congestion avoidance
+    # adds about one packet per round trip
+    def on_ack(self, acked, rtt, now, in_flight):
+        for _ in acked:
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+
+    def on_enter_recovery(self, in_flight, now):
+        self.ssthresh = max(in_flight * self.BETA, MIN_SSTHRESH)
+        # The three duplicate ACKs mean three packets have left the network
+        self.cwnd = self.ssthresh + 3
+
+    # Each duplicate ACK is another packet that left the network; inflating cwnd
+    # lets a new packet take its place
+    def on_dupack(self):
+        self.cwnd += 1
+
+    # Deflate by the packets the partial ACK covered, then allow one new packet
+    def on_partial_ack(self, acked_count):
+        self.cwnd = max(self.cwnd - acked_count + 1, 1)
+
+    def on_exit_recovery(self, in_flight, now):
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, in_flight, now):
+        self.ssthresh = max(in_flight * self.BETA, MIN_SSTHRESH)
+        self.cwnd = 1.0
+
+    # Seconds to wait between packets; 0 sends a window's worth at once
+    def pacing_interval(self):
+        return 0
+
+class NewReno(CongestionController):
+    pass
+
+# CUBIC (RFC 9438): after a loss the window follows a cubic curve in time that
+# flattens out around the size where the loss happened (w_max) and then probes
+# beyond it, so growth does not depend on the RTT. It never grows slower than
+# Reno would (the "Reno-friendly" estimate w_est).
+class Cubic(CongestionController):
+    name = 'cubic'
+    BETA = 0.7
+    C = 0.4
+
+    def __init__(self, initial_cwnd=INITIAL_CWND, initial_ssthresh=INITIAL_SSTHRESH):
+        super().__init__(initial_cwnd, initial_ssthresh)
+        self.w_max = 0.0
+        self.k = 0.0
+        self.w_est = 0.0
+        self.epoch_start = None
+        self.rtt = 0.0
+
+    def on_ack(self, acked, rtt, now, in_flight):
+        if rtt is not None:
+            self.rtt = rtt
+        if self.cwnd < self.ssthresh:
+            self.cwnd += len(acked)
+            return
+
+        if self.epoch_start is None:
+            # First ACK of a congestion avoidance epoch
+            self.epoch_start = now
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = self.cwnd
+            self.w_est = self.cwnd
+
+        # Window the cubic curve reaches one RTT from now, limited to 1.5x growth
+        t = now - self.epoch_start + self.rtt
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+
+        self.w_est += len(acked) * (3 * (1 - self.BETA) / (1 + self.BETA)) / self.cwnd
+        target = max(target, self.w_est)
+        self.cwnd += len(acked) * (target - self.cwnd) / self.cwnd
+
+    def reduce(self):
+        # Fast convergence: give up bandwidth sooner if the last w_max was not reached
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.epoch_start = None
+
+    def on_enter_recovery(self, in_flight, now):
+        self.reduce()
+        self.ssthresh = max(self.cwnd * self.BETA, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh + 3
+
+    def on_timeout(self, in_flight, now):
+        self.reduce()
+        self.ssthresh = max(self.cwnd * self.BETA, MIN_SSTHRESH)
+        self.cwnd = 1.0
+
+# BBR-like model-based controller. Instead of reacting to loss it estimates the
+# bottleneck bandwidth (the maximum delivery rate over the last BW_WINDOW_ROUNDS
+# round trips) and the minimum RTT, then paces packets at about that bandwidth
+# and keeps about two bandwidth-delay products in flight. It starts up by
+# doubling the rate every round until the bandwidth estimate stops growing,
+# drains the queue that built up, then cycles its pacing gain to probe for more.
+class BbrLike(CongestionController):
+    name = 'bbr'
+    STARTUP_GAIN = 2.885          # 2/ln(2): doubles the delivery rate each round
+    DRAIN_GAIN = 1 / 2.885
+    PROBE_GAINS = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+    CWND_GAIN = 2
+    BW_WINDOW_ROUNDS = 10
+    MIN_RTT_WINDOW = 10.0         # Seconds a min RTT sample stays valid
+    MIN_CWND = 4
+    FULL_BW_GROWTH = 1.25         # Startup ends after 3 rounds growing less than this
+    FULL_BW_ROUNDS = 3
+
+    def __init__(self, initial_cwnd=INITIAL_CWND, initial_ssthresh=INITIAL_SSTHRESH):
+        super().__init__(max(initial_cwnd, self.MIN_CWND), initial_ssthresh)
+        self.state = 'startup'
+        self.pacing_gain = self.STARTUP_GAIN
+        self.delivered = 0
+        self.delivered_time = None
+        self.sent_state = {}           # seq_num -> (delivered, delivered_time) when it was sent
+        self.bw_samples = deque()      # (round, delivery rate in packets/s)
+        self.btl_bw = 0.0
+        self.min_rtt = None
+        self.min_rtt_stamp = 0.0
+        self.round_count = 0
+        self.next_round_delivered = 0
+        self.full_bw = 0.0
+        self.full_bw_count = 0
+        self.cycle_index = 0
+        self.cycle_stamp = 0.0
+
+    def on_packet_sent(self, seq_num, now):
+        if self.delivered_time is None:
+            self.delivered_time = now
+        self.sent_state[seq_num] = (self.delivered, self.delivered_time)
+
+    def bdp(self):
+        if self.min_rtt is None or self.btl_bw == 0:
+            return None
+        return self.btl_bw * self.min_rtt
+
+    # The model is fed by every delivery, including SACKed packets and those
+    # acknowledged during recovery
+    def on_delivered(self, acked, rtt, now, in_flight):
+        self.delivered += len(acked)
+        self.delivered_time = now
+
+        # Delivery rate: packets delivered since the newest acknowledged packet was
+        # sent, over the time that took
+        snapshots = [self.sent_state.pop(seq_num) for seq_num in acked if seq_num in self.sent_state]
+        round_start = False
+        if snapshots:
+            prior_delivered, prior_time = max(snapshots)
+            if now > prior_time:
+                rate = (self.delivered - prior_delivered) / (now - prior_time)
+                if prior_delivered >= self.next_round_delivered:
+                    self.round_count += 1
+                    self.next_round_delivered = self.delivered
+                    round_start = True
+                self.bw_samples.append((self.round_count, rate))
+                while self.bw_samples[0][0] <= self.round_count - self.BW_WINDOW_ROUNDS:
+                    self.bw_samples.popleft()
+                self.btl_bw = max(sample for _, sample in self.bw_samples)
+
+        if rtt is not None and (self.min_rtt is None or rtt <= self.min_rtt
+                                or now - self.min_rtt_stamp > self.MIN_RTT_WINDOW):
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+
+        self.update_state(round_start, now, in_flight)
+
+        bdp = self.bdp()
+        if bdp is None or self.state == 'startup':
+            # Grow like slow start until the model says otherwise
+            self.cwnd += len(acked)
+            if bdp is not None:
+                self.cwnd = min(self.cwnd, self.STARTUP_GAIN * bdp + self.MIN_CWND)
+        else:
+            self.cwnd = max(self.MIN_CWND, self.CWND_GAIN * bdp)
+
+    def update_state(self, round_start, now, in_flight):
+        if self.state == 'startup' and round_start:
+            if self.btl_bw >= self.full_bw * self.FULL_BW_GROWTH:
+                self.full_bw = self.btl_bw
+                self.full_bw_count = 0
+            else:
+                self.full_bw_count += 1
+                if self.full_bw_count >= self.FULL_BW_ROUNDS:
+                    self.state = 'drain'
+                    self.pacing_gain = self.DRAIN_GAIN
+
+        if self.state == 'drain':
+            bdp = self.bdp()
+            if bdp is None or in_flight <= bdp:
+                self.state = 'probe_bw'
+                self.cycle_index = 0
+                self.cycle_stamp = now
+                self.pacing_gain = self.PROBE_GAINS[0]
+
+        elif self.state == 'probe_bw' and self.min_rtt is not None and now - self.cycle_stamp > self.min_rtt:
+            self.cycle_index = (self.cycle_index + 1) % len(self.PROBE_GAINS)
+            self.cycle_stamp = now
+            self.pacing_gain = self.PROBE_GAINS[self.cycle_index]
+
+    # Loss is not taken as a congestion signal: the window follows the model, and
+    # only the lost packet is resent
+    def on_ack(self, acked, rtt, now, in_flight):
+        pass
+
+    def on_enter_recovery(self, in_flight, now):
+        pass
+
+    def on_dupack(self):
+        pass
+
+    def on_partial_ack(self, acked_count):
+        pass
+
+    def on_exit_recovery(self, in_flight, now):
+        pass
+
+    # A timeout means the model is stale: restart from a small window
+    def on_timeout(self, in_flight, now):
+        self.cwnd = float(self.MIN_CWND)
+
+    def pacing_interval(self):
+        if self.btl_bw == 0:
+            return 0
+        return 1 / (self.pacing_gain * self.btl_bw)
+
+# Controllers selectable by name
+CONTROLLERS = {
+    'newreno': NewReno,
+    'cubic': Cubic,
+    'bbr': BbrLike,
+}
+
+# Function to create a controller from its name (or return an instance as is)
+def create_controller(controller, initial_cwnd=INITIAL_CWND, initial_ssthresh=INITIAL_SSTHRESH):
+    if isinstance(controller, CongestionController):
+        return controller
+    try:
+        return CONTROLLERS[controller](initial_cwnd, initial_ssthresh)
+    except KeyError:
+        raise ValueError(f"Unknown congestion controller {controller!r}; choose from {', '.join(CONTROLLERS)}")
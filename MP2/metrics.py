@@ -0,0 +1,214 @@
+# metrics.py
+
+import csv
+import json
+import logging
+import math
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+# Defaults
+RING_CAPACITY = 4096            # Samples a time series keeps; the oldest are dropped first
+BUCKETS_PER_DOUBLING = 8        # Histogram resolution: bucket bounds grow by 2**(1/8), about 9%
+HISTOGRAM_MIN = 0.01            # Smallest bucket bound; values at or below it share the first bucket
+HISTOGRAM_BUCKETS = 256         # Bounds reach HISTOGRAM_MIN * 2**32
+STATS_ADDR = '127.0.0.1'
+
+LOG_LEVELS = {
+    'debug': logging.DEBUG,       # Every packet event
+    'info': logging.INFO,         # Connections, recovery, summaries
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+# Function to send log records to stdout as bare messages, the way the
+# protocol's events used to be printed
+def configure_logging(level='info'):
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=LOG_LEVELS[level])
+
+# Fixed-size series of (x, value) samples; x is seconds since the transfer
+# started unless the caller gives one (e.g. a sequence number)
+class RingBuffer:
+    def __init__(self, capacity=RING_CAPACITY):
+        self.samples = deque(maxlen=capacity)
+        self.total = 0
+
+    def append(self, x, value):
+        self.samples.append((x, value))
+        self.total += 1
+
+    def __iter__(self):
+        return iter(self.samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+# Histogram with logarithmic buckets: a fixed array of counts, so recording is
+# O(1) and memory does not grow with the number of values. Percentiles are
+# read off the bucket bounds, accurate to about one bucket width.
+class Histogram:
+    def __init__(self, minimum=HISTOGRAM_MIN, buckets=HISTOGRAM_BUCKETS, per_doubling=BUCKETS_PER_DOUBLING):
+        self.minimum = minimum
+        self.per_doubling = per_doubling
+        self.counts = [0] * buckets
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def bound(self, index):
+        return self.minimum * 2 ** (index / self.per_doubling)
+
+    def add(self, value):
+        if value <= self.minimum:
+            index = 0
+        else:
+            index = min(math.ceil(math.log2(value / self.minimum) * self.per_doubling), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Function to return the upper bound of the bucket holding the p-th
+    # percentile, capped at the largest value seen
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': [[self.bound(index), count] for index, count in enumerate(self.counts) if count],
+        }
+
+# Counters, time series and histograms of one sender or receiver. Every update
+# is O(1) and bounded in memory; a lock keeps snapshots consistent while the
+# protocol's threads keep updating.
+class Metrics:
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.series = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    # Function to append a sample to a time series; x defaults to the time since start
+    def record(self, name, value, x=None):
+        if x is None:
+            x = time.time() - self.start_time
+        with self.lock:
+            ring = self.series.get(name)
+            if ring is None:
+                ring = self.series[name] = RingBuffer(self.capacity)
+            ring.append(x, value)
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    # Function to return the samples of a series as a list of (x, value)
+    def samples(self, name):
+        with self.lock:
+            ring = self.series.get(name)
+            return list(ring) if ring is not None else []
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.start_time,
+                'counters': dict(self.counters),
+                'series': {name: {'total': ring.total, 'samples': [list(sample) for sample in ring]}
+                           for name, ring in self.series.items()},
+                'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+# Function to write a snapshot as JSON
+def write_json(snapshot, path):
+    with open(path, 'w') as file:
+        json.dump(snapshot, file, indent=2)
+
+# Function to write a snapshot as CSV rows of kind, name, x, value: one row per
+# counter, per series sample and per non-empty histogram bucket (x is its bound)
+def write_csv(snapshot, path):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['kind', 'name', 'x', 'value'])
+        for name, value in sorted(snapshot['counters'].items()):
+            writer.writerow(['counter', name, '', value])
+        for name, series in sorted(snapshot['series'].items()):
+            for x, value in series['samples']:
+                writer.writerow(['series', name, x, value])
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            for bound, count in histogram['buckets']:
+                writer.writerow(['histogram', name, bound, count])
+
+# Function to write a snapshot to path as CSV or JSON, by its extension
+def export(snapshot, path):
+    if path.endswith('.csv'):
+        write_csv(snapshot, path)
+    else:
+        write_json(snapshot, path)
+
+# Local stats socket: every TCP connection to it gets the current snapshot as
+# JSON and is closed (e.g. nc 127.0.0.1 9100). Runs on a daemon thread, so
+# nothing on the packet path waits for a reader.
+class StatsServer:
+    def __init__(self, snapshot, port, host=STATS_ADDR):
+        self.snapshot = snapshot
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return    # Closed
+            with conn:
+                try:
+                    conn.sendall(json.dumps(self.snapshot()).encode() + b'\n')
+                except OSError:
+                    pass
+
+    def close(self):
+        try:
+            # Wakes the thread blocked in accept()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
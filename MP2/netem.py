@@ -0,0 +1,227 @@
+# netem.py
+#
+# Seeded link emulator: a UDP relay on localhost that impairs the datagrams it
+# forwards, in the spirit of Linux netem. Senders send to the relay instead of
+# the receiver; each sender address gets its own upstream socket, so the
+# receiver still sees one address per sender, and replies are relayed back.
+#
+#   python3 netem.py [--listen 12346] [--target 12345] [--loss 0.02] [--delay 0.01] [--jitter 0.002]
+#                    [--burst-loss 0.01 --burst-length 4] [--reorder 0.01] [--duplicate 0.01]
+#                    [--corrupt 0.01] [--bandwidth 10e6] [--seed 1]
+#   python3 sender.py --receiver localhost:12346
+#
+# Every decision (loss, duplication, corruption, jitter) comes from a random
+# generator seeded per direction, so the same seed applied to the same packet
+# sequence impairs it the same way.
+
+import argparse
+import heapq
+import random
+import selectors
+import socket
+import threading
+import time
+
+# Defaults
+QUEUE_LIMIT = 1000        # Packets queued on a bandwidth-capped link before tail drops
+REORDER_DELAY = 0.005     # Extra seconds a reordered packet is held back, on top of the delay
+MAX_DATAGRAM_SIZE = 65535
+
+# Impairments of one direction of the link. Loss is either independent
+# (loss) or in bursts (Gilbert-Elliott: burst_loss is the chance a packet
+# starts a burst, and a burst drops burst_length packets on average). Delay and
+# jitter are in seconds, bandwidth in bits per second (None for no cap).
+class LinkProfile:
+    def __init__(self, loss=0.0, burst_loss=0.0, burst_length=3, delay=0.0, jitter=0.0, reorder=0.0,
+                 duplicate=0.0, corrupt=0.0, bandwidth=None, queue_limit=QUEUE_LIMIT):
+        self.loss = loss
+        self.burst_loss = burst_loss
+        self.burst_length = burst_length
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.bandwidth = bandwidth
+        self.queue_limit = queue_limit
+
+    def as_dict(self):
+        return dict(vars(self))
+
+# One direction of the link: decides the fate of each datagram and when each
+# surviving copy is delivered
+class Link:
+    def __init__(self, profile, seed):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.in_burst = False
+        self.busy_until = 0.0     # When the bandwidth-capped link finishes its queue
+        self.queued = 0
+        self.stats = dict(packets=0, delivered=0, lost=0, burst_lost=0, queue_dropped=0, duplicated=0,
+                          reordered=0, corrupted=0)
+
+    # Function to return (delivery time, datagram) for each copy of data to deliver
+    def transmit(self, data, now):
+        profile = self.profile
+        rng = self.rng
+        self.stats['packets'] += 1
+        # Each packet of a burst ends it with probability 1 / burst_length
+        if self.in_burst or (profile.burst_loss and rng.random() < profile.burst_loss):
+            self.in_burst = rng.random() >= 1 / max(profile.burst_length, 1)
+            self.stats['burst_lost'] += 1
+            return []
+        if rng.random() < profile.loss:
+            self.stats['lost'] += 1
+            return []
+
+        copies = 2 if rng.random() < profile.duplicate else 1
+        self.stats['duplicated'] += copies - 1
+        deliveries = []
+        for _ in range(copies):
+            departure = now
+            if profile.bandwidth:
+                if self.queued >= profile.queue_limit:
+                    self.stats['queue_dropped'] += 1
+                    continue
+                # Serialization: the packet leaves once the ones queued ahead of it have
+                self.busy_until = max(self.busy_until, now) + len(data) * 8 / profile.bandwidth
+                departure = self.busy_until
+                self.queued += 1
+            delay = profile.delay
+            if profile.jitter:
+                delay = max(0.0, delay + rng.uniform(-profile.jitter, profile.jitter))
+            if rng.random() < profile.reorder:
+                delay += max(profile.delay, REORDER_DELAY)
+                self.stats['reordered'] += 1
+            packet = data
+            if rng.random() < profile.corrupt and data:
+                packet = bytearray(data)
+                packet[rng.randrange(len(packet))] ^= 0xFF
+                self.stats['corrupted'] += 1
+            deliveries.append((departure + delay, packet))
+        return deliveries
+
+# UDP relay applying a forward profile to datagrams from senders to target and
+# a reverse profile to the replies. start() runs it on a daemon thread.
+class LinkEmulator:
+    def __init__(self, target, forward=None, reverse=None, seed=0, listen=('127.0.0.1', 0)):
+        self.target = target
+        self.forward = Link(forward or LinkProfile(), seed * 2)
+        self.reverse = Link(reverse or LinkProfile(), seed * 2 + 1)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(listen)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.upstreams = {}       # sender address -> socket towards target
+        self.clients = {}         # upstream socket -> sender address
+        self.pending = []         # heap of (delivery time, order, link, socket, datagram, address)
+        self.order = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for sock in [self.sock, *self.clients]:
+            sock.close()
+        self.selector.close()
+
+    # Function to return the per-direction counters
+    def stats(self):
+        return {'forward': dict(self.forward.stats), 'reverse': dict(self.reverse.stats)}
+
+    def run(self):
+        while self.running:
+            now = time.monotonic()
+            timeout = 0.05
+            if self.pending:
+                timeout = min(timeout, max(0.0, self.pending[0][0] - now))
+            for key, _ in self.selector.select(timeout):
+                self.drain(key.fileobj)
+            self.deliver_due()
+
+    # Function to read every queued datagram from sock and schedule its copies
+    def drain(self, sock):
+        while True:
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. ICMP port unreachable from a receiver that has gone away
+                return
+            now = time.monotonic()
+            if sock is self.sock:
+                link, out_sock, destination = self.forward, self.upstream_for(address), self.target
+            else:
+                link, out_sock, destination = self.reverse, self.sock, self.clients[sock]
+            for delivery_time, packet in link.transmit(data, now):
+                heapq.heappush(self.pending, (delivery_time, self.order, link, out_sock, packet, destination))
+                self.order += 1
+
+    def upstream_for(self, address):
+        upstream = self.upstreams.get(address)
+        if upstream is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            upstream.bind(('127.0.0.1', 0))
+            upstream.setblocking(False)
+            self.upstreams[address] = upstream
+            self.clients[upstream] = address
+            self.selector.register(upstream, selectors.EVENT_READ)
+        return upstream
+
+    def deliver_due(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            _, _, link, sock, packet, destination = heapq.heappop(self.pending)
+            if link.profile.bandwidth:
+                link.queued -= 1
+            try:
+                sock.sendto(packet, destination)
+                link.stats['delivered'] += 1
+            except OSError:
+                pass
+
+# Function to parse host:port
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seeded UDP link emulator")
+    parser.add_argument('--listen', default='127.0.0.1:12346', help="address senders send to")
+    parser.add_argument('--target', default='127.0.0.1:12345', help="receiver address")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--burst-loss', type=float, default=0.0, help="probability a packet starts a loss burst")
+    parser.add_argument('--burst-length', type=float, default=3, help="mean packets lost per burst")
+    parser.add_argument('--delay', type=float, default=0.0, help="one-way delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="uniform +/- jitter in seconds")
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--duplicate', type=float, default=0.0)
+    parser.add_argument('--corrupt', type=float, default=0.0)
+    parser.add_argument('--bandwidth', type=float, help="bits per second, each direction")
+    args = parser.parse_args()
+
+    # The same impairments apply in both directions
+    profile = LinkProfile(args.loss, args.burst_loss, args.burst_length, args.delay, args.jitter, args.reorder,
+                          args.duplicate, args.corrupt, args.bandwidth)
+    emulator = LinkEmulator(parse_address(args.target), profile, profile, args.seed,
+                            parse_address(args.listen)).start()
+    print(f"Relaying {args.listen} -> {args.target} with {profile.as_dict()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    print(emulator.stats())
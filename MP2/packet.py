@@ -0,0 +1,168 @@
+# packet.py
+
+import socket
+import struct
+import threading
+import zlib
+
+# Packet Types
+PACKET_TYPE_DATA = 0
+PACKET_TYPE_SYN = 1
+PACKET_TYPE_ACK = 2
+PACKET_TYPE_FIN = 3
+PACKET_TYPE_PROBE = 4    # Zero-window probe; the receiver answers with an ACK carrying its window
+
+# Header version. Version 2 added the advertised receive window; packets of any
+# other version are dropped.
+PROTOCOL_VERSION = 2
+
+# Checksum algorithms. The sender offers one in the SYN and the receiver's
+# SYN-ACK names the one both sides use from then on; the SYN and SYN-ACK
+# themselves always use the Internet checksum.
+CHECKSUM_INET = 1     # RFC 1071 16-bit one's complement sum
+CHECKSUM_CRC32 = 2    # CRC-32, catches all burst errors up to 32 bits
+CHECKSUM_NAMES = {'inet': CHECKSUM_INET, 'crc32': CHECKSUM_CRC32}
+DEFAULT_CHECKSUM = CHECKSUM_CRC32
+
+# Preallocated structs for the wire formats
+HEADER = struct.Struct('!B B I I H I')    # version, type, connection id, sequence number, window, checksum
+HEADER_PREFIX = struct.Struct('!B B I I H')   # the part of the header the checksum covers
+CHECKSUM_FIELD = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+CHECKSUM_OFFSET = HEADER_PREFIX.size
+SYN_OPTIONS = struct.Struct('!B B')       # checksum offered (SYN) or chosen (SYN-ACK), window scale
+TRANSFER_HEADER = struct.Struct('!Q I')   # follows the options in a file transfer's SYN: total bytes, segment size
+SACK_COUNT = struct.Struct('!B')
+SACK_BLOCK = struct.Struct('!I I')        # [start, end) of packets held beyond the cumulative ACK
+
+MAX_DATAGRAM_SIZE = 65535
+MAX_PAYLOAD_SIZE = 65507 - HEADER_SIZE    # Largest UDP payload less the packet header
+MAX_WINDOW_SCALE = 14                     # As in TCP (RFC 7323): windows up to 1 GiB
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')   # Not on Windows
+
+# Function to compute the Internet checksum (RFC 1071) of the concatenated parts.
+# The one's complement sum of 16-bit words equals the bytes read as one big
+# integer modulo 0xFFFF (since 0x10000 = 1 mod 0xFFFF), so the per-word loop
+# runs in C inside int.from_bytes and %. Appending a part of k bytes shifts the
+# running value by 256**k, which is 1 or 256 modulo 0xFFFF as k is even or odd.
+def inet_checksum(*parts):
+    value = 0
+    length = 0
+    nonzero = False
+    for part in parts:
+        number = int.from_bytes(part, 'big')
+        nonzero = nonzero or number != 0
+        value = (value * (256 if len(part) % 2 else 1) + number) % 0xFFFF
+        length += len(part)
+    if length % 2:
+        # Odd length: pad with a zero byte
+        value = value * 256 % 0xFFFF
+    if value == 0 and nonzero:
+        value = 0xFFFF
+    return ~value & 0xFFFF
+
+# Function to compute the CRC-32 of the concatenated parts without joining them
+def crc32_checksum(*parts):
+    crc = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+    return crc
+
+CHECKSUM_FUNCTIONS = {
+    CHECKSUM_INET: inet_checksum,
+    CHECKSUM_CRC32: crc32_checksum,
+}
+
+# A packet is created for every datagram received, so it carries no per-instance
+# __dict__. A sender can also reuse one Packet and header buffer for every send.
+# The connection id, picked by the sender for each transfer, lets one receiver
+# tell apart concurrent transfers, including two from the same address. The
+# window is the receiver's free buffer space, shifted right by the window scale
+# it announced in the SYN-ACK.
+class Packet:
+    __slots__ = ('version', 'packet_type', 'conn_id', 'seq_num', 'window', 'payload', 'checksum',
+                 'checksum_type')
+
+    def __init__(self, packet_type, seq_num, payload=b'', checksum_type=CHECKSUM_INET, conn_id=0, window=0):
+        self.version = PROTOCOL_VERSION     # 1 byte
+        self.packet_type = packet_type      # 1 byte
+        self.conn_id = conn_id              # 4 bytes
+        self.seq_num = seq_num              # 4 bytes
+        self.window = window                # 2 bytes
+        self.payload = payload              # variable length, any bytes-like object
+        self.checksum = 0                   # 4 bytes, will be computed
+        self.checksum_type = checksum_type
+
+    # The checksum covers the whole header but itself, and the payload
+    def compute_checksum(self):
+        return CHECKSUM_FUNCTIONS[self.checksum_type](HEADER_PREFIX.pack(self.version, self.packet_type, self.conn_id,
+                                                                         self.seq_num, self.window),
+                                                      self.payload)
+
+    def pack(self):
+        packet_bytes = bytearray(HEADER_SIZE + len(self.payload))
+        HEADER_PREFIX.pack_into(packet_bytes, 0, self.version, self.packet_type, self.conn_id, self.seq_num, self.window)
+        packet_bytes[HEADER_SIZE:] = self.payload
+        view = memoryview(packet_bytes)
+        self.checksum = CHECKSUM_FUNCTIONS[self.checksum_type](view[:CHECKSUM_OFFSET], view[HEADER_SIZE:])
+        CHECKSUM_FIELD.pack_into(packet_bytes, CHECKSUM_OFFSET, self.checksum)
+        return packet_bytes
+
+    # Function to send the packet without joining header and payload: the header
+    # is written into header_buffer (HEADER_SIZE bytes, reused by the caller) and
+    # sendmsg gathers both into one datagram
+    def send(self, sock, address, header_buffer):
+        self.checksum = self.compute_checksum()
+        HEADER.pack_into(header_buffer, 0, self.version, self.packet_type, self.conn_id, self.seq_num, self.window,
+                         self.checksum)
+        if HAS_SENDMSG:
+            sock.sendmsg((header_buffer, self.payload), (), 0, address)
+        else:
+            sock.sendto(bytes(header_buffer) + self.payload, address)
+
+    # The payload is a memoryview into packet_bytes, so unpacking copies nothing.
+    # A receiver that is done with one packet before the next arrives can pass
+    # that Packet in to be refilled instead of allocating a new one.
+    @staticmethod
+    def unpack(packet_bytes, checksum_type=CHECKSUM_INET, packet=None):
+        view = packet_bytes if isinstance(packet_bytes, memoryview) else memoryview(packet_bytes)
+        if packet is None:
+            packet = Packet(PACKET_TYPE_DATA, 0)
+        (packet.version, packet.packet_type, packet.conn_id, packet.seq_num, packet.window,
+         packet.checksum) = HEADER.unpack_from(view)
+        packet.payload = view[HEADER_SIZE:]
+        packet.checksum_type = checksum_type
+        return packet
+
+    def is_corrupt(self):
+        return self.checksum != self.compute_checksum()
+
+# Function to pick the window scale for a receive buffer: the smallest shift
+# that fits its size into the 16-bit window field
+def window_scale(buffer_size):
+    return min(max(0, buffer_size.bit_length() - 16), MAX_WINDOW_SCALE)
+
+# Pool of reusable receive buffers for recvfrom_into. A receiver that has to
+# keep a datagram (an out-of-order packet waiting for a gap to fill) holds on to
+# its buffer and releases it once the payload is delivered; everything else is
+# released straight after the packet is handled. At most max_free buffers are
+# kept for reuse.
+class BufferPool:
+    def __init__(self, buffer_size=MAX_DATAGRAM_SIZE, max_free=64):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self.free = []
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(buffer)
@@ -0,0 +1,55 @@
+# plot_metrics.py
+#
+# Offline plots of a metrics snapshot exported by sender.py --metrics run.json
+# (JSON only; a CSV export is meant for spreadsheets). matplotlib is imported
+# here and nowhere on the transfer path.
+#
+#   python3 plot_metrics.py run.json [--prefix run_]
+
+import argparse
+import json
+
+# Plots drawn from the sender's series: series name -> (file, x label, y label, title, step)
+PLOTS = {
+    'rtt_ms': ('latency_plot.png', 'Packet Sequence Number', 'RTT (ms)', 'RTT for Each Packet', False),
+    'cwnd': ('cwnd_plot.png', 'Time (s)', 'Congestion Window Size (packets)', 'Congestion Window Over Time', False),
+    'throughput_bps': ('throughput_plot.png', 'Time (s)', 'Throughput (bps)', 'Throughput Over Time', False),
+    'rto_ms': ('rto_plot.png', 'Time (s)', 'RTO (ms)', 'Retransmission Timeout Over Time', True),
+}
+
+# Function to write one PNG per series of the snapshot that has samples
+def plot_snapshot(snapshot, prefix=''):
+    import matplotlib.pyplot as plt
+
+    written = []
+    for name, (filename, xlabel, ylabel, title, step) in PLOTS.items():
+        samples = snapshot['series'].get(name, {}).get('samples')
+        if not samples:
+            continue
+        samples = sorted(samples)
+        xs = [x for x, _ in samples]
+        ys = [value for _, value in samples]
+        plt.figure()
+        if step:
+            plt.step(xs, ys, where='post')
+        else:
+            plt.plot(xs, ys, marker='o')
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        plt.title(title)
+        plt.grid(True)
+        plt.savefig(prefix + filename)
+        plt.close()
+        written.append(prefix + filename)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot an exported RDT metrics snapshot")
+    parser.add_argument('snapshot', help="JSON file written by --metrics")
+    parser.add_argument('--prefix', default='', help="prepended to each PNG file name")
+    args = parser.parse_args()
+
+    with open(args.snapshot) as file:
+        snapshot = json.load(file)
+    for path in plot_snapshot(snapshot, args.prefix):
+        print(f"Wrote {path}")
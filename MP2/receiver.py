@@ -1,129 +1,605 @@
 # receiver.py
 
+import argparse
+import logging
+import mmap
+import os
 import socket
-import struct
 import random
-import threading
 import time
 
+from metrics import Metrics, StatsServer, LOG_LEVELS, configure_logging, export
+from batch_io import BatchReceiver, configure_socket_buffers, BATCH_SIZE, SOCKET_RCVBUF, SOCKET_SNDBUF
+from packet import (Packet, BufferPool, PACKET_TYPE_DATA, PACKET_TYPE_SYN, PACKET_TYPE_ACK, PACKET_TYPE_FIN,
+                    PACKET_TYPE_PROBE, PROTOCOL_VERSION, CHECKSUM_INET, CHECKSUM_FUNCTIONS, SYN_OPTIONS,
+                    TRANSFER_HEADER, SACK_COUNT, SACK_BLOCK, HEADER_SIZE, MAX_DATAGRAM_SIZE, window_scale)
+
 # Constants
 RECEIVER_ADDR = ('localhost', 12345)
 TIMEOUT_INTERVAL = 2
 LOSS_PROBABILITY = 0.1
+RECEIVE_WINDOW = 64      # Out-of-order packets buffered; 1 gives go-back-N behaviour
+MAX_SACK_BLOCKS = 4      # Received ranges reported in each ACK
+ACK_EVERY = 2            # In-order packets per delayed ACK; 1 acknowledges every packet
+ACK_DELAY = 0.01         # Seconds an in-order packet may wait for its ACK
+MAX_FLOWS = 64           # Concurrent flows served; SYNs beyond this are dropped
+IDLE_TIMEOUT = 30        # Seconds without a packet before a flow is evicted
+CLOSE_LINGER = 5         # Seconds a closed flow stays to answer FIN retries
+RECEIVE_BUFFER = 1024 * 1024   # Bytes a flow holds for its application; the advertised window is what is free
+READ_RATE = None         # Bytes per second the application reads; None reads everything at once
+READ_TICK = 0.05         # Seconds between application reads while data is unread
 
-# Packet Types
-PACKET_TYPE_DATA = 0
-PACKET_TYPE_SYN = 1
-PACKET_TYPE_ACK = 2
-PACKET_TYPE_FIN = 3
-
-class Packet:
-    def __init__(self, packet_type, seq_num, payload=b''):
-        self.packet_type = packet_type  # 1 byte
-        self.seq_num = seq_num          # 4 bytes
-        self.payload = payload          # variable length
-        self.checksum = 0               # 2 bytes, will be computed
-
-    def compute_checksum(self):
-        checksum = self.packet_type + self.seq_num
-        checksum += sum(self.payload)
-        return checksum & 0xFFFF  # Return as 16-bit value
-
-    def pack(self):
-        self.checksum = self.compute_checksum()
-        header = struct.pack('!B I H', self.packet_type, self.seq_num, self.checksum)
-        return header + self.payload
-
-    @staticmethod
-    def unpack(packet_bytes):
-        packet_type, seq_num, checksum = struct.unpack('!B I H', packet_bytes[:7])
-        payload = packet_bytes[7:]
-        packet = Packet(packet_type, seq_num, payload)
-        packet.checksum = checksum
-        return packet
-
-    def is_corrupt(self):
-        return self.checksum != self.compute_checksum()
-
-def rdt_receive():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(RECEIVER_ADDR)
-    sock.settimeout(TIMEOUT_INTERVAL)
-
-    expected_seq_num = 0
-    received_data = []
-    sender_address = None
-
-    def establish_connection():
-        nonlocal sender_address
-        while True:
-            try:
-                packet_bytes, sender_addr = sock.recvfrom(4096)
-                sender_address = sender_addr
-                syn_packet = Packet.unpack(packet_bytes)
-                if syn_packet.is_corrupt():
-                    print("Received corrupt SYN packet.")
-                    continue
-                if syn_packet.packet_type == PACKET_TYPE_SYN and syn_packet.seq_num == 0:
-                    # Send SYN-ACK
-                    syn_ack_packet = Packet(PACKET_TYPE_SYN, 0).pack()
-                    sock.sendto(syn_ack_packet, sender_address)
-                    print("Sent SYN-ACK packet.")
-                    # Wait for ACK
-                    packet_bytes, _ = sock.recvfrom(4096)
-                    ack_packet = Packet.unpack(packet_bytes)
-                    if ack_packet.is_corrupt():
-                        print("Received corrupt ACK packet.")
-                        continue
-                    if ack_packet.packet_type == PACKET_TYPE_ACK and ack_packet.seq_num == 0:
-                        print("Connection established with sender.")
-                        return True
-            except socket.timeout:
-                continue
+# Flow states
+SYN_RECEIVED = 'SYN_RECEIVED'   # SYN-ACK sent, waiting for the handshake ACK
+ESTABLISHED = 'ESTABLISHED'
+CLOSED = 'CLOSED'               # FIN acknowledged
+
+log = logging.getLogger('rdt.receiver')
+
+# Function to list the buffered out-of-order packets as [start, end) ranges. The
+# range holding the packet just received comes first, as in TCP SACK (RFC 2018).
+def sack_blocks(receive_buffer, last_seq_num):
+    blocks = []
+    for seq_num in sorted(receive_buffer):
+        if blocks and blocks[-1][1] == seq_num:
+            blocks[-1][1] = seq_num + 1
+        else:
+            blocks.append([seq_num, seq_num + 1])
+    blocks.sort(key=lambda block: not block[0] <= last_seq_num < block[1])
+    return blocks[:MAX_SACK_BLOCKS]
+
+# Function to build an ACK: seq_num is the next packet expected in order
+# (cumulative), and the payload is a block count followed by SACK ranges
+def build_ack(expected_seq_num, receive_buffer, last_seq_num, checksum_type=CHECKSUM_INET, conn_id=0, window=0):
+    blocks = sack_blocks(receive_buffer, last_seq_num)
+    payload = bytearray(SACK_COUNT.size + SACK_BLOCK.size * len(blocks))
+    SACK_COUNT.pack_into(payload, 0, len(blocks))
+    for i, (start, end) in enumerate(blocks):
+        SACK_BLOCK.pack_into(payload, SACK_COUNT.size + SACK_BLOCK.size * i, start, end)
+    return Packet(PACKET_TYPE_ACK, expected_seq_num, payload, checksum_type, conn_id, window).pack()
+
+# Reusable ACK writer of one server. The Packet, header buffer and SACK payload
+# buffer are the same for every ACK, and sendmsg gathers header and payload, so
+# an ACK allocates no buffers; build_ack() is the one-off equivalent.
+class AckWriter:
+    def __init__(self):
+        self.packet = Packet(PACKET_TYPE_ACK, 0)
+        self.header_buffer = bytearray(HEADER_SIZE)
+        payload = memoryview(bytearray(SACK_COUNT.size + SACK_BLOCK.size * MAX_SACK_BLOCKS))
+        # One view per possible block count, so no slice is taken per ACK
+        self.payloads = [payload[:SACK_COUNT.size + SACK_BLOCK.size * count] for count in range(MAX_SACK_BLOCKS + 1)]
+
+    def send(self, sock, address, expected_seq_num, receive_buffer, last_seq_num, checksum_type, conn_id, window):
+        blocks = sack_blocks(receive_buffer, last_seq_num) if receive_buffer else ()
+        payload = self.payloads[len(blocks)]
+        SACK_COUNT.pack_into(payload, 0, len(blocks))
+        for i, (start, end) in enumerate(blocks):
+            SACK_BLOCK.pack_into(payload, SACK_COUNT.size + SACK_BLOCK.size * i, start, end)
+        packet = self.packet
+        packet.seq_num = expected_seq_num
+        packet.payload = payload
+        packet.checksum_type = checksum_type
+        packet.conn_id = conn_id
+        packet.window = window
+        packet.send(sock, address, self.header_buffer)
+
+# State of one transfer, identified by the sender's address and the connection
+# id it picked. Each flow has its own handshake state, checksum, receive window
+# and delayed ACKs.
+class Flow:
+    def __init__(self, address, conn_id, checksum_type, window_size, buffer_size=RECEIVE_BUFFER):
+        self.address = address
+        self.conn_id = conn_id
+        self.label = f"{address[0]}:{address[1]}#{conn_id:08x}"
+        self.state = SYN_RECEIVED
+        self.checksum_type = checksum_type
+        self.window_size = window_size
+        self.expected_seq_num = 0
+        self.received_data = bytearray()
+        self.receive_buffer = {}   # seq_num -> (payload, pool buffer) of packets received ahead of a gap (None once written to output)
+        self.output = None         # Preallocated buffer of a file transfer
+        self.transfer_size = 0
+        self.segment_size = 0
+        self.last_seq_num = 0
+        self.pending_acks = 0      # In-order packets not acknowledged yet
+        self.ack_deadline = None
+        self.acks_sent = 0
+        self.last_active = time.monotonic()
+        # Flow control: delivered bytes the application has not read yet take up
+        # the buffer, and the rest is advertised in each ACK
+        self.buffer_size = buffer_size
+        self.window_shift = window_scale(buffer_size)
+        self.unread = 0
+        self.last_read = 0
+        self.largest_payload = 0
+        self.last_window = buffer_size   # Last window advertised, in bytes
+
+    # Function to return the free buffer space to advertise. Less than a packet
+    # (or half the buffer) is advertised as 0, so the window reopens in useful
+    # steps rather than a few bytes at a time (silly window avoidance, RFC 1122).
+    def advertised_window(self):
+        free = self.buffer_size - self.unread
+        if free < min(self.buffer_size // 2, self.largest_payload):
+            free = 0
+        return free >> self.window_shift << self.window_shift
+
+    # Function to return the data of the transfer
+    def data(self):
+        if self.output is not None:
+            return self.output
+        return bytes(self.received_data)
+
+    # Function to give the buffers of packets still waiting for a gap back to the pool
+    def release(self, buffer_pool):
+        for entry in self.receive_buffer.values():
+            if entry is not None:
+                payload, buffer = entry
+                payload.release()
+                buffer_pool.release(buffer)
+        self.receive_buffer.clear()
+
+# Receiver serving concurrent transfers on one socket. Datagrams are drained in
+# batches and handed to the flow of their (address, connection id); a SYN for a
+# new pair opens a flow, up to max_flows at a time. A file transfer announces
+# its size and segment size in the SYN, so each packet is written straight to
+# its offset in a buffer from allocate(size); a plain transfer is delivered in
+# order. on_complete(flow) is called as each transfer's FIN arrives.
+#
+# In-order packets are acknowledged together (delayed ACKs): once per batch when
+# ack_every of them are waiting, otherwise within ack_delay seconds. Out-of-order
+# and duplicate packets are acknowledged at once, so the sender sees duplicate
+# ACKs and SACK blocks without delay. Flows silent for idle_timeout seconds are
+# evicted, and closed flows stay CLOSE_LINGER seconds to answer FIN retries.
+#
+# Counters and the batch size histogram go to metrics (a new Metrics by
+# default); packet events are logged at DEBUG, checked once at startup.
+class RdtServer:
+    def __init__(self, address=RECEIVER_ADDR, window_size=RECEIVE_WINDOW, allocate=bytearray,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, rcvbuf=SOCKET_RCVBUF, sndbuf=SOCKET_SNDBUF,
+                 max_flows=MAX_FLOWS, idle_timeout=IDLE_TIMEOUT, on_complete=None, buffer_size=RECEIVE_BUFFER,
+                 read_rate=READ_RATE, metrics=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        configure_socket_buffers(self.sock, rcvbuf, sndbuf)
+        self.window_size = window_size
+        self.allocate = allocate
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.on_complete = on_complete
+        self.buffer_size = buffer_size
+        self.read_rate = read_rate
+        # Datagrams land in pooled buffers; one is kept only while its packet waits
+        # in a reorder buffer
+        self.buffer_pool = BufferPool(MAX_DATAGRAM_SIZE, max_free=window_size + BATCH_SIZE)
+        # Each datagram is unpacked into the same Packet and each ACK written by the
+        # same AckWriter; flows keep payload views, never the Packet
+        self.packet = Packet(PACKET_TYPE_DATA, 0)
+        self.ack_writer = AckWriter()
+        self.batch_receiver = BatchReceiver(self.sock, self.buffer_pool)
+        self.flows = {}        # (address, conn_id) -> Flow
+        self.delayed = set()   # Flows with in-order packets not acknowledged yet
+        self.completed = 0
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.debug = log.isEnabledFor(logging.DEBUG)
+        self.next_sweep = time.monotonic() + 1
+        self.running = True
+
+    # Function to serve flows until max_transfers have completed (forever if None).
+    # Flows closed by then are still served until their CLOSE_LINGER runs out,
+    # so a sender whose FIN-ACK was lost gets its FIN retries answered.
+    def serve(self, max_transfers=None):
+        while self.running and (max_transfers is None or self.completed < max_transfers or self.lingering()):
+            timeout = TIMEOUT_INTERVAL
+            now = time.monotonic()
+            for flow in self.delayed:
+                if flow.ack_deadline is not None:
+                    timeout = min(timeout, max(0, flow.ack_deadline - now))
+            if self.read_rate is not None and any(flow.unread for flow in self.flows.values()):
+                timeout = min(timeout, READ_TICK)
+            batch = self.batch_receiver.receive(timeout)
+            if batch:
+                self.metrics.count('batches')
+                self.metrics.count('datagrams', len(batch))
+                self.metrics.observe('batch_size', len(batch))
+            for buffer, nbytes, address in batch:
+                held = False
+                try:
+                    held = self.handle_datagram(buffer, nbytes, address)
+                finally:
+                    if not held:
+                        self.buffer_pool.release(buffer)
+            self.flush_acks()
+            self.read_applications()
+            self.evict_idle()
+
+    # Function to handle one datagram; returns True if its buffer is held by a flow
+    def handle_datagram(self, buffer, nbytes, address):
+        if nbytes < HEADER_SIZE:
+            return False
+        packet = Packet.unpack(memoryview(buffer)[:nbytes], CHECKSUM_INET, self.packet)
+        if packet.version != PROTOCOL_VERSION:
+            self.metrics.count('bad_version')
+            log.warning("Packet of protocol version %d from %s:%d, dropped", packet.version, *address[:2])
+            return False
+        flow = self.flows.get((address, packet.conn_id))
+        if packet.packet_type == PACKET_TYPE_SYN:
+            self.handle_syn(packet, address, flow)
+            return False
+        if flow is None:
+            self.metrics.count('unknown_flow')
+            if self.debug:
+                log.debug("Packet from %s:%d for unknown connection %08x, dropped", *address[:2], packet.conn_id)
+            return False
+        if flow.state != SYN_RECEIVED and random.random() < LOSS_PROBABILITY:
+            self.metrics.count('simulated_losses')
+            if self.debug:
+                log.debug("Simulating packet loss.")
+            return False
+        packet.checksum_type = flow.checksum_type
+        if packet.is_corrupt():
+            self.metrics.count('corrupt')
+            if self.debug:
+                log.debug("Received corrupt packet.")
+            return False
+        flow.last_active = time.monotonic()
+
+        if packet.packet_type == PACKET_TYPE_ACK:
+            if flow.state == SYN_RECEIVED and packet.seq_num == 0:
+                flow.state = ESTABLISHED
+                log.info("Connection established with %s.", flow.label)
+            return False
+        if packet.packet_type == PACKET_TYPE_PROBE and flow.state == ESTABLISHED:
+            # The sender saw the window shut; answer with the current one
+            self.metrics.count('window_probes')
+            log.info("Window probe from %s, window %d bytes", flow.label, flow.advertised_window())
+            self.send_ack(flow)
+            return False
+        if packet.packet_type == PACKET_TYPE_FIN and packet.seq_num == 0:
+            # Send FIN-ACK, again for each FIN the sender retries
+            fin_ack_packet = Packet(PACKET_TYPE_FIN, 0, b'', flow.checksum_type, flow.conn_id).pack()
+            self.sock.sendto(fin_ack_packet, address)
+            if flow.state != CLOSED:
+                self.finish(flow)
+            return False
+        if packet.packet_type == PACKET_TYPE_DATA and flow.state != CLOSED:
+            if flow.state == SYN_RECEIVED:
+                # The handshake ACK was lost; data from the sender completes the handshake
+                flow.state = ESTABLISHED
+                log.info("Connection established with %s.", flow.label)
+            return self.handle_data(flow, packet, buffer)
         return False
 
-    if not establish_connection():
-        print("Failed to establish connection.")
-        return
+    # Function to open a flow for a SYN, or answer a retried SYN of a flow
+    # still in its handshake
+    def handle_syn(self, packet, address, flow):
+        if packet.is_corrupt():
+            self.metrics.count('corrupt')
+            log.info("Received corrupt SYN packet.")
+            return
+        if packet.seq_num != 0:
+            return
+        if flow is None:
+            if len(self.flows) >= self.max_flows:
+                # Closed flows only linger for FIN retries; make room from them first
+                for key, closed in list(self.flows.items()):
+                    if closed.state == CLOSED:
+                        self.evict(key, closed)
+            if len(self.flows) >= self.max_flows:
+                self.metrics.count('flows_refused')
+                log.warning("Connection limit of %d flows reached, SYN from %s:%d dropped", self.max_flows, *address[:2])
+                return
+            # The SYN offers a checksum, and a file transfer adds its size
+            options = packet.payload
+            checksum_type = CHECKSUM_INET
+            if len(options) >= SYN_OPTIONS.size:
+                offered, _ = SYN_OPTIONS.unpack_from(options)
+                if offered in CHECKSUM_FUNCTIONS:
+                    checksum_type = offered
+            flow = Flow(address, packet.conn_id, checksum_type, self.window_size, self.buffer_size)
+            if len(options) >= SYN_OPTIONS.size + TRANSFER_HEADER.size:
+                flow.transfer_size, flow.segment_size = TRANSFER_HEADER.unpack_from(options, SYN_OPTIONS.size)
+                try:
+                    flow.output = self.allocate(flow.transfer_size)
+                except (MemoryError, OSError, ValueError) as e:
+                    self.metrics.count('flows_refused')
+                    log.error("Cannot receive %d bytes from %s: %s", flow.transfer_size, flow.label, e)
+                    return
+                log.info("Receiving %d bytes in segments of %d bytes from %s.", flow.transfer_size, flow.segment_size,
+                         flow.label)
+            self.flows[(address, packet.conn_id)] = flow
+            self.metrics.count('flows_opened')
+        elif flow.state != SYN_RECEIVED:
+            return
+        # Send SYN-ACK naming the checksum used from here on, the window scale and
+        # the initial window
+        syn_ack_packet = Packet(PACKET_TYPE_SYN, 0, SYN_OPTIONS.pack(flow.checksum_type, flow.window_shift),
+                                CHECKSUM_INET, flow.conn_id, flow.advertised_window() >> flow.window_shift).pack()
+        self.sock.sendto(syn_ack_packet, address)
+        log.info("Sent SYN-ACK packet to %s.", flow.label)
 
-    connection_established = True
-    while connection_established:
-        try:
-            packet_bytes, addr = sock.recvfrom(4096)
-            if random.random() < LOSS_PROBABILITY:
-                print("Simulating packet loss.")
+    # Function to take in a data packet of an established flow; returns True if
+    # the packet's buffer is kept in the flow's reorder buffer
+    def handle_data(self, flow, packet, buffer):
+        held = False
+        debug = self.debug
+        metrics = self.metrics
+        seq_num = packet.seq_num
+        flow.last_seq_num = seq_num
+        receive_buffer = flow.receive_buffer
+        # Anything but the next packet in order, with no gap open, is acknowledged at once
+        ack_now = self.ack_every <= 1 or seq_num != flow.expected_seq_num or bool(receive_buffer)
+        flow.largest_payload = max(flow.largest_payload, len(packet.payload))
+        if seq_num in receive_buffer:
+            metrics.count('duplicates')
+            if debug:
+                log.debug("Duplicate packet %d", seq_num)
+        elif (flow.expected_seq_num <= seq_num < flow.expected_seq_num + flow.window_size
+              and flow.unread + len(packet.payload) > flow.buffer_size):
+            # Sent before the sender saw the window shrink
+            metrics.count('buffer_full_drops')
+            if debug:
+                log.debug("Packet %d does not fit the receive buffer, dropped", seq_num)
+            ack_now = True
+        elif flow.expected_seq_num <= seq_num < flow.expected_seq_num + flow.window_size:
+            if seq_num != flow.expected_seq_num:
+                metrics.count('out_of_order')
+                if debug:
+                    log.debug("Buffered out-of-order packet %d, expecting %d", seq_num, flow.expected_seq_num)
+            if flow.output is None:
+                receive_buffer[seq_num] = (packet.payload, buffer)
+                held = True
+            else:
+                # A file transfer places each packet at its offset as soon as it
+                # arrives, so out-of-order packets need no copy in the buffer
+                offset = seq_num * flow.segment_size
+                if offset + len(packet.payload) > flow.transfer_size:
+                    metrics.count('malformed')
+                    log.warning("Packet %d runs past the end of the transfer, dropped", seq_num)
+                    return False
+                flow.output[offset:offset + len(packet.payload)] = packet.payload
+                receive_buffer[seq_num] = None
+
+            # Deliver everything that is now in order
+            while flow.expected_seq_num in receive_buffer:
+                entry = receive_buffer.pop(flow.expected_seq_num)
+                if entry is None:
+                    if debug:
+                        log.debug("Received segment %d of the file", flow.expected_seq_num)
+                    delivered = min(flow.segment_size, flow.transfer_size - flow.expected_seq_num * flow.segment_size)
+                else:
+                    payload, payload_buffer = entry
+                    if debug:
+                        log.debug("Received data: %s with sequence number %d", bytes(payload).decode(errors='replace'),
+                                  flow.expected_seq_num)
+                    flow.received_data += payload
+                    delivered = len(payload)
+                    payload.release()
+                    self.buffer_pool.release(payload_buffer)
+                if self.read_rate is not None:
+                    # Held until the application reads it
+                    if not flow.unread:
+                        flow.last_read = time.monotonic()
+                    flow.unread += delivered
+                metrics.count('bytes_delivered', delivered)
+                flow.expected_seq_num += 1
+        elif seq_num < flow.expected_seq_num:
+            metrics.count('duplicates')
+            if debug:
+                log.debug("Duplicate packet %d", seq_num)
+        else:
+            metrics.count('out_of_window_drops')
+            if debug:
+                log.debug("Packet %d is outside the receive window, dropped", seq_num)
+
+        if ack_now:
+            self.send_ack(flow)
+        else:
+            flow.pending_acks += 1
+            self.delayed.add(flow)
+        return held
+
+    def send_ack(self, flow):
+        # Acknowledge what has arrived so far, so the sender only resends the gaps
+        flow.last_window = flow.advertised_window()
+        self.ack_writer.send(self.sock, flow.address, flow.expected_seq_num, flow.receive_buffer, flow.last_seq_num,
+                             flow.checksum_type, flow.conn_id, flow.last_window >> flow.window_shift)
+        flow.pending_acks = 0
+        flow.ack_deadline = None
+        flow.acks_sent += 1
+        self.metrics.count('acks_sent')
+        self.delayed.discard(flow)
+
+    # Function to send each flow's cumulative ACK for the in-order packets of the
+    # batch, or start its timer
+    def flush_acks(self):
+        now = time.monotonic()
+        for flow in list(self.delayed):
+            if flow.pending_acks >= self.ack_every or (flow.ack_deadline is not None and now >= flow.ack_deadline):
+                self.send_ack(flow)
+            elif flow.ack_deadline is None:
+                flow.ack_deadline = now + self.ack_delay
+
+    # Function to let each flow's application read at read_rate, and send a
+    # window update to a sender whose window was shut once there is room again
+    def read_applications(self):
+        if self.read_rate is None:
+            return
+        now = time.monotonic()
+        for flow in self.flows.values():
+            if not flow.unread:
                 continue
-            packet = Packet.unpack(packet_bytes)
-            if packet.is_corrupt():
-                print("Received corrupt data packet.")
+            read = min(flow.unread, int(self.read_rate * (now - flow.last_read)))
+            if not read:
                 continue
-            if packet.packet_type == PACKET_TYPE_FIN and packet.seq_num == 0:
-                # Send FIN-ACK
-                fin_ack_packet = Packet(PACKET_TYPE_FIN, 0).pack()
-                sock.sendto(fin_ack_packet, sender_address)
-                print("Connection terminated by sender.")
-                connection_established = False
-                break
-            if packet.packet_type == PACKET_TYPE_DATA:
-                if packet.seq_num == expected_seq_num:
-                    data_str = packet.payload.decode()
-                    print(f"Received data: {data_str} with sequence number {packet.seq_num}")
-                    received_data.append(data_str)
-                    # Send ACK
-                    ack_packet = Packet(PACKET_TYPE_ACK, packet.seq_num).pack()
-                    sock.sendto(ack_packet, sender_address)
-                    expected_seq_num += 1
-                else:
-                    print(f"Unexpected sequence number. Expected {expected_seq_num}, got {packet.seq_num}")
-                    # Resend ACK for the last acknowledged packet
-                    ack_seq_num = expected_seq_num - 1 if expected_seq_num > 0 else 0
-                    ack_packet = Packet(PACKET_TYPE_ACK, ack_seq_num).pack()
-                    sock.sendto(ack_packet, sender_address)
-        except socket.timeout:
-            continue
+            flow.unread -= read
+            flow.last_read += read / self.read_rate
+            if flow.state == ESTABLISHED and flow.last_window == 0 and flow.advertised_window() > 0:
+                self.metrics.count('window_updates')
+                if self.debug:
+                    log.debug("Window update to %s: %d bytes", flow.label, flow.advertised_window())
+                self.send_ack(flow)
+
+    # Function to close a flow whose FIN arrived and hand over its data
+    def finish(self, flow):
+        flow.state = CLOSED
+        flow.release(self.buffer_pool)
+        self.delayed.discard(flow)
+        self.completed += 1
+        self.metrics.count('flows_completed')
+        log.info("Connection terminated by sender %s after %d packets, %d ACKs.", flow.label, flow.expected_seq_num,
+                 flow.acks_sent)
+        if self.on_complete is not None:
+            self.on_complete(flow)
+        # Only the FIN-ACK is answered from here on
+        flow.output = None
+        flow.received_data = bytearray()
+
+    def evict(self, key, flow):
+        flow.release(self.buffer_pool)
+        self.delayed.discard(flow)
+        del self.flows[key]
+
+    # Function to drop flows that have gone quiet, once a second at most
+    def evict_idle(self):
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + 1
+        for key, flow in list(self.flows.items()):
+            idle = now - flow.last_active
+            if flow.state == CLOSED:
+                if idle >= CLOSE_LINGER:
+                    self.evict(key, flow)
+            elif idle >= self.idle_timeout:
+                self.metrics.count('flows_evicted')
+                log.warning("Evicted flow %s (%s) after %.0f s without packets", flow.label, flow.state, idle)
+                self.evict(key, flow)
+        self.metrics.record('active_flows', len(self.flows))
+
+    # True while a closed flow is kept to answer FIN retries
+    def lingering(self):
+        return any(flow.state == CLOSED for flow in self.flows.values())
 
-    print("All data received.")
-    sock.close()
+    # Function to make serve() return within TIMEOUT_INTERVAL; safe from another thread
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for key, flow in list(self.flows.items()):
+            self.evict(key, flow)
+        self.batch_receiver.close()
+        self.sock.close()
+        counter = self.metrics.counter
+        log.info("Received %d datagrams in %d batches, sent %d ACKs (%d window updates).", counter('datagrams'),
+                 counter('batches'), counter('acks_sent'), counter('window_updates'))
+
+# Function to receive one transfer and return its data: bytes for a plain
+# transfer, or the buffer from allocate(size) (a bytearray by default) that a
+# file transfer was written into. Only one flow is served, so a second sender's
+# SYN is dropped while the first transfer is running.
+def rdt_receive(window_size=RECEIVE_WINDOW, allocate=bytearray, ack_every=ACK_EVERY, ack_delay=ACK_DELAY,
+                rcvbuf=SOCKET_RCVBUF, sndbuf=SOCKET_SNDBUF, buffer_size=RECEIVE_BUFFER, read_rate=READ_RATE,
+                metrics=None):
+    results = []
+    server = RdtServer(RECEIVER_ADDR, window_size, allocate, ack_every, ack_delay, rcvbuf, sndbuf,
+                       max_flows=1, on_complete=lambda flow: results.append(flow.data()), buffer_size=buffer_size,
+                       read_rate=read_rate, metrics=metrics)
+    try:
+        server.serve(max_transfers=1)
+    finally:
+        server.close()
+    log.info("All data received.")
+    return results[0] if results else None
+
+# Function to receive a transfer into a file. A file transfer is written in
+# place into the file, preallocated to its final size and mapped into memory.
+# The file is mapped for one flow only: a later SYN (e.g. after the first flow
+# was evicted) is refused rather than truncating the file under the live map.
+def receive_file(path, window_size=RECEIVE_WINDOW, **kwargs):
+    with open(path, 'w+b') as file:
+        mapped = []
+
+        def allocate(size):
+            if mapped:
+                raise ValueError(f"{path} is already being received")
+            file.truncate(size)
+            mapped.append(mmap.mmap(file.fileno(), size) if size else bytearray())
+            return mapped[0]
+
+        data = rdt_receive(window_size, allocate, **kwargs)
+        if mapped and isinstance(mapped[0], mmap.mmap):
+            mapped[0].flush()
+            mapped[0].close()
+        elif data:
+            # A plain transfer has no size up front; write what arrived
+            file.write(data)
+    return data is not None
+
+# Function to write each finished transfer to output_dir, named after its flow
+def save_to_directory(output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+
+    def save(flow):
+        host, port = flow.address[:2]
+        path = os.path.join(output_dir, f"{host}_{port}_{flow.conn_id:08x}.bin")
+        with open(path, 'wb') as file:
+            file.write(flow.data())
+        log.info("Saved %s to %s", flow.label, path)
+    return save
 
 if __name__ == "__main__":
-    rdt_receive()
+    parser = argparse.ArgumentParser(description="RDT receiver")
+    parser.add_argument('--window', type=int, default=RECEIVE_WINDOW,
+                        help="packets buffered ahead of a gap (1 = go-back-N)")
+    parser.add_argument('--output', help="write the received data to this file")
+    parser.add_argument('--ack-every', type=int, default=ACK_EVERY,
+                        help="in-order packets per delayed ACK (1 = ACK every packet)")
+    parser.add_argument('--ack-delay', type=float, default=ACK_DELAY, help="max seconds to delay an ACK")
+    parser.add_argument('--rcvbuf', type=int, default=SOCKET_RCVBUF, help="SO_RCVBUF in bytes")
+    parser.add_argument('--sndbuf', type=int, default=SOCKET_SNDBUF, help="SO_SNDBUF in bytes")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep running and serve concurrent transfers until interrupted")
+    parser.add_argument('--output-dir', help="with --serve, save each finished transfer in this directory")
+    parser.add_argument('--max-flows', type=int, default=MAX_FLOWS, help="concurrent flows served")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="seconds without packets before a flow is evicted")
+    parser.add_argument('--buffer', type=int, default=RECEIVE_BUFFER,
+                        help="receive buffer per flow in bytes; its free space is the advertised window")
+    parser.add_argument('--read-rate', type=float, default=READ_RATE,
+                        help="emulate an application reading this many bytes per second (default: at once)")
+    parser.add_argument('--seed', type=int, help="seed the simulated loss")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='info',
+                        help="debug logs every packet event")
+    parser.add_argument('--metrics', help="write the metrics to this .json or .csv file on exit")
+    parser.add_argument('--stats-port', type=int, help="serve live metrics as JSON on this local TCP port")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    if args.seed is not None:
+        random.seed(args.seed)
+    metrics = Metrics()
+    stats_server = StatsServer(metrics.snapshot, args.stats_port) if args.stats_port else None
+    options = dict(ack_every=args.ack_every, ack_delay=args.ack_delay, rcvbuf=args.rcvbuf, sndbuf=args.sndbuf,
+                   buffer_size=args.buffer, read_rate=args.read_rate, metrics=metrics)
+    try:
+        if args.serve:
+            server = RdtServer(RECEIVER_ADDR, args.window, max_flows=args.max_flows, idle_timeout=args.idle_timeout,
+                               on_complete=save_to_directory(args.output_dir) if args.output_dir else None,
+                               **options)
+            log.info("Serving on %s:%d", *RECEIVER_ADDR)
+            try:
+                server.serve()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.close()
+        elif args.output:
+            receive_file(args.output, args.window, **options)
+        else:
+            rdt_receive(args.window, **options)
+    finally:
+        if args.metrics:
+            export(metrics.snapshot(), args.metrics)
+        if stats_server is not None:
+            stats_server.close()
@@ -0,0 +1,44 @@
+# rtt_estimator.py
+
+# RFC 6298 constants
+INITIAL_RTO = 1.0       # Seconds, before the first RTT sample
+MIN_RTO = 0.2           # Lower clamp; RFC 6298 suggests 1 s, but that is far above loopback RTTs
+MAX_RTO = 60.0          # Upper clamp, also bounds exponential backoff
+CLOCK_GRANULARITY = 0.01
+ALPHA = 1 / 8           # Gain for SRTT
+BETA = 1 / 4            # Gain for RTTVAR
+K = 4
+
+# Retransmission timeout estimator (RFC 6298). Feed it RTT samples from packets
+# that were sent only once (Karn's algorithm: an ACK for a retransmitted packet
+# can't tell which copy it answers), and call backoff() when the oldest
+# outstanding packet times out.
+class RttEstimator:
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.backoffs = 0       # Consecutive doublings since the last sample
+
+    # Function to update the estimate with a new RTT measurement (seconds)
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.backoffs = 0
+        self.rto = self.clamp(self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar))
+        return self.rto
+
+    # Function to double the timeout after a retransmission timeout (RFC 6298, 5.5)
+    def backoff(self):
+        self.backoffs += 1
+        self.rto = self.clamp(self.rto * 2)
+        return self.rto
+
+    def clamp(self, rto):
+        return min(self.max_rto, max(self.min_rto, rto))
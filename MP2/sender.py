@@ -1,233 +1,481 @@
 # sender.py
 
+import argparse
+import logging
+import mmap
+import os
 import socket
-import struct
 import random
 import threading
 import time
-import matplotlib.pyplot as plt
+
+from packet import (Packet, BufferPool, PACKET_TYPE_DATA, PACKET_TYPE_SYN, PACKET_TYPE_ACK, PACKET_TYPE_FIN,
+                    PACKET_TYPE_PROBE, PROTOCOL_VERSION, CHECKSUM_INET, CHECKSUM_NAMES, DEFAULT_CHECKSUM, HEADER_SIZE, SYN_OPTIONS, TRANSFER_HEADER,
+                    SACK_COUNT, SACK_BLOCK, MAX_PAYLOAD_SIZE)
+from batch_io import BatchReceiver, configure_socket_buffers, BATCH_SIZE, SOCKET_RCVBUF, SOCKET_SNDBUF
+from congestion_control import CONTROLLERS, create_controller
+from metrics import Metrics, StatsServer, LOG_LEVELS, configure_logging, export
+from rtt_estimator import RttEstimator
+from timer_wheel import TimerWheel
 
 # Constants
 INITIAL_CWND = 1
 INITIAL_SSTHRESH = 16
-TIMEOUT_INTERVAL = 1.0
+TIMEOUT_INTERVAL = 1.0    # Initial RTO, until RTT samples arrive
 LOSS_PROBABILITY = 0.1
 ERROR_PROBABILITY = 0.05
 MAX_SEQ_NUM = 2**32 - 1
-
-# Packet Types
-PACKET_TYPE_DATA = 0
-PACKET_TYPE_SYN = 1
-PACKET_TYPE_ACK = 2
-PACKET_TYPE_FIN = 3
-
-class Packet:
-    def __init__(self, packet_type, seq_num, payload=b''):
-        self.packet_type = packet_type  # 1 byte
-        self.seq_num = seq_num          # 4 bytes
-        self.payload = payload          # variable length
-        self.checksum = 0               # 2 bytes, will be computed
-
-    def compute_checksum(self):
-        checksum = self.packet_type + self.seq_num
-        checksum += sum(self.payload)
-        return checksum & 0xFFFF  # Return as 16-bit value
-
-    def pack(self):
-        self.checksum = self.compute_checksum()
-        header = struct.pack('!B I H', self.packet_type, self.seq_num, self.checksum)
-        return header + self.payload
-
-    @staticmethod
-    def unpack(packet_bytes):
-        packet_type, seq_num, checksum = struct.unpack('!B I H', packet_bytes[:7])
-        payload = packet_bytes[7:]
-        packet = Packet(packet_type, seq_num, payload)
-        packet.checksum = checksum
-        return packet
-
-    def is_corrupt(self):
-        return self.checksum != self.compute_checksum()
-
-def rdt_send(sock, data_segments, receiver_address):
+MAX_WINDOW = 64    # Packets in flight; matches the receiver's default receive window
+SEGMENT_SIZE = 1000     # Payload bytes per packet of a file transfer
+SYN_RETRIES = 4         # SYN attempts, 1 s apart and doubling, before giving up
+FIN_RETRIES = 5
+DUPACK_THRESHOLD = 3    # Duplicate ACKs that trigger a fast retransmit
+LIMITED_TRANSMIT = 2    # New packets sent past the window on the first duplicate ACKs (RFC 3042)
+PACING_SLACK = 0.001    # Pacing delays shorter than this are sent without sleeping
+ACK_WAIT_TIMEOUT = 2    # Seconds the ACK thread waits before rechecking for the end of the transfer
+MAX_PROBE_INTERVAL = 60    # Cap on the zero-window probe backoff, in seconds
+
+# One timer wheel drives the retransmission timers of every transfer
+RETRANSMIT_TIMERS = TimerWheel()
+
+log = logging.getLogger('rdt.sender')
+
+# Read-only view of a buffer as segment_size-byte payloads. Segments are cut on
+# demand as memoryview slices, which copy nothing, so a mapped file is paged in
+# only as its packets are sent.
+class Segments:
+    def __init__(self, buffer, segment_size=SEGMENT_SIZE):
+        self.view = memoryview(buffer)
+        self.segment_size = segment_size
+
+    def __len__(self):
+        return -(-len(self.view) // self.segment_size)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * self.segment_size
+        return self.view[start:start + self.segment_size]
+
+    def release(self):
+        self.view.release()
+
+# Function to read the SACK ranges from an ACK payload: a block count followed
+# by [start, end) pairs of packets the receiver holds beyond the cumulative ACK
+def parse_sack_blocks(payload):
+    if len(payload) < SACK_COUNT.size:
+        return []
+    count, = SACK_COUNT.unpack_from(payload)
+    blocks = []
+    for i in range(count):
+        offset = SACK_COUNT.size + SACK_BLOCK.size * i
+        if offset + SACK_BLOCK.size > len(payload):
+            break
+        blocks.append(SACK_BLOCK.unpack_from(payload, offset))
+    return blocks
+
+# Function to send a sequence of bytes-like payloads, one per packet. A file
+# transfer passes transfer_size and segment_size, which the SYN carries so the
+# receiver can preallocate and place each packet at seq_num * segment_size.
+#
+# Counters, RTT/cwnd/throughput/RTO series and histograms go to metrics (a new
+# Metrics by default), all bounded in size. Packet events are logged at DEBUG;
+# whether that level is on is checked once, so it costs nothing when off.
+def rdt_send(sock, data_segments, receiver_address, timers=RETRANSMIT_TIMERS, plot=False,
+             congestion_control='newreno', transfer_size=None, segment_size=None, checksum=DEFAULT_CHECKSUM,
+             rcvbuf=SOCKET_RCVBUF, sndbuf=SOCKET_SNDBUF, metrics=None):
+    configure_socket_buffers(sock, rcvbuf, sndbuf)
+    metrics = metrics if metrics is not None else Metrics()
+    debug = log.isEnabledFor(logging.DEBUG)
     base_seq_num = 0
     next_seq_num = 0
     window = {}
-    timers = {}
+    flow = object()   # Keeps this transfer's timer keys apart from other transfers'
     window_lock = threading.Lock()
     ack_event = threading.Event()
 
-    congestion_window = INITIAL_CWND
-    ssthresh = INITIAL_SSTHRESH
-
-    # Performance Metrics Data
+    # Congestion control: the controller owns cwnd and ssthresh; this function
+    # detects the loss events (duplicate ACKs, partial ACKs, timeouts) it reacts to
+    controller = create_controller(congestion_control, INITIAL_CWND, INITIAL_SSTHRESH)
+    dupacks = 0
+    in_recovery = False
+    recovery_point = 0         # Fast recovery ends once everything below this is acknowledged
+    timeout_point = 0          # Timeouts of packets sent before this were already responded to
+    next_send_time = 0.0
+    checksum_type = CHECKSUM_INET    # Until the SYN-ACK confirms the one offered
+    conn_id = int.from_bytes(os.urandom(4), 'big')   # Tells this transfer apart at the receiver
+
+    # Flow control: the receiver advertises its free buffer space (rwnd, in bytes
+    # from the cumulative ACK) in every ACK. Sending is bounded by both cwnd and
+    # rwnd; with rwnd closed and nothing in flight, probes ask for window updates.
+    rwnd = 0
+    window_shift = 0
+    flight_bytes = 0           # Bytes of the packets from base_seq_num up to next_seq_num
+    sent_sizes = {}
+
+    # Send times and retransmission marks are kept only for packets in flight
     send_times = {}
-    ack_times = {}
-    rtt_values = {}
-    cwnd_values = []
-    cwnd_times = []
-    throughput_times = []
-    throughput_values = []
-    data_sent = 0
+    retransmitted = set()    # Packets sent more than once give no RTT sample (Karn)
+    timed_out = set()        # Packets last resent by their own timer
+    rtt_estimator = RttEstimator(initial_rto=TIMEOUT_INTERVAL)
     start_time = time.time()
 
+    # The timer carries the send time it covers: the wheel runs due callbacks
+    # outside its lock, so one can still fire after the packet was resent
     def start_timer(seq_num):
-        timers[seq_num] = threading.Timer(TIMEOUT_INTERVAL, handle_timeout, args=(seq_num,))
-        timers[seq_num].start()
+        timers.arm((flow, seq_num), rtt_estimator.rto, handle_timeout, seq_num, send_times[seq_num])
 
-    def handle_timeout(seq_num):
-        nonlocal congestion_window, ssthresh
+    def record_rto():
+        metrics.record('rto_ms', rtt_estimator.rto * 1000)
+
+    def retransmit(seq_num):
+        retransmitted.add(seq_num)
+        metrics.count('retransmissions')
+        send_packet(seq_num, window[seq_num])
+        start_timer(seq_num)
+
+    def handle_timeout(seq_num, sent_at):
+        nonlocal dupacks, in_recovery, timeout_point
         with window_lock:
-            if seq_num in window:
-                print(f"Timeout occurred for packet {seq_num}. Retransmitting.")
-                send_packet(seq_num, window[seq_num])
-                start_timer(seq_num)
-                ssthresh = max(int(congestion_window // 2), 1)
-                congestion_window = 1
-                print(f"Updated ssthresh to {ssthresh} and reset congestion window to {congestion_window}")
+            # Ignore a timer that fired for an earlier send of a packet resent since
+            if seq_num in window and send_times[seq_num] == sent_at:
+                metrics.count('timeouts')
+                if debug:
+                    log.debug("Timeout occurred for packet %d. Retransmitting.", seq_num)
+                # Back off once per loss event, and again only when a packet resent by
+                # its timer times out once more; not for every other hole of the same
+                # window whose own timer fires, as no RTT sample comes in between (Karn)
+                if seq_num >= timeout_point or seq_num in timed_out:
+                    rtt_estimator.backoff()
+                    record_rto()
+                retransmit(seq_num)
+                timed_out.add(seq_num)
+                # Likewise cut the window once per loss event
+                if seq_num >= timeout_point:
+                    controller.on_timeout(len(window), time.time())
+                    timeout_point = next_seq_num
+                    in_recovery = False
+                    dupacks = 0
+                    if debug:
+                        log.debug("Updated ssthresh to %.1f and reset congestion window to %.1f",
+                                  controller.ssthresh, controller.cwnd)
+
+    # Data packets go out through one reused Packet and header buffer (always
+    # under window_lock), and sendmsg sends the payload view without a copy
+    outgoing = Packet(PACKET_TYPE_DATA, 0, conn_id=conn_id)
+    header_buffer = bytearray(HEADER_SIZE)
 
     def send_packet(seq_num, payload):
-        packet = Packet(PACKET_TYPE_DATA, seq_num, payload).pack()
+        outgoing.seq_num = seq_num
+        outgoing.payload = payload
+        outgoing.checksum_type = checksum_type
         # Record send time
         send_times[seq_num] = time.time()
+        controller.on_packet_sent(seq_num, send_times[seq_num])
+        metrics.count('packets_sent')
         if random.random() > LOSS_PROBABILITY:
             if random.random() < ERROR_PROBABILITY:
-                packet = corrupt_packet(packet)
-            sock.sendto(packet, receiver_address)
-            print(f"Sent packet {seq_num}")
+                sock.sendto(corrupt_packet(outgoing.pack()), receiver_address)
+            else:
+                outgoing.send(sock, receiver_address, header_buffer)
+            if debug:
+                log.debug("Sent packet %d", seq_num)
         else:
-            print(f"Simulated packet loss for packet {seq_num}")
+            metrics.count('simulated_losses')
+            if debug:
+                log.debug("Simulated packet loss for packet %d", seq_num)
+
+    def send_probe():
+        probe_packet = Packet(PACKET_TYPE_PROBE, next_seq_num, b'', checksum_type, conn_id).pack()
+        sock.sendto(probe_packet, receiver_address)
+        metrics.count('window_probes')
+        log.info("Receive window closed, sent window probe for packet %d", next_seq_num)
 
     def corrupt_packet(packet_bytes):
         # Introduce an error in the payload
-        packet_list = list(packet_bytes)
-        if len(packet_list) > 7:
-            packet_list[7] ^= 0xFF  # Flip bits in the first byte of the payload
-        return bytes(packet_list)
+        if len(packet_bytes) > HEADER_SIZE:
+            packet_bytes[HEADER_SIZE] ^= 0xFF  # Flip bits in the first byte of the payload
+        return packet_bytes
 
     def sending_thread():
-        nonlocal next_seq_num, congestion_window, data_sent
+        nonlocal next_seq_num, next_send_time, flight_bytes
         total_data_segments = len(data_segments)
+        probe_interval = None
         while base_seq_num < total_data_segments:
+            delay = 0
+            zero_window = False
             with window_lock:
-                while next_seq_num < base_seq_num + int(congestion_window) and next_seq_num < total_data_segments:
-                    payload = data_segments[next_seq_num].encode()
-                    send_packet(next_seq_num, payload)
-                    data_sent += len(payload)
+                # Cleared under the lock, so an ACK that opens the window after this
+                # check still wakes the wait below
+                ack_event.clear()
+                send_window = min(int(controller.cwnd), MAX_WINDOW)
+                # Limited transmit: each of the first duplicate ACKs lets one new packet
+                # out, so a small window still draws enough ACKs for a fast retransmit
+                if not in_recovery:
+                    send_window += min(dupacks, LIMITED_TRANSMIT)
+                # Send what the window allows in one go, unless a pacing controller
+                # spaces the packets out
+                while next_seq_num < base_seq_num + send_window and next_seq_num < total_data_segments:
+                    now = time.time()
+                    delay = next_send_time - now
+                    if delay > PACING_SLACK:
+                        break
+                    payload = data_segments[next_seq_num]
+                    if flight_bytes + len(payload) > rwnd:
+                        # The receiver has no room for it; with nothing in flight no
+                        # ACK will come back to reopen the window, so probe for one
+                        zero_window = not window
+                        break
                     window[next_seq_num] = payload
+                    send_packet(next_seq_num, payload)
+                    metrics.count('bytes_sent', len(payload))
+                    flight_bytes += len(payload)
+                    sent_sizes[next_seq_num] = len(payload)
                     start_timer(next_seq_num)
                     next_seq_num += 1
-            ack_event.wait()
-            ack_event.clear()
+                    next_send_time = max(next_send_time, now) + controller.pacing_interval()
+            if delay > PACING_SLACK:
+                time.sleep(delay)
+                continue
+            if zero_window:
+                # Persist timer: probe after an RTO, backing off while the window stays shut
+                if probe_interval is None:
+                    probe_interval = rtt_estimator.rto
+                if not ack_event.wait(probe_interval):
+                    send_probe()
+                    probe_interval = min(probe_interval * 2, MAX_PROBE_INTERVAL)
+                continue
+            probe_interval = None
+            # Bounded, so the loop condition is re-checked even if a wakeup is missed
+            ack_event.wait(ACK_WAIT_TIMEOUT)
             # Record congestion window size and time
-            cwnd_values.append(congestion_window)
-            cwnd_times.append(time.time() - start_time)
-        print("All data segments sent.")
+            metrics.record('cwnd', controller.cwnd)
+        log.info("All data segments sent.")
 
     def ack_receiver_thread():
-        nonlocal base_seq_num, congestion_window, ssthresh, data_sent
-        sock.settimeout(2)
+        nonlocal base_seq_num, dupacks, in_recovery, recovery_point, rwnd, flight_bytes
         last_throughput_calc_time = start_time
         bytes_acked_since_last = 0
         while base_seq_num < len(data_segments):
-            try:
-                packet_bytes, _ = sock.recvfrom(4096)
-                packet = Packet.unpack(packet_bytes)
-                if packet.is_corrupt():
-                    print("Received corrupt ACK packet.")
-                    continue
-                if packet.packet_type == PACKET_TYPE_ACK:
-                    ack_seq_num = packet.seq_num
-                    with window_lock:
-                        if ack_seq_num >= base_seq_num:
-                            print(f"Received ACK for packet {ack_seq_num}")
-                            # Record ACK receive time and calculate RTT
-                            ack_times[ack_seq_num] = time.time()
-                            rtt = ack_times[ack_seq_num] - send_times[ack_seq_num]
-                            rtt_values[ack_seq_num] = rtt
-
-                            # Cancel timers and remove acknowledged packets from the window
-                            for seq in range(base_seq_num, ack_seq_num + 1):
-                                if seq in timers:
-                                    timers[seq].cancel()
-                                    del timers[seq]
-                                if seq in window:
-                                    del window[seq]
-                            # Update base sequence number
+            # Every ACK that queued up since the last wakeup is handled in one batch
+            for buffer, nbytes, _ in ack_receiver.receive(ACK_WAIT_TIMEOUT):
+                try:
+                    if nbytes < HEADER_SIZE:
+                        continue
+                    packet = Packet.unpack(memoryview(buffer)[:nbytes], checksum_type)
+                    if packet.is_corrupt():
+                        metrics.count('corrupt_acks')
+                        if debug:
+                            log.debug("Received corrupt ACK packet.")
+                        continue
+                    if packet.version != PROTOCOL_VERSION:
+                        continue
+                    if packet.packet_type == PACKET_TYPE_ACK and packet.conn_id == conn_id:
+                        # The ACK names the next packet the receiver expects, and its SACK
+                        # blocks list packets it already holds beyond that
+                        ack_seq_num = packet.seq_num
+                        sack_blocks = parse_sack_blocks(packet.payload)
+                        with window_lock:
+                            newly_acked = {seq for seq in range(base_seq_num, min(ack_seq_num, next_seq_num))
+                                           if seq in window}
+                            for start, end in sack_blocks:
+                                newly_acked.update(seq for seq in range(max(start, ack_seq_num), min(end, next_seq_num))
+                                                   if seq in window)
+                            advanced = ack_seq_num > base_seq_num
+                            # A window update carries no new ACK; it only wakes the sending thread
+                            advertised = packet.window << window_shift
+                            window_update = advertised != rwnd
+                            rwnd = advertised
+                            # A duplicate ACK repeats the cumulative ACK while the packet it
+                            # names is still outstanding, with the window unchanged
+                            duplicate = (not advanced and not window_update and ack_seq_num == base_seq_num
+                                         and base_seq_num in window)
+                            if not (advanced or newly_acked or duplicate):
+                                if window_update:
+                                    metrics.count('window_updates')
+                                    if debug:
+                                        log.debug("Receive window update: %d bytes", rwnd)
+                                    ack_event.set()
+                                continue
+
+                            metrics.count('acks_received')
+                            if debug:
+                                log.debug("Received ACK %d with SACK blocks %s", ack_seq_num, sack_blocks)
+                            now = time.time()
+                            rtt_sample = None
+                            # Calculate RTT for the newest packet acknowledged
+                            if newly_acked:
+                                latest_seq_num = max(newly_acked)
+                                rtt = now - send_times[latest_seq_num]
+                                metrics.record('rtt_ms', rtt * 1000, latest_seq_num)
+                                metrics.observe('rtt_ms', rtt * 1000)
+                                if latest_seq_num not in retransmitted:
+                                    rtt_sample = rtt
+                                    rtt_estimator.sample(rtt)
+                                    record_rto()
+
+                            # Cancel timers and remove acknowledged packets from the window;
+                            # packets still missing keep their timers and are resent on their own
                             bytes_acked = 0
-                            for seq in range(base_seq_num, ack_seq_num + 1):
-                                bytes_acked += len(data_segments[seq])
-                            base_seq_num = ack_seq_num + 1
+                            for seq in newly_acked:
+                                timers.cancel((flow, seq))
+                                bytes_acked += len(window.pop(seq))
+                                retransmitted.discard(seq)
+                                timed_out.discard(seq)
+                                del send_times[seq]
+                            # Update base sequence number
+                            for seq in range(base_seq_num, min(ack_seq_num, next_seq_num)):
+                                flight_bytes -= sent_sizes.pop(seq)
+                            base_seq_num = max(base_seq_num, min(ack_seq_num, next_seq_num))
                             bytes_acked_since_last += bytes_acked
 
                             # Congestion control
-                            if congestion_window < ssthresh:
-                                # Slow start phase
-                                congestion_window += 1
-                            else:
-                                # Congestion avoidance phase
-                                congestion_window += 1 / congestion_window
-                            print(f"Updated congestion window size: {congestion_window}")
+                            acked = sorted(newly_acked)
+                            if acked:
+                                controller.on_delivered(acked, rtt_sample, now, len(window))
+                            if advanced:
+                                dupacks = 0
+                                if not in_recovery:
+                                    controller.on_ack(acked, rtt_sample, now, len(window))
+                                elif base_seq_num >= recovery_point:
+                                    # Full ACK: everything outstanding at the loss has arrived
+                                    in_recovery = False
+                                    controller.on_exit_recovery(len(window), now)
+                                    if debug:
+                                        log.debug("Left fast recovery at ACK %d", ack_seq_num)
+                                else:
+                                    # Partial ACK: the next hole was lost too, resend it now
+                                    # rather than wait for its timer (NewReno)
+                                    controller.on_partial_ack(len(acked))
+                                    if base_seq_num in window:
+                                        retransmit(base_seq_num)
+                                    # Like TCP's single timer restarted on a partial ACK (RFC 6582),
+                                    # give the other holes a fresh RTO: they are resent one per round
+                                    # trip by partial ACKs, and letting their original timers fire
+                                    # would abort recovery with a timeout
+                                    for seq in range(base_seq_num + 1, min(recovery_point, next_seq_num)):
+                                        if seq in window:
+                                            start_timer(seq)
+                            elif duplicate:
+                                dupacks += 1
+                                metrics.count('duplicate_acks')
+                                if in_recovery:
+                                    controller.on_dupack()
+                            # Packets beyond the hole that the receiver already holds
+                            sacked = next_seq_num - base_seq_num - len(window)
+                            # Enter recovery after DUPACK_THRESHOLD duplicate ACKs, or once as many
+                            # packets past the hole are SACKed (RFC 6675): in a small window the
+                            # ACK that moves the base up to the hole is not a duplicate, so too
+                            # few duplicates come back and the hole would wait for its timer.
+                            # A hole already resent after a timeout keeps waiting on that timer.
+                            if (not in_recovery and base_seq_num in window and base_seq_num not in timed_out
+                                    and (dupacks >= DUPACK_THRESHOLD or sacked >= DUPACK_THRESHOLD)):
+                                if debug:
+                                    log.debug("Fast retransmit of packet %d after %d duplicate ACKs, %d SACKed",
+                                              base_seq_num, dupacks, sacked)
+                                in_recovery = True
+                                recovery_point = next_seq_num
+                                metrics.count('fast_retransmits')
+                                controller.on_enter_recovery(len(window), now)
+                                retransmit(base_seq_num)
+                            if debug:
+                                log.debug("Updated congestion window size: %.2f", controller.cwnd)
 
                             # Calculate throughput every second
-                            current_time = time.time()
-                            if current_time - last_throughput_calc_time >= 1:
-                                throughput = bytes_acked_since_last * 8 / (current_time - last_throughput_calc_time)  # bits per second
-                                throughput_times.append(current_time - start_time)
-                                throughput_values.append(throughput)
+                            if now - last_throughput_calc_time >= 1:
+                                throughput = bytes_acked_since_last * 8 / (now - last_throughput_calc_time)  # bits per second
+                                metrics.record('throughput_bps', throughput)
+                                metrics.observe('throughput_bps', throughput)
                                 bytes_acked_since_last = 0
-                                last_throughput_calc_time = current_time
+                                last_throughput_calc_time = now
 
                             ack_event.set()
-            except socket.timeout:
-                continue
+                finally:
+                    ack_pool.release(buffer)
 
     def establish_connection():
-        # Send SYN packet
-        syn_packet = Packet(PACKET_TYPE_SYN, 0).pack()
-        sock.sendto(syn_packet, receiver_address)
-        print("Sent SYN packet to initiate connection.")
-        sock.settimeout(5)
-        try:
-            packet_bytes, _ = sock.recvfrom(4096)
-            syn_ack_packet = Packet.unpack(packet_bytes)
-            if syn_ack_packet.is_corrupt():
-                print("Received corrupt SYN-ACK packet.")
-                return False
-            if syn_ack_packet.packet_type == PACKET_TYPE_SYN and syn_ack_packet.seq_num == 0:
-                # Send ACK packet
-                ack_packet = Packet(PACKET_TYPE_ACK, 0).pack()
-                sock.sendto(ack_packet, receiver_address)
-                print("Sent ACK packet. Connection established.")
-                return True
-        except socket.timeout:
-            print("Timeout waiting for SYN-ACK.")
-            return False
+        nonlocal checksum_type, rwnd, window_shift
+        # Send SYN packet offering a checksum, plus the size of a file transfer.
+        # The sender receives nothing but ACKs, so its own window scale is 0.
+        options = SYN_OPTIONS.pack(checksum, 0)
+        if transfer_size is not None:
+            options += TRANSFER_HEADER.pack(transfer_size, segment_size)
+        syn_packet = Packet(PACKET_TYPE_SYN, 0, options, CHECKSUM_INET, conn_id).pack()
+        # Resend the SYN, backing off, until a SYN-ACK arrives
+        timeout = TIMEOUT_INTERVAL
+        for attempt in range(SYN_RETRIES):
+            sock.sendto(syn_packet, receiver_address)
+            log.info("Sent SYN packet to initiate connection.")
+            deadline = time.time() + timeout
+            timeout *= 2
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    packet_bytes, _ = sock.recvfrom(4096)
+                except socket.timeout:
+                    break
+                if len(packet_bytes) < HEADER_SIZE:
+                    continue
+                syn_ack_packet = Packet.unpack(packet_bytes)
+                if syn_ack_packet.is_corrupt():
+                    log.info("Received corrupt SYN-ACK packet.")
+                    continue
+                if syn_ack_packet.version != PROTOCOL_VERSION:
+                    log.error("Receiver speaks protocol version %d, not %d.", syn_ack_packet.version, PROTOCOL_VERSION)
+                    return False
+                if (syn_ack_packet.packet_type == PACKET_TYPE_SYN and syn_ack_packet.seq_num == 0
+                        and syn_ack_packet.conn_id == conn_id and len(syn_ack_packet.payload) >= SYN_OPTIONS.size):
+                    # The receiver names the checksum to use and the scale of its window
+                    checksum_type, window_shift = SYN_OPTIONS.unpack_from(syn_ack_packet.payload)
+                    rwnd = syn_ack_packet.window << window_shift
+                    # Send ACK packet; if it is lost, the first data packet completes the handshake
+                    ack_packet = Packet(PACKET_TYPE_ACK, 0, b'', checksum_type, conn_id).pack()
+                    sock.sendto(ack_packet, receiver_address)
+                    log.info("Sent ACK packet. Connection established.")
+                    return True
+            log.warning("Timeout waiting for SYN-ACK.")
         return False
 
     def terminate_connection():
-        # Send FIN packet
-        fin_packet = Packet(PACKET_TYPE_FIN, 0).pack()
-        sock.sendto(fin_packet, receiver_address)
-        print("Sent FIN packet to terminate connection.")
-        sock.settimeout(5)
-        try:
-            packet_bytes, _ = sock.recvfrom(4096)
-            fin_ack_packet = Packet.unpack(packet_bytes)
-            if fin_ack_packet.is_corrupt():
-                print("Received corrupt FIN-ACK packet.")
-                return False
-            if fin_ack_packet.packet_type == PACKET_TYPE_FIN and fin_ack_packet.seq_num == 0:
-                print("Connection terminated gracefully.")
-                return True
-        except socket.timeout:
-            print("Timeout waiting for FIN-ACK.")
-            return False
+        # Send FIN packet, again if no FIN-ACK comes back; late data ACKs that
+        # arrive meanwhile are skipped
+        fin_packet = Packet(PACKET_TYPE_FIN, 0, b'', checksum_type, conn_id).pack()
+        for attempt in range(FIN_RETRIES):
+            sock.sendto(fin_packet, receiver_address)
+            log.info("Sent FIN packet to terminate connection.")
+            deadline = time.time() + max(rtt_estimator.rto, 1.0)
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    packet_bytes, _ = sock.recvfrom(4096)
+                except socket.timeout:
+                    break
+                if len(packet_bytes) < HEADER_SIZE:
+                    continue
+                fin_ack_packet = Packet.unpack(packet_bytes, checksum_type)
+                if fin_ack_packet.is_corrupt():
+                    log.info("Received corrupt FIN-ACK packet.")
+                    continue
+                if (fin_ack_packet.version == PROTOCOL_VERSION and fin_ack_packet.packet_type == PACKET_TYPE_FIN
+                        and fin_ack_packet.seq_num == 0
+                        and fin_ack_packet.conn_id == conn_id):
+                    log.info("Connection terminated gracefully.")
+                    return True
+            log.warning("Timeout waiting for FIN-ACK.")
         return False
 
     if not establish_connection():
-        print("Failed to establish connection with receiver.")
-        return
+        log.error("Failed to establish connection with receiver.")
+        return None
+
+    ack_pool = BufferPool(4096, max_free=BATCH_SIZE)
+    ack_receiver = BatchReceiver(sock, ack_pool)
 
     send_thread = threading.Thread(target=sending_thread)
     ack_thread = threading.Thread(target=ack_receiver_thread)
@@ -235,54 +483,109 @@ def rdt_send(sock, data_segments, receiver_address):
     ack_thread.start()
     send_thread.join()
     ack_thread.join()
+    transfer_time = time.time() - start_time
+    # Drop the last payload view, so a mapped file can be closed
+    outgoing.payload = b''
+    ack_receiver.close()
 
     if not terminate_connection():
-        print("Failed to terminate connection properly.")
-
-    # Plotting Performance Metrics
-    plot_performance_metrics(rtt_values, cwnd_values, cwnd_times, throughput_times, throughput_values)
-
-def plot_performance_metrics(rtt_values, cwnd_values, cwnd_times, throughput_times, throughput_values):
-    import matplotlib.pyplot as plt
-
-    # Plot RTT
-    seq_nums = sorted(rtt_values.keys())
-    rtt_list = [rtt_values[seq_num]*1000 for seq_num in seq_nums]  # Convert to milliseconds
-    plt.figure()
-    plt.plot(seq_nums, rtt_list, marker='o')
-    plt.xlabel('Packet Sequence Number')
-    plt.ylabel('RTT (ms)')
-    plt.title('RTT for Each Packet')
-    plt.grid(True)
-    plt.savefig('latency_plot.png')
-    plt.close()
-
-    # Plot Congestion Window
-    plt.figure()
-    plt.plot(cwnd_times, cwnd_values, marker='o')
-    plt.xlabel('Time (s)')
-    plt.ylabel('Congestion Window Size (packets)')
-    plt.title('Congestion Window Over Time')
-    plt.grid(True)
-    plt.savefig('cwnd_plot.png')
-    plt.close()
-
-    # Plot Throughput
-    plt.figure()
-    plt.plot(throughput_times, throughput_values, marker='o')
-    plt.xlabel('Time (s)')
-    plt.ylabel('Throughput (bps)')
-    plt.title('Throughput Over Time')
-    plt.grid(True)
-    plt.savefig('throughput_plot.png')
-    plt.close()
+        log.error("Failed to terminate connection properly.")
+
+    retransmissions = metrics.counter('retransmissions')
+    log.info("Final RTO %.1f ms, %d retransmissions (%d fast), %d window probes, congestion control %s",
+             rtt_estimator.rto * 1000, retransmissions, metrics.counter('fast_retransmits'),
+             metrics.counter('window_probes'), controller.name)
+    snapshot = metrics.snapshot()
+
+    # Plotting Performance Metrics, only when asked for: matplotlib is slow to import
+    if plot:
+        from plot_metrics import plot_snapshot
+        plot_snapshot(snapshot)
+
+    # The series are the most recent samples, at most the ring capacity of each
+    rtt_samples = metrics.samples('rtt_ms')
+    cwnd_samples = metrics.samples('cwnd')
+    throughput_samples = metrics.samples('throughput_bps')
+    rto_samples = metrics.samples('rto_ms')
+    return {
+        'rtt_values': {seq_num: rtt / 1000 for seq_num, rtt in rtt_samples},
+        'cwnd_times': [t for t, _ in cwnd_samples],
+        'cwnd_values': [cwnd for _, cwnd in cwnd_samples],
+        'throughput_times': [t for t, _ in throughput_samples],
+        'throughput_values': [throughput for _, throughput in throughput_samples],
+        'rto_times': [t for t, _ in rto_samples],
+        'rto_values': [rto / 1000 for _, rto in rto_samples],
+        'srtt': rtt_estimator.srtt,
+        'rttvar': rtt_estimator.rttvar,
+        'rto': rtt_estimator.rto,
+        'retransmissions': retransmissions,
+        'fast_retransmits': metrics.counter('fast_retransmits'),
+        'window_probes': metrics.counter('window_probes'),
+        'congestion_control': controller.name,
+        'transfer_time': transfer_time,   # Until the last data ACK, without the teardown
+        'duration': time.time() - start_time,
+        'metrics': snapshot,
+    }
+
+# Function to send a file. The file is memory-mapped and cut into segment_size
+# payloads lazily, so it is never read into memory as a whole.
+def send_file(sock, path, receiver_address, segment_size=SEGMENT_SIZE, **kwargs):
+    if not 0 < segment_size <= MAX_PAYLOAD_SIZE:
+        raise ValueError(f"segment_size must be between 1 and {MAX_PAYLOAD_SIZE} bytes")
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        # mmap can't map an empty file
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        segments = Segments(buffer, segment_size)
+        try:
+            return rdt_send(sock, segments, receiver_address, transfer_size=size,
+                            segment_size=segment_size, **kwargs)
+        finally:
+            segments.release()
+            if size:
+                buffer.close()
 
 if __name__ == "__main__":
-    receiver_addr = ('localhost', 12345)
+    parser = argparse.ArgumentParser(description="RDT sender")
+    parser.add_argument('--cc', choices=sorted(CONTROLLERS), default='newreno',
+                        help="congestion controller")
+    parser.add_argument('--checksum', choices=sorted(CHECKSUM_NAMES), default='crc32',
+                        help="checksum offered to the receiver")
+    parser.add_argument('--rcvbuf', type=int, default=SOCKET_RCVBUF, help="SO_RCVBUF in bytes")
+    parser.add_argument('--sndbuf', type=int, default=SOCKET_SNDBUF, help="SO_SNDBUF in bytes")
+    parser.add_argument('--file', help="send this file instead of the demo messages")
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE,
+                        help="payload bytes per packet for --file")
+    parser.add_argument('--receiver', default='localhost:12345',
+                        help="host:port of the receiver, or of a netem.py relay in front of it")
+    parser.add_argument('--seed', type=int, help="seed the simulated loss and corruption")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='info',
+                        help="debug logs every packet event")
+    parser.add_argument('--metrics', help="write the metrics to this .json or .csv file")
+    parser.add_argument('--stats-port', type=int, help="serve live metrics as JSON on this local TCP port")
+    parser.add_argument('--plot', action='store_true', help="plot the metrics to PNG files (needs matplotlib)")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+
+    host, _, port = args.receiver.rpartition(':')
+    receiver_addr = (host or 'localhost', int(port))
+    if args.seed is not None:
+        random.seed(args.seed)
     sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    # Prepare the data segments to send
-    messages = [f"Message part {i}" for i in range(1, 100)]
-
-    rdt_send(sender_socket, messages, receiver_addr)
+    metrics = Metrics()
+    stats_server = StatsServer(metrics.snapshot, args.stats_port) if args.stats_port else None
+
+    options = dict(congestion_control=args.cc, checksum=CHECKSUM_NAMES[args.checksum], rcvbuf=args.rcvbuf,
+                   sndbuf=args.sndbuf, plot=args.plot, metrics=metrics)
+    if args.file:
+        send_file(sender_socket, args.file, receiver_addr, args.segment_size, **options)
+    else:
+        # Prepare the data segments to send
+        messages = [f"Message part {i}".encode() for i in range(1, 100)]
+        rdt_send(sender_socket, messages, receiver_addr, **options)
     sender_socket.close()
+    if args.metrics:
+        export(metrics.snapshot(), args.metrics)
+    if stats_server is not None:
+        stats_server.close()
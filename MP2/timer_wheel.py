@@ -0,0 +1,122 @@
+# timer_wheel.py
+
+import logging
+import threading
+import time
+
+# Defaults
+TICK_INTERVAL = 0.01      # Timer resolution in seconds
+WHEEL_SLOTS = 512         # One turn of the wheel covers WHEEL_SLOTS * TICK_INTERVAL seconds
+
+log = logging.getLogger('rdt.timers')
+
+# Hashed timing wheel: a ring of slots, each holding the timers that expire when
+# the wheel's hand reaches it. Timers further away than one turn wait there for
+# the extra rounds. One thread advances the hand every tick and runs the
+# callbacks that are due, so any number of pending timers costs one thread.
+#
+# arm() and cancel() are O(1): a timer is stored under its key in the dict for
+# its slot, and the key's slot is remembered for cancelling. Every timer has its
+# own delay, so each flow can use its own retransmission timeout.
+class TimerWheel:
+    def __init__(self, tick_interval=TICK_INTERVAL, slots=WHEEL_SLOTS):
+        self.tick_interval = tick_interval
+        self.slots = [{} for _ in range(slots)]   # key -> [rounds, callback, args]
+        self.slot_of = {}                         # key -> index of its slot
+        self.current_tick = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+        self.running = False
+
+    # Function to schedule callback(*args) after delay seconds; re-arming a key
+    # replaces its pending timer
+    def arm(self, key, delay, callback, *args):
+        ticks = max(1, int(round(delay / self.tick_interval)))
+        with self.lock:
+            self.remove(key)
+            target_tick = self.current_tick + ticks
+            index = target_tick % len(self.slots)
+            # The hand has to pass the slot this many more times before it fires
+            rounds = (ticks - 1) // len(self.slots)
+            self.slots[index][key] = [rounds, callback, args]
+            self.slot_of[key] = index
+            if not self.running:
+                self.start()
+            self.wakeup.notify()
+
+    # Function to cancel a pending timer; returns False if it was not pending
+    def cancel(self, key):
+        with self.lock:
+            return self.remove(key)
+
+    # Function to drop a timer (caller holds the lock)
+    def remove(self, key):
+        index = self.slot_of.pop(key, None)
+        if index is None:
+            return False
+        del self.slots[index][key]
+        return True
+
+    # Number of timers waiting to fire
+    def pending(self):
+        with self.lock:
+            return len(self.slot_of)
+
+    # Function to start the thread that drives the wheel (caller holds the lock)
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Function to stop the driver thread; pending timers are dropped
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for slot in self.slots:
+                slot.clear()
+            self.slot_of.clear()
+            self.wakeup.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        next_tick_time = time.monotonic() + self.tick_interval
+        while True:
+            with self.lock:
+                # Sleep until a timer is armed instead of ticking an empty wheel
+                if not self.slot_of:
+                    while self.running and not self.slot_of:
+                        self.wakeup.wait()
+                    next_tick_time = time.monotonic() + self.tick_interval
+                if not self.running:
+                    return
+
+            delay = next_tick_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Advance one slot per elapsed tick, catching up if the thread was late
+            due = []
+            with self.lock:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                while next_tick_time <= now:
+                    self.current_tick += 1
+                    next_tick_time += self.tick_interval
+                    slot = self.slots[self.current_tick % len(self.slots)]
+                    for key, timer in list(slot.items()):
+                        if timer[0] > 0:
+                            timer[0] -= 1
+                        else:
+                            del slot[key]
+                            del self.slot_of[key]
+                            due.append(timer)
+
+            # Callbacks run without the wheel's lock, so they may arm or cancel timers
+            for _, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    log.error("Timer callback failed: %s", e)